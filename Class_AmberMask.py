@@ -0,0 +1,277 @@
+import re
+from fnmatch import fnmatchcase
+import numpy as np
+__doc__='''
+This module compile Amber atom masks and evaluate them on a Structure object.
+-------------------------------------------------------------------------------------
+Class AmberMask
+-------------------------------------------------------------------------------------
+Grammar (https://amberhub.chpc.utah.edu/atom-mask-selection-syntax/)
+    :{residue list}     residue id / id range / name (wildcard * and ? are supported)   e.g.: :1-10,15,LIG
+    @{atom list}        atom id / id range / name                                       e.g.: @CA,C,N  @1-100
+    @/{element list}    element                                                         e.g.: @/C,N
+    @%{type list}       Amber atom type (requires atom.type. e.g.: from Structure.get_atom_type)
+    :{...}@{...}        atoms match both                                                e.g.: :1-10@CA
+    *                   all atoms
+    !  &  |  ( )        not, and, or, grouping (priority: ! > & > |)
+    {mask}<:{r}         residues with any atom within r Angstrom of {mask}              e.g.: :LIG<:5.0
+    {mask}<@{r}         atoms within r Angstrom of {mask}
+    {mask}>:{r} {mask}>@{r}     complement of the above
+Residue ids are resi.id of the residue units in the structure (metalatom use its own id).
+Atom ids are atom.id.
+===============
+'''
+
+class AmberMask():
+    '''
+    a compiled Amber mask
+    -------------
+    AmberMask(mask_str)
+    AmberMask.compile(mask_str) (cached by the mask str)
+    -------------
+    mask_str
+    tree: nested tuples from the parser
+        ('all',) ('sele', res_items, atom_items) ('not', node) ('and', node, node) ('or', node, node)
+        ('dist', node, '<' or '>', ':' or '@', cutoff)
+    -------------
+    Method
+    -------------
+    eval(stru): return a bool array over atoms of the structure. (in the order of stru.coords)
+    get_atoms(stru)
+    get_atom_ids(stru)
+    '''
+
+    _cache = {}
+    _token_pattern = re.compile(r'\s*(?:([()&|!])|([<>][:@][0-9.]+)|(\*)|([:@][^\s()&|!<>]*))')
+
+    def __init__(self, mask_str: str):
+        self.mask_str = mask_str
+        self._tokens = self._tokenize(mask_str)
+        self._pos = 0
+        self.tree = self._parse_or()
+        if self._pos != len(self._tokens):
+            raise Exception('AmberMask: unexpected token '+repr(self._tokens[self._pos][1])+' in mask: '+mask_str)
+        del self._tokens
+
+    @classmethod
+    def compile(cls, mask_str: str):
+        '''
+        compile a mask (reuse the compiled one for a same mask str)
+        '''
+        if mask_str not in cls._cache:
+            cls._cache[mask_str] = cls(mask_str)
+        return cls._cache[mask_str]
+
+    '''
+    ====
+    Parser
+    ====
+    '''
+    @classmethod
+    def _tokenize(cls, mask_str):
+        '''
+        return a list of (kind, text). kind: op, dist, all, sele
+        '''
+        tokens = []
+        pos = 0
+        mask_str = mask_str.rstrip()
+        while pos < len(mask_str):
+            match = cls._token_pattern.match(mask_str, pos)
+            if match is None or match.end() == pos:
+                raise Exception('AmberMask: cannot decode mask: '+mask_str+' (at: '+mask_str[pos:]+')')
+            op, dist, all_, sele = match.groups()
+            if op:
+                tokens.append(('op', op))
+            if dist:
+                tokens.append(('dist', dist))
+            if all_:
+                tokens.append(('all', all_))
+            if sele:
+                tokens.append(('sele', sele))
+            pos = match.end()
+        if not tokens:
+            raise Exception('AmberMask: empty mask')
+        return tokens
+
+    def _peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self._pos += 1
+        return token
+
+    def _parse_or(self):
+        node = self._parse_and()
+        while self._peek() == ('op', '|'):
+            self._next()
+            node = ('or', node, self._parse_and())
+        return node
+
+    def _parse_and(self):
+        node = self._parse_not()
+        while self._peek() == ('op', '&'):
+            self._next()
+            node = ('and', node, self._parse_not())
+        return node
+
+    def _parse_not(self):
+        if self._peek() == ('op', '!'):
+            self._next()
+            return ('not', self._parse_not())
+        return self._parse_dist()
+
+    def _parse_dist(self):
+        node = self._parse_primary()
+        while self._peek()[0] == 'dist':
+            text = self._next()[1]
+            node = ('dist', node, text[0], text[1], float(text[2:]))
+        return node
+
+    def _parse_primary(self):
+        kind, text = self._next()
+        if kind == 'op' and text == '(':
+            node = self._parse_or()
+            if self._next() != ('op', ')'):
+                raise Exception('AmberMask: missing ) in mask: '+self.mask_str)
+            return node
+        if kind == 'all':
+            return ('all',)
+        if kind == 'sele':
+            return self._parse_sele(text)
+        raise Exception('AmberMask: unexpected token '+repr(text)+' in mask: '+self.mask_str)
+
+    def _parse_sele(self, text):
+        '''
+        :res_list@atom_list -> ('sele', res_items, atom_items)
+        items: [('id', start, end) | ('name', pattern) | ('ele', pattern) | ('type', pattern), ...] (None for no restriction)
+        '''
+        res_items = None
+        atom_items = None
+        if text[0] == ':':
+            res_part, _, atom_part = text[1:].partition('@')
+            res_items = self._parse_items(res_part)
+            if '@' in text:
+                atom_items = self._parse_items(atom_part, if_atom=1)
+        else:
+            atom_items = self._parse_items(text[1:], if_atom=1)
+        return ('sele', res_items, atom_items)
+
+    def _parse_items(self, text, if_atom=0):
+        kind = 'name'
+        if if_atom and text[:1] in ('/', '%'):
+            kind = {'/': 'ele', '%': 'type'}[text[0]]
+            text = text[1:]
+        items = []
+        for item in text.split(','):
+            item = item.strip()
+            if item == '':
+                raise Exception('AmberMask: empty item in mask: '+self.mask_str)
+            if kind == 'name' and re.fullmatch(r'[0-9]+', item):
+                items.append(('id', int(item), int(item)))
+            elif kind == 'name' and re.fullmatch(r'[0-9]+-[0-9]+', item):
+                start, end = item.split('-')
+                items.append(('id', int(start), int(end)))
+            else:
+                items.append((kind, item))
+        return items
+
+    '''
+    ====
+    Evaluation
+    ====
+    '''
+    def eval(self, stru):
+        '''
+        evaluate the mask on the structure
+        return a bool array over atoms in the order of stru.coords
+        '''
+        return self._eval_node(self.tree, stru)
+
+    def get_atoms(self, stru):
+        '''
+        return the list of selected atoms (in the order of stru.coords)
+        '''
+        atoms = stru.get_atoms()
+        return [atoms[i] for i in np.flatnonzero(self.eval(stru))]
+
+    def get_atom_ids(self, stru):
+        '''
+        return the list of selected atom ids (in the order of stru.coords)
+        '''
+        return stru.get_atom_column('atom_id')[self.eval(stru)].tolist()
+
+    def _eval_node(self, node, stru):
+        op = node[0]
+        if op == 'all':
+            return np.ones(len(stru.coords), dtype=bool)
+        if op == 'not':
+            return ~self._eval_node(node[1], stru)
+        if op == 'and':
+            return self._eval_node(node[1], stru) & self._eval_node(node[2], stru)
+        if op == 'or':
+            return self._eval_node(node[1], stru) | self._eval_node(node[2], stru)
+        if op == 'sele':
+            return self._eval_sele(node[1], node[2], stru)
+        if op == 'dist':
+            return self._eval_dist(node, stru)
+        raise Exception('AmberMask: bad node: '+repr(node))
+
+    def _eval_sele(self, res_items, atom_items, stru):
+        n_atom = len(stru.coords)
+        result = np.ones(n_atom, dtype=bool)
+        if res_items is not None:
+            resi_index = stru.get_atom_column('resi_index')
+            resi_mask = self._match_items(res_items, stru.get_resi_column('id'), stru.get_resi_column('name'), None)
+            result &= resi_mask[resi_index]
+        if atom_items is not None:
+            if atom_items[0][0] == 'ele':
+                result &= self._match_items(atom_items, None, None, stru.get_atom_column('ele'))
+            elif atom_items[0][0] == 'type':
+                result &= self._match_items(atom_items, None, None, stru.get_atom_column('type'))
+            else:
+                result &= self._match_items(atom_items, stru.get_atom_column('atom_id'), stru.get_atom_column('atom_name'), None)
+        return result
+
+    @staticmethod
+    def _match_items(items, ids, names, labels):
+        '''
+        match a list of items with the id/name/label (ele, type) arrays
+        '''
+        size = len(ids) if ids is not None else len(labels) if labels is not None else len(names)
+        result = np.zeros(size, dtype=bool)
+        for item in items:
+            kind = item[0]
+            if kind == 'id':
+                result |= (ids >= item[1]) & (ids <= item[2])
+                continue
+            values = names if kind == 'name' else labels
+            pattern = item[1]
+            if '*' in pattern or '?' in pattern:
+                uni_values = np.unique(values)
+                hits = [v for v in uni_values.tolist() if fnmatchcase(v, pattern)]
+                result |= np.isin(values, hits)
+            else:
+                result |= values == pattern
+        return result
+
+    def _eval_dist(self, node, stru):
+        '''
+        {mask}<:r / {mask}<@r and the complement with >
+        '''
+        _, sub_node, direction, level, cutoff = node
+        center_mask = self._eval_node(sub_node, stru)
+        in_range = stru.get_atoms_within(np.flatnonzero(center_mask), cutoff)
+        if level == ':':
+            resi_index = stru.get_atom_column('resi_index')
+            resi_in_range = np.zeros(len(stru.get_resi_column('id')), dtype=bool)
+            resi_in_range[resi_index[in_range]] = True
+            in_range = resi_in_range[resi_index]
+        if direction == '>':
+            return ~in_range
+        return in_range
+
+    def __repr__(self):
+        return 'AmberMask('+repr(self.mask_str)+')'
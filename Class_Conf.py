@@ -11,6 +11,8 @@ Config --- Amber
 import os
 from time import strftime, localtime
 import re
+import numpy as np
+from Class_AmberMask import AmberMask
 
 
 class Config:
@@ -51,6 +53,12 @@ class Config:
     # place to hold all submitted job id in current run
     # 
     JOB_ID_LOG_PATH = '' # default (job_obj.sub_dir/submitted_job_ids.log)
+    # -----------------------------
+    # on-disk cache of parsed structures (Structure.fromPDB with a cache_path, e.g.: PDB.get_stru)
+    # 0: off 1: on
+    stru_cache = 0
+    # size cap of the cache folder in MB. Least recently used files are removed beyond it.
+    stru_cache_size = 500
 
     
     # >>>>>> Software <<<<<<
@@ -436,6 +444,8 @@ class Config:
         # preset: 0: no preset (fill layer atom manually) 1: preset_1 -> xxx
         layer_preset = 0
         layer_atoms = []
+        # radius (Angstrom) around the substrate for preset 4
+        layer_radius = 5.0
 
 
     class Multiwfn:
@@ -467,6 +477,8 @@ class Layer:
 	def __init__(self, PDB_obj, atom_lists, if_set=0):
 		'''
 		general way to assign layer: list of atom indexes
+		atom_lists: list of str for each layer. e.g.: ['1-9,11', '12-L']
+					a str starts with : @ ! ( * is decoded as an Amber mask. e.g.: [':FAH<:5.0', '*']
 		'''
 		self.PDB = PDB_obj
 		if not if_set:
@@ -476,6 +488,11 @@ class Layer:
 				raise Exception('Layer.__init__: only support 2 or 3 layers. Input layers: '+str(len(atom_lists)))
 				
 			for layer in atom_lists:
+				if layer.strip()[:1] in (':', '@', '!', '(', '*'):
+					# Amber mask. e.g.: :FAH<:5.0
+					PDB_obj.get_stru()
+					self.layer.append(sorted(AmberMask.compile(layer).get_atom_ids(PDB_obj.stru)))
+					continue
 				atoms = []
 				for atom_str in layer.split(','):
 					if '-' in atom_str:
@@ -502,7 +519,7 @@ class Layer:
 									
 	
 	@classmethod
-	def preset(cls, PDB_obj, set_id, lig_list=[]):
+	def preset(cls, PDB_obj, set_id, lig_list=[], radius=None):
 		'''
 		preset layer settings for ONIOM
                 ------------
@@ -513,7 +530,9 @@ class Layer:
 			3: Substrate and key residues (manually assigned)
 			4: Substrate and all residues/ligands within a assigned radius (Need to keep consistant molecular number)
 			5: Based on some parameters to select the QM region
-		lig_list: (set_id = 2) key ligand index
+		lig_list: (set_id = 2, 4) key ligand index or name
+		radius: (set_id = 4) residues/ligands with any atom within the radius (Angstrom) of the key ligands
+				are included in the high layer as a whole. (default: Config.Gaussian.layer_radius)
 		'''
 		layer_atoms = []
 		PDB_obj.get_stru()
@@ -526,7 +545,7 @@ class Layer:
 			# TODO: connect with the database and recognize the substrate in the future
 			pass
 
-		if set_id == 2:
+		if set_id in (2, 4):
 			if lig_list == []:
 				h_atoms=[]
 				lig_names = []
@@ -537,7 +556,7 @@ class Layer:
 				layer_atoms.append(h_atoms)
 				# log
 				if Config.debug >= 1:
-					print('Layer.preset(set_id=2): No id in lig_list, set all ligands to high layer by default')
+					print('Layer.preset(set_id='+str(set_id)+'): No id in lig_list, set all ligands to high layer by default')
 					print(' '.join(lig_names))
 			else:
 				h_atoms=[]
@@ -553,6 +572,9 @@ class Layer:
 								for atom in lig:
 									h_atoms.append(atom.id)
 
+			if set_id == 4:
+				h_atoms = cls._get_atoms_in_radius(stru, h_atoms, radius)
+
 			l_atoms = list(set(stru.get_atom_id()).difference(set(h_atoms)))
 
 			#debug
@@ -573,6 +595,27 @@ class Layer:
 		
 		return cls(PDB_obj, layer_atoms, if_set=1)
 
+	@staticmethod
+	def _get_atoms_in_radius(stru, center_atoms, radius=None):
+		'''
+		return sorted ids of atoms in residue units (solvent excluded) that have any atom within radius of center_atoms
+		center_atoms: list of atom ids
+		'''
+		if radius is None:
+			radius = Config.Gaussian.layer_radius
+		atom_ids = stru.get_atom_column('atom_id')
+		resi_index = stru.get_atom_column('resi_index')
+		center_index = np.flatnonzero(np.isin(atom_ids, center_atoms))
+		if_in = stru.get_atoms_within(center_index, radius)
+		# expand to whole residue units
+		if_resi_in = np.zeros(len(stru.get_resi_column('id')), dtype=bool)
+		if_resi_in[resi_index[if_in]] = True
+		if_resi_in &= stru.get_resi_column('kind') != 3
+		if_resi_in[resi_index[center_index]] = True
+		if Config.debug >= 1:
+			print('Layer.preset(set_id=4): '+str(int(if_resi_in.sum()))+' residue units within '+str(radius)+' A')
+		return sorted(atom_ids[if_resi_in[resi_index]].tolist())
+
 
 	'''
 	====
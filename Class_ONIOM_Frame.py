@@ -3,12 +3,17 @@
 - need all files in operation share a **same** atomic/coordinate order !!
 Usage:
 1. Obtain the coordinate
-    - from .mdcrd file:  coords = Frame.fromMDCrd(path)  // return a list of all frames in the mdcrd file. You may want to use cpptraj to sample the wanted frame into the file
+    - from .mdcrd file:  coords = Frame.fromMDCrd(path, prmtop_path=...)  // return a list of all frames in the mdcrd file. You may want to use cpptraj to sample the wanted frame into the file
+    - from .nc file:     coords = Frame.fromNC(path, start=1, end=-1, step=1)  // return a list of the sampled frames in the NetCDF file (read directly)
+    - lazily:            frames = FrameSet(path, n_atom=None) // a sequence of frames in a .mdcrd/.nc/.npy file that are only read when used (bounded memory)
+    - by chunks:         for coords in iter_frame_chunks(frames, window=None) // (n, n_atom, 3) arrays of a FrameSet, a list of Frame or an array of frames
     - from Gaussian output file: coord = Frame.fromGaussinOut(path) // return the last point of the gaussian opt/freq
+                                 coords = getOrientations(path, every=1) // return a (n_step, n_atom, 3) array of all (or every k-th) steps
 2. (optional) shift some orders of the coordinate
     - frame.shift_line(shift_list) // shift_list is a list of (l1, l2): l1 is the moving line, l2 is the line before the target position. *l2 cannot be same as any l1 in the list.
 3. combine the coordinate with the template
     - write_to_template(template_path, frame_obj) // Use out_path and index to customize the output filename and path.
+    - ONIOMTemplate.fromPath(template_path).write_frames(frames) // parse the template once and write all frames (n_proc for parallel)
 -----------------
 4. select and write a visible file
     select:
@@ -16,6 +21,7 @@ Usage:
     - Frame.sele_high(g_file) // return a dict of select infomation (index : atom_name)
     write:
     - frame.write_sele_lines(self, sele_list, out_path='sele_coord.'+ff, ff='gjf')
+    - QMSelection(sele_list).write_frames(frames, out_path, ...) // decode the sele list once and write all frames (coordinates of all frames in one array expression)
 -----------------
 5. Read Frequencies
     - getFreq(g_out_file) // return a list of frequence numbers
@@ -23,9 +29,14 @@ Usage:
 '''
 import numpy as np
 from Class_Conf import Config
+from Class_Prmtop import Prmtop
+from Class_Traj import open_traj, read_mdcrd, read_nc, take_frames
 from helper import line_feed, set_distance
+import copy
+import mmap
 import re
 import os
+from multiprocessing import Pool
 
 # In gjf: 
 #   pattern for determining the beginning of the coordinate (strip)
@@ -34,13 +45,11 @@ ChrgSpin_pattern = r'(?: ?\-?\+?[0-9] [0-9])+'
 unfreeze_pattern = r'[A-z,\-,0-9,\.]+ +0 '
 #   pattern for high layer atoms
 high_pattern = r'[0-9]+ +H'
-# In mdcrd: 
-#   pattern for determining the end of a old frame (no strip)
-digit_pattern = r'[ ,\-,0-9][ ,\-,0-9][ ,\-,0-9][0-9]\.[0-9][0-9][0-9]'
-frame_sep_pattern = digit_pattern * 3 + line_feed
 # In log/out:
 #   pattern for determining the position of frequencies
 freq_pattern = r'Frequencies'
+#   mark of the coordinate of each step
+orientation_mark = b'Input orientation:'
 
 
 
@@ -55,133 +64,51 @@ class Frame:
 
     def __init__(self, coord):
         '''
-        coord: a 2D list of coordinate of each atom [[x,y,z],...]
+        coord: a 2D list or (N, 3) array of coordinate of each atom [[x,y,z],...]
         '''
         self.coord = coord
 
     @classmethod
-    def fromMDCrd(cls, mdcrd_file):
+    def fromMDCrd(cls, mdcrd_file, n_atom=None, prmtop_path=None):
         '''
         read a list of coordinates for frames
+        n_atom     : number of atoms in a frame. (or from the prmtop_path)
+                     Inferred from the file if neither is provided. (see Class_Traj.read_mdcrd)
         -------
-        return a list of Frame object
+        return a list of Frame object. (frame.coord is a (n_atom, 3) view of one array of all frames)
         '''
-        coords = []
-        coord = []
-        atom_coord = []
-        counter = 1
-        end_flag_1 = 0
-        fake_end_flag = 0
-        #os.system('echo >> '+mdcrd_file)
-        debug_counter = 0
-
-        with open(mdcrd_file) as f:
-            while True:
-                # use the while True format to detect the EOF
-                line=f.readline()            
-
-                if re.match(digit_pattern, line) == None:
-                    # not data line // could be faster here
-                    if not end_flag_1 and not fake_end_flag:
-                        continue
-                
-                if fake_end_flag:
-                    # if next line of fake end is the file end 
-                    if line == '':
-                        break
-
-                if end_flag_1:
-                    debug_counter += 1
-                    if re.match(frame_sep_pattern, line) != None:
-                        # last line is a fake end line
-                        coord.append(holder)
-                        coords.append(cls(coord))
-                        # empty for next loop
-                        coord = []
-                        end_flag_1 = 0
-                        fake_end_flag = 1
-                        continue
-                    else:                        
-                        # last line is a real end line
-                        coords.append(cls(coord))
-                        # empty for next loop
-                        coord = []
-                        end_flag_1 = 0
-                        if line == '':
-                            #the last line
-                            break
-                        if line == line_feed:
-                            if Config.debug >= 1:
-                                print("Frame.fromMDCrd: WARNING: unexpected empty line detected. Treat as EOF. exit reading")
-                            break
-                        # do not skip if normal next line
-
-                else:
-                    if re.match(frame_sep_pattern, line) != None:
-                        # find line that mark the end of a frame // possible fake line
-                        # store the last frame and empty the holder
-                        end_flag_1 = 1 
-                        lp = re.split(' +', line.strip())
-                        # hold the info
-                        holder = [float(lp[0]), float(lp[1]), float(lp[2])]
-                        continue
-                
+        if n_atom is None and prmtop_path is not None:
+            n_atom = Prmtop.fromPath(prmtop_path).get_n_atom()
+        return [cls(coord) for coord in read_mdcrd(mdcrd_file, n_atom=n_atom)]
 
-                # normal data lines
-                lp = re.split(' +', line.strip())
-                for i in lp:
-                    if counter < 3:
-                        atom_coord.append(float(i))
-                        counter = counter + 1
-                    else:
-                        atom_coord.append(float(i))
-                        coord.append(atom_coord)
-                        # empty for next atom
-                        atom_coord = []        
-                        counter = 1
-        return coords
+    @classmethod
+    def fromNC(cls, nc_file, start=1, end=-1, step=1, atom_index=None):
+        '''
+        read a list of coordinates for sampled frames of a NetCDF trajectory (without converting to mdcrd)
+        start, end, step: 1-based frame range with end included (same as trajin of cpptraj)
+        atom_index      : 0-based index of atoms to read (all atoms by default)
+        -------
+        return a list of Frame object
+        '''
+        return [cls(coord) for coord in read_nc(nc_file, start=start, end=end, step=step, atom_index=atom_index)]
 
     @classmethod
     def fromGaussinOut(cls, g_out_file):
         '''
         get last step from the Gaussian out file, according to the Input orientation
+        The file is memory-mapped and only the last block (found by a reverse search) is parsed.
+        (see getOrientations for all steps)
         '''
-        coord = []
-        f_counter = 0
-        f_counter_2 = 0
-        coord_flag = 0
-        skip4 = 0
-        with open(g_out_file) as f:
-            # get where is the last 'Input orientation:' mark by count the number
-            for line in f:
-                if line.strip() == 'Input orientation:':
-                    f_counter = f_counter + 1
-
-        # reopen to avoid the mem problem
-        with open(g_out_file) as f:
-            # get the last part based on the count
-            for line in f:
-                if line.strip() == 'Input orientation:':
-                    f_counter_2 = f_counter_2 + 1
-                    if f_counter_2 == f_counter:
-                        #here is the last frame
-                        coord_flag = 1
-                
-                if coord_flag:
-                    # skip 4 title lines
-                    if skip4 <= 4:
-                        skip4 = skip4 + 1
-                        continue
-                    # detect end of the coord section
-                    if line.strip() == '---------------------------------------------------------------------':
-                        coord_flag = 0
-                        break
-
-                    lp = line.strip().split()
-                    atom_coord = [float(lp[3]), float(lp[4]), float(lp[5])]
-                    coord.append(atom_coord)
-        
-        return cls(coord)
+        if os.path.getsize(g_out_file) == 0:
+            return cls(np.zeros((0, 3)))
+        with open(g_out_file, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = mm.rfind(orientation_mark)
+                if pos < 0:
+                    if Config.debug >= 1:
+                        print('Frame.fromGaussinOut: WARNING: no Input orientation in '+g_out_file)
+                    return cls(np.zeros((0, 3)))
+                return cls(_read_orientation(mm, pos))
 
 
     def shift_line(self, shift_list):
@@ -218,6 +145,7 @@ class Frame:
         '''
         1. find the beginning and ending of the coordinate section.
         2. replace coordinate based on the same atom sequence.
+        (the template is parsed once per file. see ONIOMTemplate to write many frames)
         ------
         write to out_path
         '''
@@ -226,56 +154,7 @@ class Frame:
         if index != None:
             out_path = out_path[:-4]+'_'+index+'.gjf'
         chk_path = out_path[:-3]+'chk'
-        
-        with open(t_file_path) as f:
-            with open(out_path,'w') as of:
-                coord_b_flag = 0
-                coord_e_flag = 0
-                coord_index = 0
-                for line in f:
-                    
-                    if re.search('chk_place_holder', line.strip()) != None:
-                        if ifchk:
-                            of.write(r'%chk='+chk_path + line_feed)
-                            continue
-                        else:
-                            continue
-
-                    if re.match(ChrgSpin_pattern, line.strip()) != None:
-                        coord_b_flag = 1
-                        of.write(line)
-                        continue
-                    
-                    # end when a space line appears
-                    if coord_b_flag:
-                        if line == line_feed:
-                            coord_e_flag = 1
-
-                    if coord_b_flag and not coord_e_flag:
-                        # line part
-                        lp = line.strip().split()
-                        line_coord = self.coord[coord_index]
-                        
-                        # potential *CHANGE* here about where coord is in a line
-                        label = '{:<20}'.format(lp[0])
-                        freeze_mark = '{:<3}'.format(lp[1])
-                        x = '{:>15.8f}'.format(line_coord[0])
-                        y = '{:>15.8f}'.format(line_coord[1])
-                        z = '{:>15.8f}'.format(line_coord[2])
-                        layer_mark = lp[5]
-
-                        new_line = ' '+label+' '+freeze_mark+x+y+z+' '+layer_mark
-
-                        if len(lp) > 6:
-                            new_line = new_line + ' ' + lp[6] + ' ' + lp[7]
-                        new_line = new_line + line_feed
-
-                        of.write(new_line)
-                        coord_index = coord_index+1
-                        continue
-                    
-                    of.write(line)
-                    
+        ONIOMTemplate.fromPath(t_file_path).write(self.coord, out_path, chk_path=chk_path if ifchk else None)
         if ifchk:
             return out_path, chk_path
 
@@ -288,61 +167,15 @@ class Frame:
         --------
         obtain atomic info externally. Mimic the Amber prmtop strategy ---> only have the minimium atomic info
         TODO: Any meaning to require a map form of sele_list? instead of a list.
+        (the sele list is compiled to a QMSelection. Use QMSelection.write_frames for many frames)
         '''
         if out_path == None:
             out_path ='sele_coord.'+ff
-        if ifchk:
-            chk_path = out_path[:-len(ff)]+'chk'
-
-        sele_lines = []
-        for sele in sele_list.keys():
-            # decode val fix atoms
-            if '-' in sele:
-                ele_name = sele_list[sele]
-                fix_info = sele.split('-')
-                fix_val_coord = self._get_fix_val_coord(fix_info[0], fix_info[1], fix_info[2])
-                sele_lines.append((ele_name, fix_val_coord))
-                continue
-
-            # get coord for normal atoms
-            # clean up
-            if sele[-1] not in '1234567890':
-                sele_id = sele[:-1]
-            else:
-                sele_id = sele 
-            # get coord
-            sele_lines.append((sele_list[sele], self.coord[int(sele_id)-1]))
-        
+        chk_path = out_path[:-len(ff)]+'chk' if ifchk else None
+        sele = QMSelection.compile(sele_list)
+        text = sele.render(self.coord, g_route, g_cores, g_mem_cores, ff=ff, chrgspin=chrgspin, chk_path=chk_path)
         with open(out_path, 'w') as of:
-            if ff != 'xyz' and ff != 'gjf':
-                raise Exception('only support xyz and gjf format now')
-            if ff == 'xyz':
-                of.write(str(len(sele_list.keys()))+line_feed)
-            if ff == 'gjf':
-                if ifchk:
-                    of.write(r'%chk='+chk_path+line_feed)
-                of.write(f'%mem={int(g_cores)*int(g_mem_cores)-1000}MB{line_feed}') # left 1000MB for outer usage
-                of.write(f'%nprocshared={g_cores}{line_feed}')
-                of.write(g_route+line_feed)
-                of.write(line_feed)
-                of.write('Title Card Required'+line_feed)
-                of.write(line_feed)
-                if chrgspin == None:
-                    of.write('0 1'+line_feed)
-                else:
-                    chrg = str(chrgspin[0])
-                    spin = str(chrgspin[1])
-                    of.write(chrg+' '+spin+line_feed)
-
-            for atom, line_coord in sele_lines:
-                label = '{:<5}'.format(atom)
-                x = '{:>15.8f}'.format(line_coord[0])
-                y = '{:>15.8f}'.format(line_coord[1])
-                z = '{:>15.8f}'.format(line_coord[2])
-
-                of.write(label+x+y+z+line_feed)
-            # write a blank line to support "g16 < .gjf > .out" mode of gaussian
-            of.write(line_feed)
+            of.write(text)
 
     @classmethod
     def sele_unfreeze(cls, g_file, ff='gjf'):
@@ -401,15 +234,8 @@ class Frame:
         '''
         search for coord of id1 and id2 and generate a new coord using d for center atom of the fix
         '''
-        # search for p1
-        for index, line in enumerate(self.coord):            
-            if int(id1) == index + 1:
-                p1 = line
-                break
-        for index, line in enumerate(self.coord):            
-            if int(id2) == index + 1:
-                p2 = line
-                break
+        p1 = self.coord[int(id1)-1]
+        p2 = self.coord[int(id2)-1]
         d = float(d)
         fix_val_coord = set_distance(p1,p2,d)
 
@@ -425,6 +251,396 @@ class Frame:
         return self.coord[key]
 
 
+class ONIOMTemplate:
+    '''
+    An ONIOM gjf template parsed once for writing the coordinates of many frames
+    (same atom sequence as the frames. e.g.: from PDB2QMMM)
+    ---------
+    template = ONIOMTemplate.fromPath(t_file_path)  // reuse the one parsed in this process if the file is not changed
+    template.render(coord, chk_path=None)           // the gjf text of a frame
+    template.write(coord, out_path, chk_path=None)
+    template.write_frames(frames, out_path=None, ifchk=1, n_proc=1)  // out_path[:-4]+'_'+i+'.gjf' of each frame
+    ---------
+    head / tail: text before / after the coordinate section. (the chk_place_holder line is replaced by %chk= or removed)
+    line_format: a %-format of the coordinate section with the label and freeze mark before and the layer
+                 (and link atom) after x y z of each atom. Rendering a frame is one format of all coordinates.
+    '''
+    _cache = {}
+
+    def __init__(self, t_file_path):
+        self.path = t_file_path
+        # [text, ...] with None at the chk_place_holder lines
+        head = []
+        tail = []
+        atom_formats = []
+        coord_b_flag = 0
+        coord_e_flag = 0
+        with open(t_file_path) as f:
+            for line in f:
+                part = tail if coord_e_flag else head
+                if 'chk_place_holder' in line.strip():
+                    part.append(None)
+                    continue
+                if not coord_b_flag and re.match(ChrgSpin_pattern, line.strip()) != None:
+                    coord_b_flag = 1
+                    head.append(line)
+                    continue
+                # end when a space line appears
+                if coord_b_flag and not coord_e_flag:
+                    if line == line_feed:
+                        coord_e_flag = 1
+                        tail.append(line)
+                        continue
+                    lp = line.strip().split()
+                    # potential *CHANGE* here about where coord is in a line
+                    prefix = ' '+'{:<20}'.format(lp[0])+' '+'{:<3}'.format(lp[1])
+                    suffix = ' '+lp[5]
+                    if len(lp) > 6:
+                        suffix = suffix + ' ' + lp[6] + ' ' + lp[7]
+                    atom_formats.append(prefix.replace('%', '%%') + '%15.8f%15.8f%15.8f' + suffix.replace('%', '%%') + line_feed)
+                    continue
+                part.append(line)
+        self.head = head
+        self.tail = tail
+        self.n_atom = len(atom_formats)
+        self.line_format = ''.join(atom_formats)
+
+    @classmethod
+    def fromPath(cls, t_file_path):
+        '''
+        get the ONIOMTemplate of the path. Reuse the one parsed in this process if the file is not changed.
+        '''
+        abs_path = os.path.abspath(t_file_path)
+        f_stat = os.stat(abs_path)
+        key = (f_stat.st_mtime_ns, f_stat.st_size)
+        if abs_path not in cls._cache or cls._cache[abs_path][0] != key:
+            cls._cache[abs_path] = (key, cls(t_file_path))
+        return cls._cache[abs_path][1]
+
+    def render(self, coord, chk_path=None):
+        '''
+        return the gjf text with coordinates of *coord* ((n_atom, 3) array or list)
+        chk_path: write %chk= at the chk_place_holder (removed if None)
+        '''
+        coord = np.asarray(coord, dtype=float)
+        if len(coord) < self.n_atom:
+            raise Exception('ONIOMTemplate: '+str(len(coord))+' coordinates for '+str(self.n_atom)+' atoms in '+self.path)
+        chk_line = '' if chk_path is None else r'%chk='+chk_path+line_feed
+        head = ''.join(chk_line if line is None else line for line in self.head)
+        tail = ''.join(chk_line if line is None else line for line in self.tail)
+        return head + self.line_format % tuple(coord[:self.n_atom].ravel().tolist()) + tail
+
+    def write(self, coord, out_path, chk_path=None):
+        '''
+        write the gjf of *coord* to out_path
+        '''
+        with open(out_path, 'w') as of:
+            of.write(self.render(coord, chk_path=chk_path))
+        return out_path
+
+    def write_frames(self, frames, out_path=None, ifchk=1, n_proc=1):
+        '''
+        write gjfs of frames (a FrameSet, a list of Frame or a (n_frame, n_atom, 3) array)
+        out_path: gjf of frame i is out_path[:-4]+'_'+str(i)+'.gjf' (default: the template path with _newcoord)
+        ifchk   : use a chk file of the same name for each gjf
+        n_proc  : render and write in n_proc processes
+        ---------
+        return a list of gjf paths (and a list of chk paths if ifchk)
+        '''
+        if out_path == None:
+            out_path = self.path[:-4]+'_newcoord.gjf'
+        gjf_paths = [out_path[:-4]+'_'+str(i)+'.gjf' for i in range(len(frames))]
+        chk_paths = [gjf_path[:-3]+'chk' if ifchk else None for gjf_path in gjf_paths]
+        jobs = ((frame.coord if isinstance(frame, Frame) else frame, gjf_path, chk_path)
+                for frame, gjf_path, chk_path in zip(frames, gjf_paths, chk_paths))
+        if n_proc > 1:
+            with Pool(n_proc, initializer=_set_worker_template, initargs=(self,)) as pool:
+                list(pool.imap(_write_worker_frame, jobs, chunksize=4))
+        else:
+            for coord, gjf_path, chk_path in jobs:
+                self.write(coord, gjf_path, chk_path=chk_path)
+        if ifchk:
+            return gjf_paths, chk_paths
+        return gjf_paths
+
+# the template of a worker process of ONIOMTemplate.write_frames (sent once per process)
+_worker_template = None
+
+def _set_worker_template(template):
+    global _worker_template
+    _worker_template = template
+
+def _write_worker_frame(job):
+    coord, gjf_path, chk_path = job
+    return _worker_template.write(coord, gjf_path, chk_path=chk_path)
+
+
+class QMSelection(dict):
+    '''
+    A QM cluster selection compiled for writing the coordinates of many frames
+    (a sele list of {label: element} e.g.: from Structure.get_sele_list, Frame.sele_high)
+    ---------
+    sele = QMSelection(sele_list)                    // or QMSelection.compile(sele_list) to reuse a compiled one
+    sele.get_coords(coords)                          // (n_frame, n_line, 3) coordinates of the selection in frames
+    sele.render(coord, g_route, g_cores, g_mem_cores, ff='gjf', chrgspin=None, chk_path=None)
+    sele.write_frames(frames, out_path, g_route, g_cores, g_mem_cores, ff='gjf', chrgspin=None, ifchk=0)
+    sele.iter_write_frames(...)                      // a generator of each path once it is written
+    ---------
+    Labels are decoded once:
+    index       : 0-based frame row of each line (the QM atom for a link atom line)
+    element     : element of each line
+    link_line   : lines of link atoms ('id1-id2-d' labels)
+    link_atom / link_partner / link_dist: rows of the QM atom and the cut partner, and the QM atom - link atom distance
+    The link atom of a line is placed at d from the QM atom in the direction of the partner. (same as helper.set_distance)
+    It is still a dict of the sele list (the compiled arrays are not updated if it is changed).
+    '''
+    def __init__(self, sele_list=()):
+        super().__init__(sele_list)
+        index = []
+        link_line = []
+        link_partner = []
+        link_dist = []
+        for i, sele in enumerate(self.keys()):
+            # decode val fix atoms
+            if '-' in sele:
+                id1, id2, d = sele.split('-')
+                link_line.append(i)
+                link_partner.append(int(id2)-1)
+                link_dist.append(float(d))
+                sele = id1
+            # clean up
+            if sele[-1] not in '1234567890':
+                sele = sele[:-1]
+            index.append(int(sele)-1)
+        self.index = np.array(index, dtype=int)
+        self.element = np.array(list(self.values()), dtype=str)
+        self.link_line = np.array(link_line, dtype=int)
+        self.link_atom = self.index[self.link_line]
+        self.link_partner = np.array(link_partner, dtype=int)
+        self.link_dist = np.array(link_dist, dtype=float)
+        self.line_format = ''.join(('%-5s' % ele).replace('%', '%%') + '%15.8f%15.8f%15.8f' + line_feed for ele in self.element.tolist())
+
+    @classmethod
+    def compile(cls, sele_list):
+        '''
+        return sele_list if it is already compiled
+        '''
+        if isinstance(sele_list, cls):
+            return sele_list
+        return cls(sele_list)
+
+    def get_coords(self, coords):
+        '''
+        coords: a (n_frame, n_atom, 3) array (or (n_atom, 3) for one frame)
+        -------
+        return a (n_frame, n_line, 3) array of the selection coordinates (with link atoms) in each frame
+        '''
+        coords = np.asarray(coords, dtype=float)
+        if coords.ndim == 2:
+            coords = coords[np.newaxis]
+        sele_coords = coords[:, self.index]
+        if len(self.link_line):
+            p1 = sele_coords[:, self.link_line]
+            p2 = coords[:, self.link_partner]
+            v = p2 - p1
+            norm = np.sqrt((v * v).sum(axis=-1, keepdims=True))
+            sele_coords[:, self.link_line] = p1 + v / norm * self.link_dist[:, np.newaxis]
+        return sele_coords
+
+    def render(self, coord, g_route, g_cores, g_mem_cores, ff='gjf', chrgspin=None, chk_path=None, sele_coord=None):
+        '''
+        return the text of the selection in a frame of *coord* ((n_atom, 3))
+        (sele_coord: the (n_line, 3) coordinates if already get from get_coords)
+        '''
+        if ff != 'xyz' and ff != 'gjf':
+            raise Exception('only support xyz and gjf format now')
+        if sele_coord is None:
+            sele_coord = self.get_coords(coord)[0]
+        head = ''
+        if ff == 'xyz':
+            head = str(len(self))+line_feed
+        if ff == 'gjf':
+            if chk_path is not None:
+                head += r'%chk='+chk_path+line_feed
+            head += f'%mem={int(g_cores)*int(g_mem_cores)-1000}MB{line_feed}' # left 1000MB for outer usage
+            head += f'%nprocshared={g_cores}{line_feed}'
+            head += g_route+line_feed+line_feed+'Title Card Required'+line_feed+line_feed
+            if chrgspin == None:
+                head += '0 1'+line_feed
+            else:
+                head += str(chrgspin[0])+' '+str(chrgspin[1])+line_feed
+        # write a blank line to support "g16 < .gjf > .out" mode of gaussian
+        return head + self.line_format % tuple(sele_coord.ravel().tolist()) + line_feed
+
+    def write_frames(self, frames, out_path, g_route, g_cores, g_mem_cores, ff='gjf', chrgspin=None, ifchk=0):
+        '''
+        write the selection of frames (a FrameSet, a list of Frame or a (n_frame, n_atom, 3) array)
+        Coordinates of a window of frames are from one get_coords.
+        out_path: file of frame i is out_path[:-len(ff)-1]+'_'+str(i)+'.'+ff
+        ifchk   : use a chk file of the same name for each gjf
+        ---------
+        return a list of file paths
+        '''
+        return list(self.iter_write_frames(frames, out_path, g_route, g_cores, g_mem_cores, ff=ff, chrgspin=chrgspin, ifchk=ifchk))
+
+    def iter_write_frames(self, frames, out_path, g_route, g_cores, g_mem_cores, ff='gjf', chrgspin=None, ifchk=0):
+        '''
+        same as write_frames but yield the path of each file once it is written
+        '''
+        i = 0
+        for coords in iter_frame_chunks(frames):
+            for sele_coord in self.get_coords(coords):
+                path = out_path[:-len(ff)-1]+'_'+str(i)+'.'+ff
+                chk_path = path[:-len(ff)]+'chk' if ifchk else None
+                with open(path, 'w') as of:
+                    of.write(self.render(None, g_route, g_cores, g_mem_cores, ff=ff, chrgspin=chrgspin, chk_path=chk_path, sele_coord=sele_coord))
+                i += 1
+                yield path
+
+def iter_frame_chunks(frames, window=None):
+    '''
+    iterate over (n, n_atom, 3) arrays of every *window* frames (a FrameSet, a list of Frame/coordinates or an array)
+    (window: frames.window of a FrameSet or 20 by default)
+    '''
+    if isinstance(frames, FrameSet):
+        yield from frames.iter_chunks(window)
+        return
+    if window is None:
+        window = 20
+    if isinstance(frames, np.ndarray):
+        for start in range(0, len(frames), window):
+            yield frames[start:start+window]
+        return
+    frames = list(frames)
+    for start in range(0, len(frames), window):
+        yield np.stack([np.asarray(frame.coord if isinstance(frame, Frame) else frame, dtype=float) for frame in frames[start:start+window]])
+
+
+class FrameSet:
+    '''
+    A lazy sequence of frames in a trajectory file (.mdcrd/.crd, .nc or .npy. see Class_Traj.open_traj)
+    Frames are decoded by windows of *window* frames when used, so the memory does not grow with the number of frames.
+    ---------
+    frames = FrameSet(path, n_atom=None, frame_index=None, atom_index=None, window=20)
+    len(frames)
+    frames[i]                           // a Frame
+    frames[i:j:k] / frames[index_list]  // a FrameSet of these frames (nothing is read)
+    for frame in frames: ...            // Frame objects of each frame (window by window)
+    for coords in frames.iter_chunks(): // (n, n_atom, 3) arrays of window frames
+    ---------
+    frame_index: index of frames to use in the file (all frames by default)
+    atom_index : index of atoms to read in each frame (all atoms by default). Only these atoms are decoded.
+    expand_to  : (n_full_atom, full_index) to place the read atoms at rows *full_index* of (n_full_atom, 3)
+                 frames filled with NaN. (keep the atom ids of the full system for frames of a stripped system)
+    '''
+    def __init__(self, path, n_atom=None, frame_index=None, atom_index=None, window=20, expand_to=None):
+        self.path = path
+        self.n_atom = n_atom
+        self.traj = open_traj(path, n_atom=n_atom)
+        if frame_index is None:
+            frame_index = np.arange(len(self.traj))
+        self.frame_index = np.asarray(frame_index, dtype=int)
+        self.atom_index = None if atom_index is None else np.asarray(atom_index, dtype=int)
+        self.window = window
+        self.expand_to = expand_to
+        # the current window: (start position, coords)
+        self._window = (None, None)
+
+    @classmethod
+    def fromNC(cls, nc_file, start=1, end=-1, step=1, atom_index=None, window=20, expand_to=None):
+        '''
+        frames of a NetCDF trajectory from start to end with step (1-based with end included, same as trajin of cpptraj)
+        '''
+        frames = cls(nc_file, atom_index=atom_index, window=window, expand_to=expand_to)
+        return frames[start-1: None if end == -1 else end: step]
+
+    def __reduce__(self):
+        # reopen by path instead of pickling the opened file
+        return (type(self), (self.path, self.n_atom, self.frame_index, self.atom_index, self.window, self.expand_to))
+
+    def __len__(self):
+        return len(self.frame_index)
+
+    def __getitem__(self, key):
+        '''
+        FrameSet_obj[int]: Frame of the frame
+        FrameSet_obj[slice or index list]: FrameSet of the frames
+        '''
+        if isinstance(key, (int, np.integer)):
+            key = range(len(self))[key]
+            start, coords = self._window
+            if start is None or not start <= key < start + len(coords):
+                start = key - key % self.window
+                coords = self._read(start, start + self.window)
+                self._window = (start, coords)
+            return Frame(coords[key - start])
+        frames = copy.copy(self)
+        frames.frame_index = self.frame_index[key]
+        frames._window = (None, None)
+        return frames
+
+    def __iter__(self):
+        for coords in self.iter_chunks():
+            for coord in coords:
+                yield Frame(coord)
+
+    def iter_chunks(self, window=None):
+        '''
+        iterate over (n, n_atom, 3) coordinate arrays of every *window* frames (self.window by default)
+        '''
+        if window is None:
+            window = self.window
+        for start in range(0, len(self), window):
+            yield self._read(start, start + window)
+
+    def _read(self, start, end):
+        '''
+        read frames from position *start* to *end*-1 as a float array
+        '''
+        coords = take_frames(self.traj, self.frame_index[start:end], atom_index=self.atom_index)
+        if self.expand_to is not None:
+            n_full_atom, full_index = self.expand_to
+            full_coords = np.full((len(coords), n_full_atom, 3), np.nan)
+            full_coords[:, full_index] = coords
+            coords = full_coords
+        return coords
+
+
+def getOrientations(g_out_file, every=1):
+    '''
+    Get coordinates of all steps (Input orientation) from a gaussian output file. (e.g.: the trajectory of an optimization)
+    every: only parse every k-th step (the 1st, k+1th, ... and always the last)
+    --------
+    return a (n_step, n_atom, 3) array
+    '''
+    if os.path.getsize(g_out_file) == 0:
+        return np.zeros((0, 0, 3))
+    with open(g_out_file, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            marks = []
+            pos = mm.find(orientation_mark)
+            while pos >= 0:
+                marks.append(pos)
+                pos = mm.find(orientation_mark, pos + len(orientation_mark))
+            if not marks:
+                return np.zeros((0, 0, 3))
+            sele_marks = marks[::every]
+            if sele_marks[-1] != marks[-1]:
+                sele_marks.append(marks[-1])
+            return np.stack([_read_orientation(mm, pos) for pos in sele_marks])
+
+def _read_orientation(mm, pos):
+    '''
+    parse the Input orientation block at *pos* of a mapped gaussian output
+    return a (n_atom, 3) array
+    '''
+    # skip the title line and 4 header lines
+    for i in range(5):
+        pos = mm.find(b'\n', pos) + 1
+    end = mm.find(b'---', pos)
+    values = np.array(mm[pos:end].split(), dtype=float)
+    # Center Number / Atomic Number / Atomic Type / X Y Z
+    return values.reshape(-1, 6)[:, 3:]
 
 def getFreq(g_out_file):
     '''
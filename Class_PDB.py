@@ -1,5 +1,4 @@
 import copy
-from math import ceil
 import os
 import re
 from subprocess import SubprocessError, run, CalledProcessError
@@ -9,11 +8,13 @@ from AmberMaps import *
 from wrapper import *
 from Class_Structure import *
 from Class_line import *
+from Class_Prmtop import Prmtop
+from Class_Traj import convert_traj, get_atom_index, open_nc, read_npy_header
 from Class_Conf import Config, Layer
 from Class_ONIOM_Frame import *
 from core import job_manager
 from core.clusters._interface import ClusterInterface
-from helper import Conformer_Gen_wRDKit, decode_atom_mask, get_center, get_field_strength_value, line_feed, mkdir, generate_Rosetta_params
+from helper import Conformer_Gen_wRDKit, decode_atom_mask, get_center, get_index_ranges, get_field_strength_value, get_field_strength_values, iter_in_background, line_feed, mkdir, generate_Rosetta_params
 try:
     from pdb2pqr.main import main_driver as run_pdb2pqr
     from pdb2pqr.main import build_main_parser as build_pdb2pqr_parser
@@ -87,10 +88,14 @@ class PDB():
         '''
         # Nessessary initilize for empty judging
         self.stru = None
+        self._prmtop_stru = None
         self.path = None
         self.prmtop_path = None
         self.MutaFlags = []
         self.nc=None
+        self.nc_frame_range=None
+        self.mdcrd=None
+        self.traj_atom_index=None
         self.frames=None
         # default MD conf.
         self._init_MD_conf()
@@ -148,6 +153,7 @@ class PDB():
         input_name  : a name tag for the object (self.name by default)
         ligand_list : a list of user assigned ligand residue names.
         renew       : 1: force generate a new stru_obj
+        * parsed structures are cached under self.cache_path if Config.stru_cache is on (off by default)
         '''
         # indicated by self.name
         input_name = self.name
@@ -168,9 +174,9 @@ class PDB():
             if Config.debug >= 1:
                 print('PDB.get_stru: Getting new stru')
             if self.path is not None:
-                self.stru = Structure.fromPDB(self.path, input_name=input_name, ligand_list=ligand_list)
+                self.stru = Structure.fromPDB(self.path, input_name=input_name, ligand_list=ligand_list, cache_path=self.cache_path)
             else:
-                self.stru = Structure.fromPDB(self.file_str, input_type='file_str', input_name=input_name, ligand_list=ligand_list)
+                self.stru = Structure.fromPDB(self.file_str, input_type='file_str', input_name=input_name, ligand_list=ligand_list, cache_path=self.cache_path)
         elif Config.debug >= 1:
             print('PDB.get_stru: Not getting new stru - have existing self.stru with the same name and renew == 0')
 
@@ -530,8 +536,8 @@ class PDB():
         # Add missing atom (from the PDB2PQR step. Update to func result after update the _get_protonation_pdb2pqr func)       
         # Now metal and ligand
 
-        old_stru = Structure.fromPDB(self.path)
-        new_stru = Structure.fromPDB(self.pqr_path)
+        old_stru = Structure.fromPDB(self.path, cache_path=self.cache_path)
+        new_stru = Structure.fromPDB(self.pqr_path, cache_path=self.cache_path)
 
         # find Metal center and combine with the pqr file
         metal_list = old_stru.get_metal_center()
@@ -1971,7 +1977,7 @@ class PDB():
     QM/MM
     ========
     '''
-    def PDB2QMMM(self, o_dir='',tag='', work_type='spe', qm='g16', keywords='', prmtop_path=None, prepi_path:dict=None, spin_list=[1,1], ifchk=1):
+    def PDB2QMMM(self, o_dir='',tag='', work_type='spe', qm='g16', keywords='', prmtop_path=None, prepi_path:dict=None, spin_list=[1,1], ifchk=1, n_proc=1):
         '''
         generate QMMM input template based on [connectivity, atom order, work type, layer/freeze settings, charge settings]
         * NEED TO SET LAYER BY ATOM INDEX OR SELECT A LAYER PRESET (use Config.Gaussian.layer_preset and Config.Gaussian.layer_atoms)
@@ -1986,6 +1992,7 @@ class PDB():
         prepi_path  : a diction of prepin file path with each ligand name as key. (e.g.: {'4CO':'./ligand/xxx.prepin'})
         spin_list   : a list of spin for each layers. (Do not support auto judge of the spin now)
         ifchk       : if save chk and return chk paths
+        n_proc      : number of processes to write the gjfs of frames (see ONIOMTemplate.write_frames)
         <see more options in Config.Gaussian>
         ========
         Gaussian
@@ -2018,6 +2025,8 @@ class PDB():
         support_qm=['g16']
         if qm not in support_qm:
             raise Exception('PDB2QMMM.qm: only support: '+repr(support_qm))
+        if self.traj_atom_index is not None:
+            raise Exception('PDB2QMMM: needs frames of all atoms. Please sample without keep_mask')
         # default
         if prmtop_path == None:
             prmtop_path = self.prmtop_path
@@ -2042,7 +2051,7 @@ class PDB():
             title = 'ONIOM input template generated by PDB2QMMM module of XXX(software name)'+line_feed
             chrgspin = self._get_oniom_chrgspin(prmtop_path=prmtop_path, spin_list=spin_list)
             cnt_table = self.stru.get_connectivty_table(prepi_path=prepi_path)
-            coord = self._get_oniom_g16_coord(prmtop_path) # use connectivity info from the line above.
+            coord = self._get_oniom_g16_coord(prepi_path=prepi_path) # use the bond graph from the line above.
             add_prm = self._get_oniom_g16_add_prm() # test for rules of missing parameters
             
             #combine and write 
@@ -2060,19 +2069,14 @@ class PDB():
                 of.write(add_prm)
         
         # deploy to inp files
-        frames = Frame.fromMDCrd(self.mdcrd)
+        frames = self._get_frames(prmtop_path=prmtop_path)
         self.frames = frames
-        gjf_paths = []
-        chk_paths = []
         if Config.debug >= 1:
             print('Writing QMMM gjfs.')
-        for i, frame in enumerate(frames):
-            if ifchk:
-                frame_path = frame.write_to_template(g_temp_path, index = str(i), ifchk=1)
-                gjf_paths.append(frame_path[0])
-                chk_paths.append(frame_path[1])
-            else:
-                gjf_paths.append(frame.write_to_template(g_temp_path, index = str(i), ifchk=0))
+        # parse the template once for all frames
+        gjf_paths = ONIOMTemplate.fromPath(g_temp_path).write_frames(frames, ifchk=ifchk, n_proc=n_proc)
+        if ifchk:
+            gjf_paths, chk_paths = gjf_paths
         # run Gaussian job
         self.qmmm_out = PDB.Run_QM(gjf_paths)
 
@@ -2138,10 +2142,11 @@ class PDB():
         for j in range(len(self.layer)):
             self.layer_chrgspin.append(float(0))
         # add charge to layers
-        for i, chrg in enumerate(self.chrg_list_all):
-            for j, layer in enumerate(self.layer):
-                if i+1 in layer:
-                    self.layer_chrgspin[j] += chrg
+        chrg_array = np.array(self.chrg_list_all)
+        for j, layer in enumerate(self.layer):
+            layer_ids = np.unique(np.array(layer, dtype=int))
+            layer_ids = layer_ids[(layer_ids >= 1) & (layer_ids <= len(chrg_array))]
+            self.layer_chrgspin[j] += float(chrg_array[layer_ids-1].sum())
 
         # add spin
         if len(self.layer_chrgspin) != len(spin_list):
@@ -2166,7 +2171,7 @@ class PDB():
         return chrgspin
 
 
-    def _get_oniom_g16_coord(self):
+    def _get_oniom_g16_coord(self, prepi_path=None):
         '''
         generate coordinate line. Base on *structure* and layer settings in the *config* module.
         Use element name as atom type for ligand atoms since they are mostly in QM regions.
@@ -2178,84 +2183,71 @@ class PDB():
         	- freeze part (general option / some presupposition) 
         	- xyz (from self.stru)
         	- layer (general option / some presupposition)
+        ---------------
+        prepi_path: for the bond graph of ligands (same as get_connectivty_table, which is cached)
+        Lines are formatted in one pass over atoms (same format as Atom.build_oniom) and joined at the end.
+        Layer membership is a bool mask over atoms and link atoms come from the boundary of the bond graph.
         '''
-        coord=''
-
+        stru = self.stru
+        atoms = stru.get_atoms()
+        n_atom = len(atoms)
         # amber default hold the chain - ligand - metal - solvent order
-        a_id = 0
-        for chain in self.stru.chains:
+        if not np.array_equal(stru.get_atom_column('atom_id'), np.arange(1, n_atom+1)):
+            raise Exception('atom id error.')
+        kinds = stru.get_resi_column('kind')[stru.get_atom_column('resi_index')].tolist()
+        if_h = np.zeros(n_atom, dtype=bool)
+        h_ids = np.array(list(self.layer[0]), dtype=int)
+        if_h[h_ids[(h_ids >= 1) & (h_ids <= n_atom)]-1] = True
+
+        # connection between layers: [low atom row] -> high atom row
+        low_rows, high_rows = stru.get_bond_graph(prepi_path=prepi_path).get_boundary(~if_h)
+        if len(low_rows) and np.bincount(low_rows).max() > 1:
+            raise Exception('A low layer atom is connecting 2 higher layer atoms')
+        cnt_flags = {}
+        for i, j in zip(low_rows.tolist(), high_rows.tolist()):
+            if Config.debug >= 1 and kinds[i] in (1, 3):
+                print('\033[1;31;0m In PDB2QMMM in _get_oniom_g16_coord: WARNING: Found '+('ligand' if kinds[i] == 1 else 'solvent')+' atom'+str(i+1)+' in seperate layers \033[0m')
+            cnt_flags[i] = ' H-'+atoms[j].get_pseudo_H_type(atoms[i])+' '+str(j+1)
+        if Config.debug >= 1 and np.any(~if_h[np.array(kinds) == 1]):
+            print('\033[1;31;0m In PDB2QMMM in _get_oniom_g16_coord: WARNING: Found ligand atom in low layer \033[0m')
+
+        # G16 labels (deal with N/C terminal and ligand)
+        labels = []
+        for chain in stru.chains:
+            r1 = chain.residues[0]
+            rm1 = chain.residues[-1]
             for res in chain:
+                label_map = G16_label_map[res.name]
                 for atom in res:
-                    a_id += 1
-                    # san check
-                    if atom.id != a_id:
-                        raise Exception('atom id error.')
-                    if atom.id in self.layer[0]:
-                        coord += atom.build_oniom('h', self.chrg_list_all[atom.id-1])
+                    if res is r1 and atom.name in ['H1','H2','H3']:
+                        labels.append('H')
+                    elif res is rm1 and atom.name == 'OXT':
+                        labels.append('O2')
                     else:
-                        # consider connection
-                        cnt_info = None
-                        repeat_flag = 0
-                        for cnt_atom in atom.connect:
-                            if cnt_atom.id in self.layer[0]:
-                                if repeat_flag:
-                                    raise Exception('A low layer atom is connecting 2 higher layer atoms')
-                                cnt_info = ['H', cnt_atom.get_pseudo_H_type(atom), cnt_atom.id] 
-                                repeat_flag = 1
-                        # general low layer
-                        coord += atom.build_oniom('l', self.chrg_list_all[atom.id-1], cnt_info=cnt_info)
-        for lig in self.stru.ligands:
-            for atom in lig:
-                a_id += 1
-                if atom.id != a_id:
-                    raise Exception('atom id error.')
-                if atom.id in self.layer[0]:
-                    coord += atom.build_oniom('h', self.chrg_list_all[atom.id-1], if_lig=1)
-                else:
-                    if Config.debug >= 1:
-                        print('\033[1;31;0m In PDB2QMMM in _get_oniom_g16_coord: WARNING: Found ligand atom in low layer \033[0m')
-                    # consider connection
-                    cnt_info = None
-                    repeat_flag = 0 
-                    for cnt_atom in atom.connect:
-                        if repeat_flag:
-                            raise Exception('A low layer atom is connecting 2 higher layer atoms')
-                        if cnt_atom.id in self.layer[0]:
-                            if Config.debug >= 1:
-                                print('\033[1;31;0m In PDB2QMMM in _get_oniom_g16_coord: WARNING: Found ligand atom'+str(atom.id)+' in seperate layers \033[0m')
-                            cnt_info = ['H', cnt_atom.get_pseudo_H_type(atom), cnt_atom.id]
-                            repeat_flag = 1
-                    coord += atom.build_oniom('l', self.chrg_list_all[atom.id-1], cnt_info=cnt_info, if_lig=1)
-        for atom in self.stru.metalatoms:
-            a_id += 1
-            if atom.id != a_id:
-                raise Exception('atom id error.')
-            if atom.id in self.layer[0]:
-                coord += atom.build_oniom('h', self.chrg_list_all[atom.id-1])
+                        labels.append(label_map[atom.name])
+        eles = stru.get_atom_column('ele').tolist()
+        for lig in stru.ligands:
+            labels.extend(eles[len(labels):len(labels)+len(lig)])
+        labels.extend([None]*len(stru.metalatoms))
+        for sol in stru.solvents:
+            labels.extend(G16_label_map[sol.name][atom.name] for atom in sol)
+
+        # lines
+        template = '%-16s %2s   %-14.8f %-14.8f %-14.8f %s%s'+line_feed
+        chrgs = self.chrg_list_all
+        coords = stru.coords.tolist()
+        lines = []
+        for i, (atom, label, kind, if_high) in enumerate(zip(atoms, labels, kinds, if_h.tolist())):
+            if kind == 2:
+                lines.append(atom.build_oniom('h' if if_high else 'l', chrgs[i]))
+                continue
+            x, y, z = coords[i]
+            atom_label = ' '+eles[i]+'-'+label+'-'+str(round(chrgs[i],6))
+            if if_high:
+                lines.append(template % (atom_label, '0', x, y, z, 'H', ''))
             else:
-                coord += atom.build_oniom('l', self.chrg_list_all[atom.id-1])
-        for sol in self.stru.solvents:
-            for atom in sol:
-                a_id += 1
-                if atom.id != a_id:
-                    raise Exception('atom id error.')
-                if atom.id in self.layer[0]:
-                    coord += atom.build_oniom('h', self.chrg_list_all[atom.id-1], if_sol=1)
-                else:
-                    # consider connection
-                    cnt_info = None # for future update
-                    repeat_flag = 0
-                    for cnt_atom in atom.connect:
-                        if cnt_atom.id in self.layer[0]:
-                            if Config.debug >= 1:
-                                print('\033[1;31;0m In PDB2QMMM in _get_oniom_g16_coord: WARNING: Found solvent atom'+str(atom.id)+' in seperate layers \033[0m')
-                            if repeat_flag:
-                                raise Exception('A low layer atom is connecting 2 higher layer atoms')
-                            cnt_info = ['H', cnt_atom.get_pseudo_H_type(atom), cnt_atom.id] 
-                            repeat_flag = 1
-                    coord += atom.build_oniom('l', self.chrg_list_all[atom.id-1], cnt_info=cnt_info, if_sol=1)
-
-        return coord
+                lines.append(template % (atom_label, '-1', x, y, z, 'L', cnt_flags.get(i, '')))
+        return ''.join(lines)
 
 
     def _get_oniom_g16_add_prm(self):
@@ -2286,64 +2278,50 @@ class PDB():
         '''
         Get charge from the .prmtop file
         Take the (path) of .prmtop file and return a [list of charges] with corresponding to the atom sequence
+        (the file is read once per process, see Class_Prmtop)
         -----------------
         * Unit transfer in prmtop: http://ambermd.org/Questions/units.html
         '''
-        with open(prmtop_path) as f:
-            
-            charge_list=[]
-            line_index=0
-
-            for line in f:
-                
-                line_index=line_index+1 #current line
-                
-                if line.strip() == r'%FLAG POINTERS':
-                    format_flag=line_index
-                if line.strip() == r'%FLAG CHARGE':
-                    charge_flag=line_index
-
-                if 'format_flag' in dir():
-                    if line_index == format_flag+2:
-                        N_atom=int(line.split()[0])
-                        del format_flag
-                        
-                if 'charge_flag' in dir():
-                    if line_index >= charge_flag+2 and line_index <= charge_flag+1+ceil(N_atom/5):
-                        for i in line.strip().split():
-                            charge_list.append(float(i)/18.2223)
-        return charge_list
+        return Prmtop.fromPath(prmtop_path).get_charge().tolist()
 
     '''
     ========
     MD Analysis 
     ========
     '''
-    def nc2mdcrd(self, o_path='', point=None, start=1, end=-1, step=1, engine='cpptraj'):
+    def nc2mdcrd(self, o_path='', point=None, start=1, end=-1, step=1, engine='cpptraj', keep_mask=None, window=20):
         '''
         convert self.nc to a mdcrd file to read and operate.(self.nc[:-2]+'.mdcrd' by default)
         a easier way is to use pytraj directly.
         ---------------
         o_path: user assigned out path (self.nc[:-2]+'mdcrd' by default)
+                a .npy path writes a float32 frame store with a JSON header instead (see Class_Traj.write_npy. always by the numpy engine)
+                that is memory-mapped by the readers without parsing. (Class_Traj.convert_traj converts it to/from .mdcrd)
         point:  sample point. use value from self.conf_prod['nstlim'] and self.conf_prod['ntwx'] to determine step size.
         start:  start point
         end:    end point
         step:   step size
-        engine: pytraj or cpptraj (some package conflict may cause pytraj not available)
+        engine: pytraj, cpptraj or numpy (some package conflict may cause pytraj not available)
+                numpy: read self.nc with Class_Traj and write the mdcrd by chunks of *window* frames (no cpptraj needed. no box lines)
+        keep_mask: Amber mask of atoms to keep (e.g. the solute: '!:WAT,Na+,Cl-'). Other atoms are stripped from the mdcrd.
+                   The kept atom index is stored in self.traj_atom_index and frames are read back with the atom ids of the full system.
+                   (distance based masks are evaluated on the first frame)
         '''
         if self.nc == None:
             raise Exception('No nc file found. Please assign self.nc or run PDBMD first')
         else:
             if o_path == '':
                 o_path= self.nc[:-2]+'mdcrd'
-            if end == -1:
-                end = 'last'
-            if point != None:
-                all_p = int(self.conf_prod['nstlim'])/int(self.conf_prod['ntwx'])
-                step = int(all_p/point)
-
-            if engine not in ['pytraj', 'cpptraj']:
-                raise Exception('engine: pytraj or cpptraj')
+            step = self._get_sample_step(point, step)
+
+            if engine not in ['pytraj', 'cpptraj', 'numpy']:
+                raise Exception('engine: pytraj, cpptraj or numpy')
+            if o_path.endswith('.npy'):
+                engine = 'numpy'
+
+            atom_index = None
+            if keep_mask != None:
+                atom_index = self._get_keep_atom_index(keep_mask)
             
             if engine == 'pytraj':
                 pass
@@ -2353,14 +2331,89 @@ class PDB():
                 cpp_out_path = self.cache_path+'/cpptraj_nc2mdcrd.out'
                 with open(cpp_in_path,'w') as of:
                     of.write('parm '+self.prmtop_path+line_feed)
-                    of.write('trajin '+self.nc+' '+str(start)+' '+end+' '+str(step)+line_feed)
+                    of.write('trajin '+self.nc+' '+str(start)+' '+('last' if end == -1 else str(end))+' '+str(step)+line_feed)
+                    if atom_index is not None:
+                        of.write('strip !@'+get_index_ranges(atom_index + 1)+line_feed)
                     of.write('trajout '+o_path+line_feed)
                     of.write('run'+line_feed)
                     of.write('quit'+line_feed)
                 os.system('cpptraj -i '+cpp_in_path+' > '+cpp_out_path)
 
+            if engine == 'numpy':
+                frame_index = np.arange(len(open_nc(self.nc)))[start-1: None if end == -1 else end: step]
+                convert_traj(self.nc, o_path, frame_index=frame_index, atom_index=atom_index, window=window)
+
         self.mdcrd=o_path
+        self.traj_atom_index = atom_index
         return o_path
+
+    def sample_nc(self, point=None, start=1, end=-1, step=1, keep_mask=None):
+        '''
+        sample frames from self.nc to read them directly (no cpptraj or mdcrd text file)
+        the frame range is stored in self.nc_frame_range and used by the functions that read frames
+        (PDB2QMCluster, PDB2QMMM, get_field_strength). Use nc2mdcrd instead to keep a mdcrd file.
+        ---------------
+        point:  sample point. use value from self.conf_prod['nstlim'] and self.conf_prod['ntwx'] to determine step size.
+        start:  start point
+        end:    end point (-1 for the last)
+        step:   step size
+        keep_mask: Amber mask of atoms to read (e.g. the solute). see nc2mdcrd
+        '''
+        if self.nc == None:
+            raise Exception('No nc file found. Please assign self.nc or run PDBMD first')
+        step = self._get_sample_step(point, step)
+        self.traj_atom_index = None
+        if keep_mask != None:
+            self.traj_atom_index = self._get_keep_atom_index(keep_mask)
+        self.nc_frame_range = (start, end, step)
+        self.mdcrd = None
+        return self.nc_frame_range
+
+    def _get_keep_atom_index(self, keep_mask):
+        '''
+        get the 0-based index of atoms in *keep_mask* (solvent included) in the atom order of self.nc
+        The mask is evaluated on the structure of self.prmtop_path with the first frame of self.nc
+        '''
+        self.traj_atom_index = None
+        stru = self._get_prmtop_stru(open_nc(self.nc)[0])
+        atom_index = get_atom_index(decode_atom_mask(stru, keep_mask, ifsolvent=1))
+        if len(atom_index) == 0:
+            raise Exception('keep_mask: '+keep_mask+' selects no atom')
+        return atom_index
+
+    def _get_sample_step(self, point, step):
+        '''
+        get the step size of sampling *point* frames from the prod MD (or return *step* if point is None)
+        '''
+        if point != None:
+            all_p = int(self.conf_prod['nstlim'])/int(self.conf_prod['ntwx'])
+            step = int(all_p/point)
+        return step
+
+    def _get_frames(self, prmtop_path=None):
+        '''
+        get sampled frames from self.mdcrd (nc2mdcrd) or directly from self.nc (sample_nc)
+        return a FrameSet that reads frames only when they are used
+        '''
+        if prmtop_path == None:
+            prmtop_path = self.prmtop_path
+        n_atom = None if prmtop_path == None else Prmtop.fromPath(prmtop_path).get_n_atom()
+        # a frame store records the kept atoms
+        if self.mdcrd != None and self.mdcrd.endswith('.npy'):
+            atom_index = read_npy_header(self.mdcrd)['atom_index']
+            self.traj_atom_index = None if atom_index is None else np.array(atom_index)
+        # frames of stripped atoms keep the atom ids of the full system
+        expand_to = None
+        if self.traj_atom_index is not None:
+            expand_to = (n_atom, self.traj_atom_index)
+        if self.mdcrd == None and self.nc_frame_range != None:
+            start, end, step = self.nc_frame_range
+            return FrameSet.fromNC(self.nc, start=start, end=end, step=step, atom_index=self.traj_atom_index, expand_to=expand_to)
+        if self.mdcrd == None:
+            raise Exception('No sampled frames. Please run nc2mdcrd or sample_nc first')
+        if self.traj_atom_index is not None:
+            return FrameSet(self.mdcrd, n_atom=len(self.traj_atom_index), expand_to=expand_to)
+        return FrameSet(self.mdcrd, n_atom=n_atom)
             
 
     '''
@@ -2368,6 +2421,22 @@ class PDB():
     QM Cluster
     ========    
     '''
+    def _get_prmtop_stru(self, coords):
+        '''
+        get a Structure of self.prmtop_path with coords. (atom order of the MD frames)
+        It is kept in self._prmtop_stru and self.stru (of self.path) is not changed.
+        The structure is reused if it was built from the same prmtop file and only the coordinates are updated.
+        Only atoms in self.traj_atom_index are built if frames are stripped. (nc2mdcrd/sample_nc with keep_mask)
+        '''
+        prmtop = Prmtop.fromPath(self.prmtop_path)
+        n_stru_atom = prmtop.get_n_atom() if self.traj_atom_index is None else len(self.traj_atom_index)
+        stru = self._prmtop_stru
+        if stru is None or stru.prmtop is not prmtop or len(stru.coords) != n_stru_atom:
+            self._prmtop_stru = Structure.fromPrmtop(prmtop, coords, input_name=self.name, atom_index=self.traj_atom_index)
+        else:
+            stru.coords[:] = np.asarray(coords, dtype=float).reshape(-1, 3)[stru.get_atom_column('atom_id')-1]
+        return self._prmtop_stru
+
     def PDB2QMCluster(
         self, 
         atom_mask: str, 
@@ -2385,7 +2454,9 @@ class PDB():
         res_setting: Union[dict, str, None] = None,
         cpu_cores: Union[int, str, None] = None,
         cpu_mem: Union[int, str, None] = None,
-        cluster_debug: bool = 0
+        cluster_debug: bool = 0,
+        stream: bool = 0,
+        callback = None
     ) -> list :
         '''
         Build & Run QM cluster input from self.mdcrd with selected atoms according to atom_mask
@@ -2394,15 +2465,13 @@ class PDB():
         self (Pre-requisites):
             dir 
                 - for *default dir*
-            path 
-                - for *get_stru()* 
-                - need the same pdb representing the structure in the MD frames
             prmtop_path 
-                - for get *charge* list 
+                - for the *structure* (Structure.fromPrmtop) and *charge* list 
                 - need the prmtop file used as MD input
             mdcrd 
                 - for *coordinates* of each QM cluster 
                 - the mdcrd file that sampled from the traj
+                - (or nc and nc_frame_range from sample_nc to read the sampled frames directly)
             prepi_path (val_fix='internal')
                 - for get *connectivity (ligand part)* and fix free valances if they exist
                 - the dict for prepin files for all ligands {'3_letter_name':'path_to_prepin_file', ...}
@@ -2441,9 +2510,15 @@ class PDB():
             these values should be the same as indicated in the res_setting.
         cluster_debug:
            1:  add also the qm cluster job obj to the pdb obj
+        stream:
+            1: write the gjfs in a background worker and submit (or run) each one as soon as it is written
+               (within the job_array_size) instead of after writing all of them.
+        callback:
+            called with the path of each qm cluster output file once its job ends (in the order of ending)
+            (use PDB.iter_Run_QM for an iterator of the outputs of a list of input files)
         ---data---
         Attribute:
-            self.frames
+            self.frames (a FrameSet of the sampled frames)
             self.qm_cluster_map (PDB atom id -> QM atom id)
         Return:
             self.qm_cluster_out
@@ -2453,13 +2528,15 @@ class PDB():
         if o_dir == None:
             o_dir = self.dir+'/QM_cluster'+tag
         mkdir(o_dir)
-        # update stru
-        self.get_stru()
+        # update stru (in the atom order of the MD frames by construction)
+        frames = self._get_frames()
+        self.frames = frames
+        stru = self._get_prmtop_stru(frames[0].coord)
         # get sele
         if val_fix == 'internal':
-            sele_lines, sele_map = self.stru.get_sele_list(atom_mask, fix_end='H', prepi_path=self.prepi_path)
+            sele_lines, sele_map = stru.get_sele_list(atom_mask, fix_end='H', prepi_path=self.prepi_path)
         else:
-            sele_lines, sele_map = self.stru.get_sele_list(atom_mask, fix_end=None)
+            sele_lines, sele_map = stru.get_sele_list(atom_mask, fix_end=None)
         self.qm_cluster_map = sele_map
         # get chrgspin
         chrgspin = self._get_qmcluster_chrgspin(sele_lines, spin=spin)
@@ -2482,33 +2559,30 @@ class PDB():
             cpu_mem = Config.max_core
 
         #make inp files
-        frames = Frame.fromMDCrd(self.mdcrd)
-        self.frames = frames
         if QM in ['g16','g09']:
-            gjf_paths = []
             if Config.debug >= 1:
                 print('Writing QMcluster gjfs.')
-            for i, frame in enumerate(frames):
-                gjf_path = o_dir+'/qm_cluster_'+str(i)+'.gjf'
-                frame.write_sele_lines(sele_lines, out_path=gjf_path, g_route=g_route, g_cores=cpu_cores, g_mem_cores=cpu_mem, chrgspin=chrgspin, ifchk=ifchk)
-                gjf_paths.append(gjf_path)
-            # Run inp files
-            if if_cluster_job:
-                Run_QM_out = PDB.Run_QM( gjf_paths, 
-                                         prog=QM, 
-                                         if_cluster_job=if_cluster_job, 
-                                         cluster = cluster,
-                                         job_array_size = job_array_size,
-                                         period = period,
-                                         res_setting=res_setting,
-                                         cluster_debug=cluster_debug)
-                if cluster_debug:
-                    qm_cluster_out_paths = Run_QM_out[0]
-                    self.qm_cluster_jobs = Run_QM_out[1]
-                else:
-                    qm_cluster_out_paths = Run_QM_out
+            gjf_paths = [o_dir+'/qm_cluster_'+str(i)+'.gjf' for i in range(len(frames))]
+            gjf_iter = sele_lines.iter_write_frames(frames, o_dir+'/qm_cluster.gjf', g_route=g_route, g_cores=cpu_cores, g_mem_cores=cpu_mem, chrgspin=chrgspin, ifchk=ifchk)
+            if stream:
+                gjf_iter = iter_in_background(gjf_iter)
             else:
-                qm_cluster_out_paths = PDB.Run_QM(gjf_paths, prog=QM, if_cluster_job=0)
+                gjf_iter = list(gjf_iter)
+            # Run inp files
+            qm_cluster_jobs = {}
+            for out_path, job in PDB.iter_Run_QM(gjf_iter,
+                                                 prog=QM,
+                                                 if_cluster_job=if_cluster_job,
+                                                 cluster = cluster,
+                                                 job_array_size = job_array_size,
+                                                 period = period,
+                                                 res_setting=res_setting):
+                qm_cluster_jobs[out_path] = job
+                if callback is not None:
+                    callback(out_path)
+            qm_cluster_out_paths = [gjf_path[:-3]+'out' for gjf_path in gjf_paths]
+            if if_cluster_job and cluster_debug:
+                self.qm_cluster_jobs = [qm_cluster_jobs[out_path] for out_path in qm_cluster_out_paths]
             # get chk files if ifchk
             if ifchk:
                 qm_cluster_chk_paths = []
@@ -2602,48 +2676,67 @@ class PDB():
         TODO put this individually as part of the qm interface
              maybe introduct the current executor object to decouple this module with the job manager.
         '''
+        jobs = dict(cls.iter_Run_QM(inp, prog=prog, if_cluster_job=if_cluster_job, cluster=cluster,
+                                    job_array_size=job_array_size, period=period, res_setting=res_setting))
+        # outputs in the order of inp
+        if if_cluster_job:
+            outs = [gjf_path.removesuffix('gjf')+'out' for gjf_path in inp]
+        else:
+            outs = [gjf_path[:-3]+'out' for gjf_path in inp]
+        if if_cluster_job and cluster_debug:
+            return outs, [jobs[out] for out in outs]
+        return outs
+
+    @classmethod
+    def iter_Run_QM(
+        cls, 
+        inp, 
+        prog: str = 'g16', 
+        if_cluster_job: bool = 1,
+        cluster: ClusterInterface = None,
+        job_array_size: int = 0,
+        period: int = 600,
+        res_setting: dict = None
+    ):
+        '''
+        Run QM with {prog} for {inp} files and yield (path of the output file, job) of each input once it ends.
+        (in the order of ending. job is the ClusterJob object or None for a local run)
+        Args:
+        inp:
+            an iterable of paths of input files. It can be lazy (e.g.: input files written in the background. 
+            see PDB2QMCluster(stream=1)): each input is submitted (or run) as soon as it is available
+            within the job_array_size.
+        see Run_QM for other args
+        '''
         if if_cluster_job:
             #san check
             if not isinstance(cluster, ClusterInterface):
                 raise TypeError('cluster job need a cluster (ClusterInterface object) input')
             
             if prog == 'g16':
-                outs = []
                 # config jobs
-                jobs = []
-                for gjf_path in inp:
-                    out_path = gjf_path.removesuffix('gjf')+'out'
-                    jobs.append(cls._make_single_g16_job(gjf_path, out_path, cluster, res_setting))
-                    outs.append(out_path)
+                outs = {}
+                def config_jobs():
+                    for gjf_path in inp:
+                        out_path = gjf_path.removesuffix('gjf')+'out'
+                        job = cls._make_single_g16_job(gjf_path, out_path, cluster, res_setting)
+                        outs[id(job)] = out_path
+                        yield job
                 # submit and run in array
                 if Config.debug > 0:
-                    print(f'''Running QM array on {cluster.NAME}: number: {len(jobs)} size: {job_array_size} period: {period}''')
-                job_manager.ClusterJob.wait_to_array_end(jobs, period, job_array_size)
-
-                if cluster_debug:
-                    return outs, jobs
-                return outs
+                    print(f'''Running QM array on {cluster.NAME}: size: {job_array_size} period: {period}''')
+                for job in job_manager.ClusterJob.iter_array_end(config_jobs(), period, job_array_size):
+                    yield outs.pop(id(job)), job
         else:
             # local job
-            if prog == 'g16':
-                outs = []
+            if prog in ['g16', 'g09']:
+                exe = Config.Gaussian.g16_exe if prog == 'g16' else Config.Gaussian.g09_exe
                 for gjf in inp:
                     out = gjf[:-3]+'out'
                     if Config.debug > 1:
-                        print('running: '+Config.Gaussian.g16_exe+' < '+gjf+' > '+out)
-                    os.system(Config.Gaussian.g16_exe+' < '+gjf+' > '+out)
-                    outs.append(out)
-                return outs
-
-            if prog == 'g09':
-                outs = []
-                for gjf in inp:
-                    out = gjf[:-3]+'out'
-                    if Config.debug > 1:
-                        print('running: '+Config.Gaussian.g09_exe+' < '+gjf+' > '+out)
-                    os.system(Config.Gaussian.g09_exe+' < '+gjf+' > '+out)
-                    outs.append(out)
-                return outs
+                        print('running: '+exe+' < '+gjf+' > '+out)
+                    os.system(exe+' < '+gjf+' > '+out)
+                    yield out, None
 
     @classmethod
     def _make_single_g16_job(
@@ -2709,7 +2802,7 @@ class PDB():
     QM Analysis 
     ========
     '''
-    def get_field_strength(self, atom_mask, a1=None, a2=None, bond_p1='center', p1=None, p2=None, d1=None):
+    def get_field_strength(self, atom_mask, a1=None, a2=None, bond_p1='center', p1=None, p2=None, d1=None, engine='numpy', window=20):
         '''
         use frame coordinate from *mdcrd* and MM charge from *prmtop* to calculate the field strength of *p1* along *p2-p1* or *d1*
         atoms in *atom_mask* is included. (TODO: or an exclude one?)
@@ -2723,26 +2816,28 @@ class PDB():
         p1:     the point where E is calculated
         p2:     a point to fix d1
         d1:     the direction E is projected
+        engine: numpy:  fields of all charges in every *window* frames are computed in one broadcast (see get_field_strengths)
+                python: sum helper.get_field_strength_value of each charge in each frame
         return an ensemble field strengths
+        (use get_field_strengths for many probes in one pass over the frames)
         '''
+        # san check
+        PDB._check_field_probe(a1, a2, bond_p1, p1, p2, d1)
+        if engine not in ['numpy', 'python']:
+            raise Exception('get_field_strength: engine can only be numpy or python')
+
+        if engine == 'numpy':
+            probe = {'a1': a1, 'a2': a2, 'bond_p1': bond_p1, 'p1': p1, 'p2': p2, 'd1': d1}
+            return self.get_field_strengths(atom_mask, [probe], window=window)[:, 0].tolist()
+
         Es = []
         chrg_list = PDB.get_charge_list(self.prmtop_path)
 
-        # san check
-        if a1 == None and p1 == None:
-            raise Exception('Please provide a 1nd atom (a1=...) or point (p1=...) where E is calculated ')
-        if a2 == None and p2 == None and d1 == None:
-            raise Exception('Please provide a 2nd atom (a2=...) or point (p2=...) or a direction (d1=...)')
-        if a1 == None and a2 == None and bond_p1 == 'center':
-            raise Exception('Please provide a both atom (a1=... a2=...) when bond_p1 = center; Or change bond_p1 to a1 to calculate E at a1')
-        if a1 != None and a2 != None and bond_p1 not in ['center', 'a1']:
-            raise Exception('Only support p1 selection in center or a1 now')
-
         if self.frames == None:
-            self.frames = Frame.fromMDCrd(self.mdcrd)
+            self.frames = self._get_frames()
 
         # decode atom mask (stru corresponding to mdcrd structures)
-        atom_list = decode_atom_mask(self.stru, atom_mask)
+        atom_list = decode_atom_mask(self._get_prmtop_stru(self.frames[0].coord), atom_mask)
 
         for frame in self.frames:
             #get p2
@@ -2767,6 +2862,97 @@ class PDB():
 
         return Es
 
+    def get_field_strengths(self, atom_mask, probes, by_residue=0, window=20):
+        '''
+        field strengths of many probes (bonds or points) in one pass over the frames (see get_field_strength)
+        The frames and the charge list are read once. For every *window* frames, fields of all charges at all probes
+        are computed in one broadcast. (memory: window * n_probe * n_charge)
+        -------------------------------------
+        atom_mask:  atoms of the charges included
+        probes:     a list of probe definitions. Each is a dict of a1, a2, bond_p1, p1, p2 and d1 of get_field_strength
+                    e.g.: [{'a1': 2000, 'a2': 2001}, {'a1': 2000, 'a2': 2005, 'bond_p1': 'a1'}, {'p1': (1.0, 2.0, 3.0), 'd1': (0.0, 0.0, 1.0)}]
+        by_residue: also decompose the field strengths by residues of the charges
+        -------------------------------------
+        return a (n_frame, n_probe) array of field strengths
+               if by_residue: (field strengths, a (n_frame, n_probe, n_residue) array of the contribution of each residue,
+                               a list of the residue ids)
+        '''
+        probes = [dict({'a1': None, 'a2': None, 'bond_p1': 'center', 'p1': None, 'p2': None, 'd1': None}, **probe) for probe in probes]
+        for probe in probes:
+            PDB._check_field_probe(**probe)
+        chrg_list = PDB.get_charge_list(self.prmtop_path)
+
+        if self.frames == None:
+            self.frames = self._get_frames()
+
+        # decode atom mask (stru corresponding to mdcrd structures)
+        stru = self._get_prmtop_stru(self.frames[0].coord)
+        atom_index = np.array(decode_atom_mask(stru, atom_mask), dtype=int) - 1
+        chrgs = np.array(chrg_list)[atom_index]
+        if by_residue:
+            # group the charges by residues
+            atom_rows = np.flatnonzero(np.isin(stru.get_atom_column('atom_id'), atom_index + 1))
+            resi_index = stru.get_atom_column('resi_index')[atom_rows]
+            order = np.argsort(resi_index, kind='stable')
+            atom_index, chrgs, resi_index = atom_index[order], chrgs[order], resi_index[order]
+            resi_starts = np.flatnonzero(np.diff(resi_index, prepend=-1))
+            resi_ids = stru.get_resi_column('id')[resi_index[resi_starts]].tolist()
+
+        Es = []
+        E_resis = []
+        for coords in iter_frame_chunks(self.frames, window=window):
+            probe_p1s, probe_d1s = zip(*(PDB._get_field_probe(coords, **probe) for probe in probes))
+            # (n, n_probe, n_charge)
+            E_atoms = get_field_strength_values(coords[:, np.newaxis, atom_index], chrgs, np.stack(probe_p1s, axis=1), np.stack(probe_d1s, axis=1))
+            Es.append(E_atoms.sum(axis=-1))
+            if by_residue:
+                E_resis.append(np.add.reduceat(E_atoms, resi_starts, axis=-1) if len(resi_starts) else E_atoms)
+        Es = np.concatenate(Es) if Es else np.zeros((0, len(probes)))
+        if by_residue:
+            E_resis = np.concatenate(E_resis) if E_resis else np.zeros((0, len(probes), len(resi_ids)))
+            return Es, E_resis, resi_ids
+        return Es
+
+    @staticmethod
+    def _check_field_probe(a1=None, a2=None, bond_p1='center', p1=None, p2=None, d1=None):
+        '''
+        san check of the arguments of a field strength probe (see get_field_strength)
+        '''
+        if a1 == None and p1 == None:
+            raise Exception('Please provide a 1nd atom (a1=...) or point (p1=...) where E is calculated ')
+        if a2 == None and p2 == None and d1 == None:
+            raise Exception('Please provide a 2nd atom (a2=...) or point (p2=...) or a direction (d1=...)')
+        if a1 == None and a2 == None and bond_p1 == 'center':
+            raise Exception('Please provide a both atom (a1=... a2=...) when bond_p1 = center; Or change bond_p1 to a1 to calculate E at a1')
+        if a1 != None and a2 != None and bond_p1 not in ['center', 'a1']:
+            raise Exception('Only support p1 selection in center or a1 now')
+
+    @staticmethod
+    def _get_field_probe(coords, a1=None, a2=None, bond_p1='center', p1=None, p2=None, d1=None):
+        '''
+        get the points and directions of a field strength probe (see get_field_strength) in frames of *coords* (n_frame, n_atom, 3)
+        return (n_frame, 3) arrays of p1 and d1
+        '''
+        n_frame = len(coords)
+        #get p2
+        if a2 != None:
+            p2 = coords[:, a2-1]
+        elif p2 is not None:
+            p2 = np.broadcast_to(np.asarray(p2, dtype=float), (n_frame, 3))
+        #get p1
+        if a1 != None and bond_p1 == 'a1':
+            p1 = coords[:, a1-1]
+        elif a1 != None and bond_p1 == 'center':
+            p1 = 0.5 * (coords[:, a1-1] + p2)
+        else:
+            p1 = np.broadcast_to(np.asarray(p1, dtype=float), (n_frame, 3))
+        #get d1
+        if d1 is None:
+            d1 = p2 - p1
+        else:
+            d1 = np.broadcast_to(np.asarray(d1, dtype=float), (n_frame, 3))
+        return p1, d1
+
     @classmethod
     def get_bond_dipole(cls, qm_fch_paths, a1, a2, prog='Multiwfn'):
         '''
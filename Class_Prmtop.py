@@ -0,0 +1,163 @@
+import os
+import re
+import mmap
+import numpy as np
+__doc__='''
+This module read Amber topology (.prmtop) files.
+-------------------------------------------------------------------------------------
+Class Prmtop
+-------------------------------------------------------------------------------------
+The file is memory-mapped and the offset of every %FLAG section is indexed in one scan.
+Sections are decoded into NumPy arrays by their %FORMAT on demand and kept in the object.
+Prmtop.fromPath(path) reuse the object of a same path in the process until the file is modified.
+-------------------------------------------------------------------------------------
+read_inpcrd(path): coordinates from an Amber ASCII coordinate file (.inpcrd/.rst7)
+* Format: https://ambermd.org/prmtop.pdf
+===============
+'''
+
+class Prmtop():
+    '''
+    an Amber topology file
+    -------------
+    Prmtop(path)
+    Prmtop.fromPath(path) (cached by the path. Validated by the mtime and size of the file)
+    -------------
+    path
+    flags: {FLAG: (fortran format str, data start offset, data end offset)}
+    -------------
+    Method
+    -------------
+    get_section(flag): decoded array of any section. (e.g.: CHARGE, ATOM_NAME, RESIDUE_POINTER, MASS, RADII)
+    get_n_atom()
+    get_charge(): charges in e
+    get_atom_type()
+    get_atom_name()
+    get_resi_pointer(): index of the first atom of each residue (from 0)
+    get_bonds(): (n_bond, 2) array of atom indexes (from 0)
+    '''
+
+    _cache = {}
+    _flag_pattern = re.compile(rb'^%FLAG[ \t]+(\S+)[^\n]*\n(?:%COMMENT[^\n]*\n)*%FORMAT\(([^)]*)\)[^\n]*\n', re.M)
+    _format_pattern = re.compile(r'([0-9]*)([aIE])([0-9]+)(?:\.[0-9]+)?')
+    # unit of CHARGE in prmtop: e * 18.2223 (http://ambermd.org/Questions/units.html)
+    charge_unit = 18.2223
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = b''
+        self.flags = {}
+        self._sections = {}
+        # index all sections: the data of a section ends at the next %FLAG
+        matches = list(self._flag_pattern.finditer(self._buffer))
+        for i, match in enumerate(matches):
+            end = matches[i+1].start() if i+1 < len(matches) else len(self._buffer)
+            self.flags[match.group(1).decode()] = (match.group(2).decode(), match.end(), end)
+
+    @classmethod
+    def fromPath(cls, path):
+        '''
+        get a Prmtop object of the path. Reuse the one read in this process if the file is not changed.
+        '''
+        abs_path = os.path.abspath(path)
+        f_stat = os.stat(abs_path)
+        key = (f_stat.st_mtime_ns, f_stat.st_size)
+        if abs_path not in cls._cache or cls._cache[abs_path][0] != key:
+            cls._cache[abs_path] = (key, cls(abs_path))
+        return cls._cache[abs_path][1]
+
+    '''
+    ====
+    Sections
+    ====
+    '''
+    def get_section(self, flag):
+        '''
+        decode a section by its %FORMAT. (cached)
+        return an array of int (I), float (E) or str (a)
+        '''
+        if flag not in self._sections:
+            if flag not in self.flags:
+                raise Exception('Prmtop: no section %FLAG '+flag+' in '+self.path)
+            fmt, start, end = self.flags[flag]
+            match = self._format_pattern.fullmatch(fmt.strip())
+            if match is None:
+                raise Exception('Prmtop: unsupported format '+fmt+' of %FLAG '+flag)
+            n_per_line, kind, width = int(match.group(1) or 1), match.group(2), int(match.group(3))
+            self._sections[flag] = self._decode(self._buffer[start:end], kind, width, n_per_line)
+        return self._sections[flag]
+
+    @staticmethod
+    def _decode(data, kind, width, n_per_line):
+        '''
+        cut fixed-width fields from the lines of a section
+        (n_per_line fields in each line: trailing spaces stripped from any line are padded back)
+        '''
+        line_width = width * n_per_line
+        lines = data.replace(b'\r', b'').rstrip(b'\n').split(b'\n')
+        if max(len(line) for line in lines) > line_width:
+            raise Exception('Prmtop: a line is longer than '+str(n_per_line)+' fields of width '+str(width))
+        # the last line may hold fewer fields
+        last = lines[-1].ljust(-(-len(lines[-1]) // width) * width)
+        data = b''.join([line.ljust(line_width) for line in lines[:-1]]) + last
+        fields = np.frombuffer(data, dtype='S'+str(width))
+        if kind == 'I':
+            return fields.astype(int)
+        if kind == 'E':
+            return fields.astype(float)
+        return np.char.strip(fields).astype(str)
+
+    def get_n_atom(self):
+        return int(self.get_section('POINTERS')[0])
+
+    def get_charge(self):
+        '''
+        return an array of atomic charges in e
+        '''
+        return self.get_section('CHARGE') / self.charge_unit
+
+    def get_atom_type(self):
+        return self.get_section('AMBER_ATOM_TYPE')
+
+    def get_atom_name(self):
+        return self.get_section('ATOM_NAME')
+
+    def get_resi_pointer(self):
+        '''
+        return an array of the index of the first atom of each residue (from 0)
+        '''
+        return self.get_section('RESIDUE_POINTER') - 1
+
+    def get_bonds(self):
+        '''
+        return a (n_bond, 2) array of bonded atom indexes (from 0). Bonds with H come first.
+        '''
+        bonds = [self.get_section(flag).reshape(-1, 3)[:, :2] for flag in ('BONDS_INC_HYDROGEN', 'BONDS_WITHOUT_HYDROGEN')]
+        # prmtop stores 3*(index) for the coordinate array
+        return np.concatenate(bonds) // 3
+
+    def __reduce__(self):
+        # the memory map is not picklable: reopen the file
+        return (type(self), (self.path,))
+
+    def __repr__(self):
+        return 'Prmtop('+repr(self.path)+')'
+
+
+def read_inpcrd(path):
+    '''
+    read coordinates from an Amber ASCII coordinate file (.inpcrd/.rst7)
+    (title, number of atoms, 6F12.7 coordinates, then optional velocities/box)
+    return a (N, 3) array
+    '''
+    with open(path) as f:
+        f.readline()
+        n_atom = int(f.readline().split()[0])
+        n_line = -(-n_atom*3 // 6)
+        data = ''.join([f.readline().rstrip('\r\n').ljust(72) for i in range(n_line)])
+    fields = np.frombuffer(data.encode(), dtype='S12')[:n_atom*3]
+    return fields.astype(float).reshape(n_atom, 3)
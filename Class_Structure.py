@@ -1,9 +1,14 @@
 import numpy as np
 import os, re
-from math import ceil
-from Class_line import PDB_line
+import itertools
+from multiprocessing import shared_memory
+from Class_line import PDB_line, PDB_columns
 from Class_Conf import Config
-from helper import Child, get_center, get_distance, line_feed, mkdir
+from Class_AmberMask import AmberMask
+from Class_Prmtop import Prmtop, read_inpcrd
+from Class_ONIOM_Frame import QMSelection
+from helper import Child, BondGraph, CellList, get_center, get_distance, line_feed, mkdir
+from helper import get_bond_components, gc_paused, get_file_hash, load_array_cache, save_array_cache
 from AmberMaps import *
 try:
     import openbabel
@@ -30,6 +35,9 @@ Class Solvent
 ===============
 '''
 
+# a residue list of get_sele_list (ids, id ranges and chain-prefixed ids): e.g.: :108,298  :A12,B3  :1-5,A12
+resi_list_pattern = r':\s*(?:[A-Z]?[0-9]+|[0-9]+-[0-9]+)(?:\s*,\s*(?:[A-Z]?[0-9]+|[0-9]+-[0-9]+))*\s*'
+
 class Structure():
     '''
     initilize from
@@ -41,6 +49,8 @@ class Structure():
     ligands = [ligand, ...]
     solvents = [solvent, ...]
     # maybe add solvent in the future. mimic the metal treatment
+    coords = (N, 3) array of all atoms. (chains -> ligands -> metalatoms -> solvents, the order of build())
+             Atom.coord is a view of the corresponding row.
     ------------
     METHOD
     ------------
@@ -60,7 +70,21 @@ class Structure():
 
     protonation_metal_fix
 
+    get_bond_graph (CSR bond graph in the order of coords. cached)
+    get_connect
+    get_connectivty_table
+
     get_all_protein_atom
+    get_all_residue_unit
+    get_residue
+    get_atom
+    get_atom_id
+    get_atom_index
+    get_atoms
+    get_atom_resi_index
+    translate
+    get_geo_center
+    share_coords
 
     ---------
     Special Method
@@ -104,8 +128,26 @@ class Structure():
             self.solvents.append(solvent)
         self.name = name
 
+        # version of the structure. Bumped by add/sort/deletion
+        self._version = 0
+        self._topo_version = 0
+        # coordinate storage
+        self._pack_key = None
+        self._pack()
+        # flat registry of residues and atoms
+        self._registry = None
+        self._registry_key = None
+        # spatial index of coords
+        self._cell_list = None
+        # bond graph (and bonds from a prmtop as (atom id, atom id) pairs if built from it)
+        self._bond_graph = None
+        self._bond_graph_key = None
+        self._prmtop_bonds = None
+        # the Prmtop object if built from it (see fromPrmtop)
+        self.prmtop = None
+
     @classmethod
-    def fromPDB(cls, input_obj, input_type='path', input_name = None, ligand_list = None):
+    def fromPDB(cls, input_obj, input_type='path', input_name = None, ligand_list = None, cache_path = None):
         '''
         extract the structure from PDB path. Capable with raw experimental and Amber format
         ---------
@@ -113,6 +155,9 @@ class Structure():
             split the file_str to chain and init each chain
         ligand_list: ['NAME',...]
             User specific ligand names. Only extract these if provided. 
+        cache_path: a folder to cache the parsed structure. (e.g.: PDB.cache_path)
+            A snapshot of arrays is saved under cache_path/stru/ and keyed by the hash of the file and ligand_list.
+            A same file is loaded from the snapshot instead of parsing the text. (switch: Config.stru_cache)
         ---------
         Target:
         - structure(w/name)  - chain - residue - atom
@@ -131,15 +176,95 @@ class Structure():
             file_str = input_obj.read()
         if input_type == 'file_str':
             file_str = input_obj
+
+        # check the cache
+        if_cache = cache_path is not None and Config.stru_cache
+        if if_cache:
+            cache_dir = cache_path+'/stru'
+            cache_key = get_file_hash(file_str, repr(ligand_list), str(cls._snapshot_version))
+            snapshot = load_array_cache(cache_dir, cache_key)
+            if snapshot is not None:
+                if Config.debug > 1:
+                    print('Structure.fromPDB: load from cache '+cache_dir+'/'+cache_key+'.npz')
+                with gc_paused():
+                    return cls._from_snapshot(snapshot, input_name)
         
-        raw_chains = []
         # get raw chains
-        chains_str = file_str.split(line_feed+'TER') # Note LF is required
-        for index, chain_str in enumerate(chains_str):
-            if chain_str.strip() != 'END' and chain_str.strip() != '':
-                Chain_index = chr(65+index) # Covert to ABC using ACSII mapping
-                # Generate chains
-                raw_chains.append(Chain.fromPDB(chain_str, Chain_index))
+        raw_chains = cls._get_raw_chains(PDB_columns.fromstr(file_str))
+        stru = cls._fromRawChains(raw_chains, input_name, ligand_list)
+        if if_cache:
+            save_array_cache(cache_dir, cache_key, stru._get_snapshot(), max_size=Config.stru_cache_size)
+        return stru
+
+    @classmethod
+    def fromPrmtop(cls, prmtop, coords, input_name = None, ligand_list = None, atom_index = None):
+        '''
+        build the structure from an Amber topology and coordinates. (no PDB round-trip)
+        The atom order is the same as the prmtop and thus the MD frames by construction.
+        ---------
+        prmtop: path of a .prmtop file or a Prmtop object
+        coords: (N, 3) coordinates in the atom order of the prmtop. (e.g.: Frame.coord of a mdcrd)
+                or path of an Amber ASCII coordinate file (.inpcrd/.rst7)
+        ligand_list: ['NAME',...] same as fromPDB
+        atom_index: only build these atoms (0-based index. e.g.: the solute kept in a stripped trajectory)
+                    atom/residue ids are still those of the full system and bonds to the other atoms are dropped.
+        ---------
+        atom/residue: ATOM_NAME / RESIDUE_LABEL and RESIDUE_POINTER. ids are the index in the prmtop (from 1)
+        chain: one raw chain for each molecule (ATOMS_PER_MOLECULE or connected atoms by BONDS_*),
+               named by the order (A, B, C, ...) like the TER segments of a PDB from ambpdb.
+        metal/ligand/solvent: same as fromPDB
+        connectivity: BONDS_* are used by get_bond_graph/get_connect instead of templates/prepin files.
+                      (atom.connect is only filled upon get_connect)
+        stru.prmtop: the Prmtop object
+        '''
+        if not isinstance(prmtop, Prmtop):
+            prmtop = Prmtop.fromPath(prmtop)
+        if isinstance(coords, str):
+            coords = read_inpcrd(coords)
+        n_atom = prmtop.get_n_atom()
+        coords = np.array(coords, dtype=float).reshape(-1, 3)
+        if len(coords) != n_atom:
+            raise Exception('Structure.fromPrmtop: '+str(len(coords))+' coordinates do not match '+str(n_atom)+' atoms in '+prmtop.path)
+
+        # per atom columns
+        resi_pointer = prmtop.get_resi_pointer()
+        resi_size = np.diff(np.append(resi_pointer, n_atom))
+        resi_index = np.repeat(np.arange(len(resi_pointer)), resi_size)
+        bonds = prmtop.get_bonds()
+        if 'ATOMS_PER_MOLECULE' in prmtop.flags:
+            mol_size = prmtop.get_section('ATOMS_PER_MOLECULE')
+            mol_index = np.repeat(np.arange(len(mol_size)), mol_size)
+        else:
+            mol_index = get_bond_components(n_atom, bonds)
+        atom_id = np.arange(1, n_atom+1)
+        atom_name = prmtop.get_atom_name()
+        if atom_index is not None:
+            atom_index = np.asarray(atom_index, dtype=int)
+            if_kept = np.zeros(n_atom, dtype=bool)
+            if_kept[atom_index] = True
+            bonds = bonds[if_kept[bonds].all(axis=1)]
+            atom_id, atom_name, resi_index, mol_index, coords = (
+                atom_id[atom_index], atom_name[atom_index], resi_index[atom_index], mol_index[atom_index], coords[atom_index])
+        pdb_cols = PDB_columns(atom_id = atom_id,
+                               atom_name = atom_name,
+                               resi_name = prmtop.get_section('RESIDUE_LABEL')[resi_index],
+                               resi_id = resi_index + 1,
+                               chain_id = np.full(len(atom_id), ' '),
+                               coord = coords,
+                               element = np.full(len(atom_id), ''),
+                               chain_index = mol_index)
+        stru = cls._fromRawChains(cls._get_raw_chains(pdb_cols), input_name, ligand_list)
+
+        # connectivity (used upon request)
+        stru._prmtop_bonds = bonds + 1
+        stru.prmtop = prmtop
+        return stru
+
+    @classmethod
+    def _fromRawChains(cls, raw_chains, input_name = None, ligand_list = None):
+        '''
+        clean raw chains to chains, metalatoms, ligands and solvents and make the structure
+        '''
         # clean chains
         # clean metals
         raw_chains_woM, metalatoms = cls._get_metalatoms(raw_chains, method='1')
@@ -159,6 +284,202 @@ class Structure():
 
         return cls(raw_chains_woM_woL_woS, metalatoms, ligands, solvents, input_name)
 
+    # bump when the snapshot layout changes
+    _snapshot_version = 1
+
+    def _get_snapshot(self, if_extra=0):
+        '''
+        get a dict of arrays that describes the structure (used by the fromPDB cache, copy and subset)
+        residue units in the order of self.coords: chain residues -> ligands -> metalatoms -> solvents
+        -----
+        chain_id    : id of each chain
+        unit_kind   : 0 residue / 1 ligand / 2 metalatom / 3 solvent
+        unit_chain  : index of the chain of residues (-1 for others)
+        unit_id     : id of units
+        unit_name   : name of units (resi_name for metalatoms)
+        unit_size   : number of atoms of units
+        net_charge  : net charge of ligands (nan for None)
+        atom_name, atom_id, atom_ff, coord : per atom data
+        if_extra: 1: also atom_ele, atom_type ('' for None) and atom_charge (nan for None)
+        '''
+        self._check_pack()
+        units = self._resi_units
+        unit_chain = []
+        for index, chain in enumerate(self.chains):
+            unit_chain.extend([index]*len(chain))
+        unit_chain.extend([-1]*(len(units)-len(unit_chain)))
+        net_charge = [np.nan if type(unit) != Ligand or unit.net_charge is None else unit.net_charge for unit in units]
+        snapshot = {
+            'chain_id'   : np.array([chain.id for chain in self.chains], dtype=str),
+            'unit_kind'  : self.get_resi_column('kind'),
+            'unit_chain' : np.array(unit_chain, dtype=int),
+            'unit_id'    : np.array([unit.id for unit in units], dtype=int),
+            'unit_name'  : self.get_resi_column('name'),
+            'unit_size'  : np.bincount(self._atom_resi_index, minlength=len(units)),
+            'net_charge' : np.array(net_charge, dtype=float),
+            'atom_name'  : self.get_atom_column('atom_name'),
+            'atom_id'    : np.array([atom.id for atom in self._atoms], dtype=int),
+            'atom_ff'    : np.array([atom.ff for atom in self._atoms], dtype=str),
+            'coord'      : self._coords,
+        }
+        if if_extra:
+            atoms = self._atoms
+            snapshot['atom_ele'] = np.array(['' if atom.ele is None else atom.ele for atom in atoms], dtype=str)
+            snapshot['atom_type'] = self.get_atom_column('type')
+            snapshot['atom_charge'] = np.array([np.nan if atom.charge is None else atom.charge for atom in atoms], dtype=float)
+        return snapshot
+
+    @classmethod
+    def _from_snapshot(cls, snapshot, name=None):
+        '''
+        build a structure from the arrays of _get_snapshot
+        '''
+        # share one str object for each distinct name
+        atom_names = snapshot['atom_name'].tolist()
+        uni_names = {n: n for n in set(atom_names)}
+        atom_names = [uni_names[n] for n in atom_names]
+        uni_ffs = {f: f for f in set(snapshot['atom_ff'].tolist())}
+        atom_ffs = [uni_ffs[f] for f in snapshot['atom_ff'].tolist()]
+        atom_ids = snapshot['atom_id'].tolist()
+        coords = snapshot['coord'].tolist()
+
+        chains = [Chain([], chain_id) for chain_id in snapshot['chain_id'].tolist()]
+        metalatoms = []
+        ligands = []
+        solvents = []
+        unit_data = zip(snapshot['unit_kind'].tolist(), snapshot['unit_chain'].tolist(), snapshot['unit_id'].tolist(),
+                        snapshot['unit_name'].tolist(), snapshot['unit_size'].tolist(), snapshot['net_charge'].tolist())
+        start = 0
+        for kind, chain_index, unit_id, unit_name, size, net_charge in unit_data:
+            end = start + size
+            if kind == 2:
+                metalatoms.append(Metalatom(atom_names[start], unit_name, coords[start], atom_ffs[start], id=atom_ids[start]))
+            else:
+                atoms = [Atom(atom_names[i], coords[i], atom_ffs[i], atom_id=atom_ids[i]) for i in range(start, end)]
+                if kind == 0:
+                    residue = Residue(atoms, unit_id, unit_name)
+                    residue.set_parent(chains[chain_index])
+                    chains[chain_index].residues.append(residue)
+                elif kind == 1:
+                    ligands.append(Ligand(atoms, unit_id, unit_name, net_charge=None if np.isnan(net_charge) else net_charge))
+                else:
+                    solvents.append(Solvent(atoms, unit_id, unit_name))
+            start = end
+
+        stru = cls(chains, metalatoms, ligands, solvents, name)
+        if 'atom_ele' in snapshot:
+            # Metalatom.ele is set by its resi_name
+            extra_data = zip(stru._atoms, snapshot['atom_ele'].tolist(), snapshot['atom_type'].tolist(), snapshot['atom_charge'].tolist())
+            for atom, ele, atom_type, charge in extra_data:
+                if ele != '' and type(atom) != Metalatom:
+                    atom.ele = ele
+                if atom_type != '':
+                    atom.type = atom_type
+                if not np.isnan(charge):
+                    atom.charge = charge
+        return stru
+
+    def copy(self, name=None):
+        '''
+        return an independent copy of the structure (new objects with parent links and coordinates of their own)
+        copied: chains, residues, ligands (w/ net_charge), metalatoms, solvents and atom name/id/ff/ele/type/charge/coord
+        * connectivity and other derived data (e.g.: atom.connect, metal donors) are not copied. Rerun the getters if needed.
+        name: name of the copy (self.name by default)
+        '''
+        return self.subset(name=name)
+
+    def subset(self, chains=None, ligands=None, metalatoms=None, solvents=None, mask=None, name=None):
+        '''
+        return a new structure with a part of the structure. (copied as in copy())
+        chains     : list of chain ids to keep. (e.g.: ['A', 'B'])
+        ligands    : list of ligand ids (int) or names (str) to keep.
+        metalatoms : list of metalatom ids (int) or resi_names (str) to keep.
+        solvents   : list of solvent ids (int) or names (str) to keep.
+                     (None for keeping all of the kind and [] for none)
+        mask       : an Amber mask str. Only keep selected atoms within the above. (e.g.: '!@/H')
+        name       : name of the new structure (self.name by default)
+        '''
+        snapshot = self._get_snapshot(if_extra=1)
+        unit_kind = snapshot['unit_kind']
+        unit_id = snapshot['unit_id']
+        unit_name = snapshot['unit_name']
+
+        # select units
+        if_unit = np.ones(len(unit_kind), dtype=bool)
+        if chains is not None:
+            chain_ids = snapshot['chain_id']
+            if_chain = np.isin(chain_ids, [str(c_id) for c_id in chains])
+            if_unit[unit_kind == 0] = if_chain[snapshot['unit_chain'][unit_kind == 0]]
+        for kind, keys in ((1, ligands), (2, metalatoms), (3, solvents)):
+            if keys is not None:
+                ids = [key for key in keys if type(key) == int]
+                names = [key for key in keys if type(key) == str]
+                if_kind = unit_kind == kind
+                if_unit[if_kind] = np.isin(unit_id[if_kind], ids) | np.isin(unit_name[if_kind], names)
+
+        # select atoms
+        if_atom = np.repeat(if_unit, snapshot['unit_size'])
+        if mask is not None:
+            if_atom &= AmberMask.compile(mask).eval(self)
+
+        # cut the snapshot
+        atom_unit = np.repeat(np.arange(len(unit_kind)), snapshot['unit_size'])
+        unit_size = np.bincount(atom_unit[if_atom], minlength=len(unit_kind))
+        if_unit &= unit_size > 0
+        if_chain = np.zeros(len(snapshot['chain_id']), dtype=bool)
+        if_chain[snapshot['unit_chain'][if_unit & (unit_kind == 0)]] = True
+        chain_map = np.cumsum(if_chain) - 1
+
+        sub_snapshot = {}
+        for key, value in snapshot.items():
+            if key.startswith('unit_') or key == 'net_charge':
+                sub_snapshot[key] = value[if_unit]
+            elif key == 'chain_id':
+                sub_snapshot[key] = value[if_chain]
+            else:
+                sub_snapshot[key] = value[if_atom]
+        sub_snapshot['unit_size'] = unit_size[if_unit]
+        sub_chain = sub_snapshot['unit_chain']
+        sub_snapshot['unit_chain'] = np.where(sub_chain >= 0, chain_map[sub_chain], -1)
+
+        if name is None:
+            name = self.name
+        with gc_paused():
+            return self._from_snapshot(sub_snapshot, name)
+
+
+    @classmethod
+    def _get_raw_chains(cls, pdb_cols):
+        '''
+        build raw chains from the decoded columns of a PDB file (PDB_columns)
+        -----
+        Chains are seperated by TER lines and named by their order in the file (A, B, C, ...).
+        A new residue begins when the residue id changes within a chain.
+        Chains without any ATOM/HETATM record are not built.
+        '''
+        # share one str object for each distinct name
+        uni_names, name_index = np.unique(pdb_cols.atom_name, return_inverse=True)
+        uni_names = uni_names.tolist()
+        names = [uni_names[i] for i in name_index.tolist()]
+        uni_r_names, r_name_index = np.unique(pdb_cols.resi_name, return_inverse=True)
+        uni_r_names = uni_r_names.tolist()
+        r_names = [uni_r_names[i] for i in r_name_index.tolist()]
+        a_ids = pdb_cols.atom_id.tolist()
+        coords = pdb_cols.coord.tolist()
+        r_ids = pdb_cols.resi_id.tolist()
+        c_indexes = pdb_cols.chain_index.tolist()
+        bounds = pdb_cols.get_resi_bounds().tolist()
+
+        chain_residues = {}
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            atoms = [Atom(names[i], coords[i], 'Amber', atom_id=a_ids[i]) for i in range(start, end)]
+            residue = Residue(atoms, r_ids[start], r_names[start])
+            chain_residues.setdefault(c_indexes[start], []).append(residue)
+
+        raw_chains = []
+        for index, residues in chain_residues.items():
+            raw_chains.append(Chain(residues, chr(65+index))) # Covert to ABC using ACSII mapping
+        return raw_chains
 
     @classmethod
     def _get_metalatoms(cls, raw_chains, method='1'):
@@ -283,6 +604,126 @@ class Structure():
 
         return raw_chains, solvents
 
+    '''
+    ====
+    Coordinates
+    ====
+    '''
+    def _touch(self, topology=1):
+        '''
+        bump the version of the structure. Called by children when they are added/deleted/sorted.
+        topology: 1 - children are added/deleted/reordered (also invalid the packed coordinates)
+                  0 - only ids are changed
+        '''
+        self._version += 1
+        if topology:
+            self._topo_version += 1
+
+    def _get_pack_key(self):
+        '''
+        the packed arrays are valid as long as this key does not change.
+        (list lengths cover direct operations on self.chains, etc.)
+        '''
+        return (self._topo_version, len(self.chains), len(self.ligands), len(self.metalatoms), len(self.solvents))
+
+    def _pack(self):
+        '''
+        collect all atoms into a contiguous (N, 3) coordinate array and per-atom index arrays.
+        Atoms are in the order of build(): chains -> ligands -> metalatoms -> solvents
+        -----
+        self._atoms           : [atom, ...]
+        self._resi_units      : [residue/ligand/metalatom/solvent, ...]
+        self._atom_resi_index : index of the residue unit of each atom
+        self._coords          : (N, 3) array. Atom.coord of each atom is pointed to its row.
+        '''
+        resi_units = []
+        for chain in self.chains:
+            resi_units.extend(chain.residues)
+        resi_units.extend(self.ligands)
+        resi_units.extend(self.metalatoms)
+        resi_units.extend(self.solvents)
+
+        atoms = []
+        atom_resi_index = []
+        for index, unit in enumerate(resi_units):
+            if isinstance(unit, Metalatom):
+                atoms.append(unit)
+                atom_resi_index.append(index)
+            else:
+                atoms.extend(unit.atoms)
+                atom_resi_index.extend([index]*len(unit.atoms))
+
+        coords = np.array([atom.coord for atom in atoms], dtype=float).reshape(len(atoms), 3)
+
+        self._atoms = atoms
+        self._resi_units = resi_units
+        self._atom_resi_index = np.array(atom_resi_index, dtype=int)
+        self._bind_coords(coords)
+        self._pack_key = self._get_pack_key()
+
+    def _bind_coords(self, coords):
+        '''
+        use coords as the coordinate array and point Atom.coord to its rows
+        '''
+        for atom, coord in zip(self._atoms, coords):
+            atom._coord = coord
+        self._coords = coords
+
+    def _check_pack(self):
+        if self._pack_key != self._get_pack_key():
+            self._pack()
+
+    @property
+    def coords(self):
+        '''
+        (N, 3) coordinate array of all atoms in the order of get_atoms()
+        Edit in place to move atoms. (e.g.: stru.coords[:] = new_coords)
+        '''
+        self._check_pack()
+        return self._coords
+
+    def get_atoms(self):
+        '''
+        return a list of all atoms in the order of the rows in self.coords
+        '''
+        self._check_pack()
+        return list(self._atoms)
+
+    def get_atom_resi_index(self):
+        '''
+        return an array of the index of the residue unit of each atom in self.coords
+        (residue units: chain residues -> ligands -> metalatoms -> solvents)
+        '''
+        self._check_pack()
+        return self._atom_resi_index
+
+    def translate(self, vector):
+        '''
+        move the whole structure by vector
+        '''
+        coords = self.coords
+        coords += np.asarray(vector, dtype=float)
+
+    def get_geo_center(self):
+        '''
+        return the geometric center of all atoms
+        '''
+        return tuple(self.coords.mean(axis=0))
+
+    def share_coords(self):
+        '''
+        move the coordinate array to a shared memory block. Other processes can then map it without copying:
+            shm = SharedMemory(name); coords = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        The caller is responsible for close() and unlink() of the returned SharedMemory.
+        * Adding/deleting atoms after this moves the coordinates back to a private array.
+        '''
+        coords = self.coords
+        shm = shared_memory.SharedMemory(create=True, size=max(coords.nbytes, 1))
+        shared_coords = np.ndarray(coords.shape, dtype=float, buffer=shm.buf)
+        shared_coords[:] = coords
+        self._bind_coords(shared_coords)
+        return shm
+
     '''
     ====
     Methods
@@ -381,7 +822,8 @@ class Structure():
                 self.ligands.append(obj)
             if type(obj) == Solvent:
                 self.solvents.append(obj)
-            
+
+        self._touch()
         if sort:
             self.sort()
             
@@ -403,6 +845,7 @@ class Structure():
             residue.id within each above.
             list order within each residues.
         '''
+        self._touch(topology=if_local)
         if if_local:
             # sort chain order
             self.chains.sort(key=lambda chain: chain.id)
@@ -457,84 +900,7 @@ class Structure():
         '''
         with open(path, 'w') as of:
             if ff == 'AMBER':
-                if not keep_id:
-                    a_id = 0
-                    r_id = 0
-                    for chain in self.chains:
-                        #write chain
-                        for resi in chain:
-                            r_id = r_id+1
-                            for atom in resi:
-                                a_id = a_id + 1 #current line index
-                                line = atom.build(a_id= a_id, r_id = r_id, ff=ff, forcefield=forcefield)
-                                of.write(line)
-                        #write TER after each chain
-                        of.write('TER'+line_feed)
-
-                    c_id = chr(len(self.chains)+64)
-
-                    for ligand in self.ligands:
-                        r_id = r_id + 1
-                        c_id = chr(ord(c_id)+1)
-
-                        for atom in ligand:
-                            a_id = a_id + 1
-                            line = atom.build(a_id= a_id, r_id = r_id, c_id = c_id, ff=ff, forcefield=forcefield)
-                            of.write(line)
-                        of.write('TER'+line_feed)
-
-                    for metal in self.metalatoms:
-                        a_id = a_id + 1
-                        r_id = r_id + 1
-                        c_id = chr(ord(c_id)+1)
-
-                        line = metal.build(a_id= a_id, r_id = r_id, c_id = c_id, ff=ff, forcefield=forcefield)
-                        of.write(line)
-                        of.write('TER'+line_feed)
-
-                    if len(self.solvents) != 0:
-                        c_id = chr(ord(c_id)+1) # same chain_id for all solvent
-                        for solvent in self.solvents:
-                            r_id = r_id + 1
-                            for atom in solvent:
-                                a_id = a_id + 1
-                                line = atom.build(a_id= a_id, r_id = r_id, c_id = c_id, ff=ff, forcefield=forcefield)
-                                of.write(line)
-                        of.write('TER'+line_feed)
-
-                else:
-                    for chain in self.chains:
-                        #write chain
-                        for resi in chain:
-                            for atom in resi:
-                                line = atom.build(ff=ff, forcefield=forcefield)
-                                of.write(line)
-                        #write TER after each chain
-                        of.write('TER'+line_feed)
-
-                    c_id = chr(len(self.chains)+64)
-
-                    for ligand in self.ligands:
-                        c_id = chr(ord(c_id)+1)
-                        for atom in ligand:
-                            line = atom.build(c_id = c_id, ff=ff, forcefield=forcefield)
-                            of.write(line)
-                        of.write('TER'+line_feed)
-
-                    for metal in self.metalatoms:
-                        c_id = chr(ord(c_id)+1)
-                        line = metal.build(c_id = c_id, ff=ff, forcefield=forcefield)
-                        of.write(line)
-                        of.write('TER'+line_feed)
-
-                    if len(self.solvents) != 0:
-                        c_id = chr(ord(c_id)+1) # chain_id for all solvent
-                        for solvent in self.solvents:
-                            for atom in solvent:
-                                line = atom.build(c_id = c_id, ff=ff, forcefield=forcefield)
-                                of.write(line)
-                        of.write('TER'+line_feed)
-
+                of.write(self._get_amber_lines(forcefield=forcefield, keep_id=keep_id))
 
             if ff == 'XXX':
                 #place holder
@@ -542,6 +908,88 @@ class Structure():
                 
             of.write('END'+line_feed)
 
+    # ATOM line of Atom.build and Metalatom.build. name_field: atom name and residue name
+    _amber_line_template = 'ATOM  %5d %s %s%4d    %8.3f%8.3f%8.3f  1.00  0.00'+line_feed
+
+    def _get_amber_lines(self, forcefield='ff14SB', keep_id=0):
+        '''
+        format all atom lines of build() in batch (same as calling Atom.build for each atom)
+        Columns are collected from the packed arrays and each segment (chain/ligand/metal/solvents) is
+        formatted by one % operation of a repeated line template.
+        return the str of lines (w/o END)
+        '''
+        atoms = self.get_atoms()
+        if forcefield != 'ff14SB' and len(atoms):
+            raise Exception('Only support ff14SB atom/resiude name now')
+        units = self._resi_units
+        resi_index = self.get_atom_resi_index().tolist()
+
+        # segments (end atom index, c_id). a TER line follows each segment
+        segments = []
+        c_ids = []
+        n_atom = 0
+        for chain in self.chains:
+            n_chain_atom = sum(len(resi.atoms) for resi in chain.residues)
+            c_ids.extend([chain.id]*n_chain_atom)
+            n_atom += n_chain_atom
+            segments.append((n_atom, chain.id))
+        c_id = chr(len(self.chains)+64)
+        for ligand in self.ligands:
+            c_id = chr(ord(c_id)+1)
+            c_ids.extend([c_id]*len(ligand.atoms))
+            n_atom += len(ligand.atoms)
+            segments.append((n_atom, c_id))
+        for metal in self.metalatoms:
+            c_id = chr(ord(c_id)+1)
+            c_ids.append(c_id)
+            n_atom += 1
+            segments.append((n_atom, c_id))
+        if len(self.solvents) != 0:
+            c_id = chr(ord(c_id)+1) # same chain_id for all solvent
+            c_ids.extend([c_id]*(len(atoms)-n_atom))
+            segments.append((len(atoms), c_id))
+
+        # name field of each distinct (atom name, residue name)
+        name_fields = []
+        name_map = {}
+        for atom, index in zip(atoms, resi_index):
+            if type(atom) == Metalatom:
+                key = (atom.name, atom.resi_name, 1)
+            else:
+                key = (atom.name, units[index].name, 0)
+            if key not in name_map:
+                a_name, r_name, if_metal = key
+                if if_metal:
+                    name_map[key] = '{:>2}'.format(a_name)+'   '+'{:<3}'.format(r_name)
+                elif len(a_name) > 3:
+                    name_map[key] = '{:<4}'.format(a_name)+' '+'{:>3}'.format(r_name)
+                else:
+                    name_map[key] = ' '+'{:<3}'.format(a_name)+' '+'{:>3}'.format(r_name)
+            name_fields.append(name_map[key])
+
+        if keep_id:
+            a_ids = [atom.id for atom in atoms]
+            unit_ids = [unit.id for unit in units]
+            r_ids = [unit_ids[index] for index in resi_index]
+        else:
+            a_ids = range(1, len(atoms)+1)
+            r_ids = [index+1 for index in resi_index]
+        x, y, z = self.coords.T.tolist()
+        fields = tuple(itertools.chain.from_iterable(zip(a_ids, name_fields, c_ids, r_ids, x, y, z)))
+        n_field = 7
+
+        lines = []
+        start = 0
+        for end, c_id in segments:
+            if keep_id and end - start == 1 and type(atoms[start]) == Metalatom:
+                # Metalatom do not have a residue id
+                lines.append(atoms[start].build(c_id=c_id, forcefield=forcefield))
+            elif end > start:
+                lines.append((self._amber_line_template * (end-start)) % fields[start*n_field:end*n_field])
+            lines.append('TER'+line_feed)
+            start = end
+        return ''.join(lines)
+
 
     def build_ligands(self, dir, ft='PDB', ifcharge=0 ,c_method='PYBEL', ph=7.0, ifname=0, ifunique=0):
         '''
@@ -631,9 +1079,10 @@ class Structure():
         return out_paths
 
 
-    def get_connect(self, metal_fix = 1, ligand_fix = 1, prepi_path=None):
+    def get_bond_graph(self, metal_fix = 1, ligand_fix = 1, prepi_path=None):
         '''
-        get connectivity
+        get the bond graph of atoms in the order of self.coords (a helper.BondGraph)
+        Built once and reused until the structure is changed. (add/sort/deletion or residue renaming)
         -----------------
         TREATMENT
         chain: based on connectivity map of each atom in each residue
@@ -641,63 +1090,105 @@ class Structure():
                     fix2: connect to donor atom (MCPB?)
         ligand: fix1: use antechamber generated prepin file to get connectivity.
                       according to https://ambermd.org/doc/prep.html the coordniate line will always start at the 11th line after 3 DUMM.
+        A structure from fromPrmtop use the BONDS_* sections of the prmtop for all atoms instead.
+        '''
+        atoms = self.get_atoms()
+        key = (self._version,) + self._get_pack_key() + (metal_fix, ligand_fix, repr(prepi_path), tuple(unit.name for unit in self._resi_units))
+        if self._bond_graph_key == key:
+            return self._bond_graph
+
+        if self._prmtop_bonds is not None:
+            index_map = self._get_registry()['index_map']
+            ids = self._prmtop_bonds
+            rows = np.full(ids.shape, -1, dtype=int)
+            if_mapped = ids < len(index_map)
+            rows[if_mapped] = index_map[ids[if_mapped]]
+            rows = rows[np.all(rows >= 0, axis=1)]
+            # neighbors in the order of the atom
+            edges = np.concatenate((rows, rows[:, ::-1]))
+            graph = BondGraph(len(atoms), edges[np.lexsort((edges[:, 1], edges[:, 0]))])
+        else:
+            # san check
+            if ligand_fix == 1 and prepi_path == None:
+                raise Exception('Ligand fix 1 requires prepin_path.')
+            if metal_fix == 2:
+                raise Exception('TODO: Still working on 2 right now')
+            row_map = {id(atom): i for i, atom in enumerate(atoms)}
+            edges = []
+            # chain & solvent part
+            for chain in self.chains:
+                for res in chain:
+                    for atom in res:
+                        i = row_map[id(atom)]
+                        edges.extend((i, row_map[id(cnt_atom)]) for cnt_atom in atom._get_template_connect())
+            for sol in self.solvents:
+                for atom in sol:
+                    i = row_map[id(atom)]
+                    edges.extend((i, row_map[id(cnt_atom)]) for cnt_atom in atom._get_template_connect())
+            # ligand
+            if ligand_fix == 1:
+                prepi_bonds = {}
+                for lig in self.ligands:
+                    if lig.name not in prepi_bonds:
+                        prepi_bonds[lig.name] = self._read_prepi_bonds(prepi_path[lig.name])
+                    index_pairs, name_pairs = prepi_bonds[lig.name]
+                    for a, b in index_pairs:
+                        i, j = row_map[id(lig[a])], row_map[id(lig[b])]
+                        edges.extend(((i, j), (j, i)))
+                    for name_a, name_b in name_pairs:
+                        i, j = row_map[id(lig._find_atom_name(name_a))], row_map[id(lig._find_atom_name(name_b))]
+                        edges.extend(((i, j), (j, i)))
+            graph = BondGraph(len(atoms), edges)
+
+        self._bond_graph = graph
+        self._bond_graph_key = key
+        return graph
+
+    @staticmethod
+    def _read_prepi_bonds(prepi_path):
+        '''
+        read bonds of a ligand from the prepin file
+        return ([(atom index, atom index), ...] from the coordinate lines (from 0), [(atom name, atom name), ...] from LOOP)
+        '''
+        index_pairs = []
+        name_pairs = []
+        with open(prepi_path) as f:
+            line_id = 0
+            if_loop = 0
+            for line in f:
+                line_id += 1
+                if line.strip() == '':
+                    if if_loop == 1:
+                        # switch off loop and break if first blank after LOOP encountered
+                        break
+                    continue
+                if if_loop:
+                    lp = line.strip().split()
+                    name_pairs.append((lp[0], lp[1]))
+                    continue
+                # loop connect starts at LOOP
+                if line.strip() == 'LOOP':
+                    if_loop = 1
+                    continue
+                # coord starts at 11th
+                if line_id >= 11:
+                    lp = line.strip().split()
+                    atom_id = int(lp[0])-3
+                    atom_cnt = int(lp[4])-3
+                    if atom_cnt != 0:
+                        index_pairs.append((atom_id-1, atom_cnt-1))
+        return index_pairs, name_pairs
+
+    def get_connect(self, metal_fix = 1, ligand_fix = 1, prepi_path=None):
         '''
-        # san check
-        if ligand_fix == 1 and prepi_path == None:
-            raise Exception('Ligand fix 1 requires prepin_path.')
-        # chain part
-        for chain in self.chains:
-            for res in chain:
-                for atom in res:
-                    atom.get_connect()
-        for sol in self.solvents:
-            for atom in sol:
-                atom.get_connect()
-        # metal
-        for metal in self.metalatoms:
-            metal.connect = []
-        if metal_fix == 1:
-            pass
-        if metal_fix == 2:
-            raise Exception('TODO: Still working on 2 right now')
-        
-        # ligand
-        # init
-        for lig in self.ligands:
-            for atom in lig:
-                atom.connect = []
-        # fix 1
-        if ligand_fix == 1:
-            for lig in self.ligands:
-                # read prepin for each ligand
-                with open(prepi_path[lig.name]) as f:
-                    line_id = 0
-                    if_loop = 0
-                    for line in f:
-                        line_id += 1
-                        if line.strip() == '':
-                            if if_loop == 1:
-                                # switch off loop and break if first blank after LOOP encountered
-                                if_loop = 0
-                                break
-                            continue
-                        if if_loop:
-                            lp = line.strip().split()
-                            lig._find_atom_name(lp[0]).connect.append(lig._find_atom_name(lp[1]))
-                            continue
-                        # loop connect starts at LOOP
-                        if line.strip() == 'LOOP':
-                            if_loop = 1
-                            continue
-                        # coord starts at 11th
-                        if line_id >= 11:
-                            lp = line.strip().split()
-                            atom_id = int(lp[0])-3
-                            atom_cnt = int(lp[4])-3
-                            if atom_cnt != 0:
-                                lig[atom_id-1].connect.append(lig[atom_cnt-1])
-                                lig[atom_cnt-1].connect.append(lig[atom_id-1])
-                            
+        get connectivity and save the list of connected Atom objects to atom.connect of every atom
+        (from get_bond_graph. see there for the TREATMENT)
+        '''
+        atoms = self.get_atoms()
+        graph = self.get_bond_graph(metal_fix, ligand_fix, prepi_path)
+        for atom, neighbors in zip(atoms, graph.get_neighbor_lists()):
+            atom.connect = [atoms[j] for j in neighbors]
+
 
     def get_connectivty_table(self, ff='GAUSSIAN', metal_fix = 1, ligand_fix = 1, prepi_path=None):
         '''
@@ -713,63 +1204,23 @@ class Structure():
         Use 1.0 for all connection.
             Amber force field in gaussian do not account in bond order. (Only UFF does.)
             Note that bond order less than 0.1 do not count in MM but only in opt redundant coordinate.
+        (atom.connect of every atom is also updated)
         '''
-        connectivty_table = ''
         # get connect for every atom in stru
         self.get_connect(metal_fix, ligand_fix, prepi_path)
+        graph = self._bond_graph
+
+        # san check: atoms are written in order (chain -> ligand -> metal -> solvent)
+        atom_ids = self.get_atom_column('atom_id')
+        if not np.array_equal(atom_ids, np.arange(1, len(atom_ids)+1)):
+            raise Exception('atom id error.')
 
         # write str in order
         # Note: Only write the connected atom with larger id
-        a_id = 0
-        for chain in self.chains:
-            for res in chain:
-                for atom in res:
-                    a_id += 1
-                    cnt_line = ' '+str(atom.id)
-                    # san check
-                    if atom.id != a_id:
-                        raise Exception('atom id error.')
-                    for cnt_atom in atom.connect:
-                        if cnt_atom.id > atom.id:
-                            cnt_line += ' '+str(cnt_atom.id)+' '+'1.0'
-                    connectivty_table += cnt_line+line_feed
-                        
-        for lig in self.ligands:
-            for atom in lig:
-                a_id += 1
-                cnt_line = ' '+str(atom.id)
-                # san check
-                if atom.id != a_id:
-                    raise Exception('atom id error.')
-                for cnt_atom in atom.connect:
-                    if cnt_atom.id > atom.id:
-                        cnt_line += ' '+str(cnt_atom.id)+' '+'1.0'
-                connectivty_table += cnt_line+line_feed
-
-        for atom in self.metalatoms:
-            a_id += 1
-            cnt_line = ' '+str(atom.id)
-            # san check
-            if atom.id != a_id:
-                raise Exception('atom id error.')
-            for cnt_atom in atom.connect:
-                if cnt_atom.id > atom.id:
-                    cnt_line += ' '+str(cnt_atom.id)+' '+'1.0'
-            connectivty_table += cnt_line+line_feed
-
-        for sol in self.solvents:
-            for atom in sol:
-                a_id += 1
-                cnt_line = ' '+str(atom.id)
-                # san check
-                if atom.id != a_id:
-                    raise Exception('atom id error.')
-                for cnt_atom in atom.connect:
-                    if cnt_atom.id > atom.id:
-                        cnt_line += ' '+str(cnt_atom.id)+' '+'1.0'
-                connectivty_table += cnt_line+line_feed
-
-        return connectivty_table
+        cnt_lines = [' '+str(a_id) for a_id in range(1, len(atom_ids)+1)]
+        for i, j in graph.get_pairs().tolist():
+            cnt_lines[i] += ' '+str(j+1)+' '+'1.0'
+        return ''.join([cnt_line+line_feed for cnt_line in cnt_lines])
 
 
     def protonation_metal_fix(self, Fix):
@@ -799,35 +1250,90 @@ class Structure():
         return True
 
 
+    def _get_registry(self):
+        '''
+        get the flat registry of residues and atoms. Rebuilt only when the structure version changes (add/sort/deletion)
+        -----
+        protein_atoms : [atom, ...] of chains
+        resi_units    : [residue unit, ...] chain residues -> ligands -> metalatoms
+        resi_by_id    : {id: [residue unit, ...]} of resi_units
+        sol_by_id     : {id: [solvent, ...]}
+        atom_by_id    : {id: atom}
+        atom_ids      : array of atom id in the order of self.coords (-1 for None)
+        index_map     : array maps atom id to the row index in self.coords (-1 for not found)
+        '''
+        key = (self._version,) + self._get_pack_key()
+        if self._registry_key == key:
+            return self._registry
+
+        atoms = self.get_atoms()
+        protein_atoms = []
+        resi_units = []
+        for chain in self.chains:
+            for resi in chain:
+                resi_units.append(resi)
+                protein_atoms.extend(resi.atoms)
+        resi_units.extend(self.ligands)
+        resi_units.extend(self.metalatoms)
+
+        resi_by_id = {}
+        for resi in resi_units:
+            resi_by_id.setdefault(resi.id, []).append(resi)
+        sol_by_id = {}
+        for sol in self.solvents:
+            sol_by_id.setdefault(sol.id, []).append(sol)
+
+        atom_by_id = {}
+        for atom in atoms:
+            atom_by_id.setdefault(atom.id, atom)
+        atom_ids = np.array([atom.id if type(atom.id) == int else -1 for atom in atoms], dtype=int)
+        valid = atom_ids >= 0
+        uni_ids, first_index = np.unique(atom_ids[valid], return_index=True)
+        index_map = np.full(uni_ids[-1]+1 if len(uni_ids) else 1, -1, dtype=int)
+        index_map[uni_ids] = np.flatnonzero(valid)[first_index]
+
+        self._registry = {
+            'protein_atoms' : protein_atoms,
+            'resi_units'    : resi_units,
+            'resi_by_id'    : resi_by_id,
+            'sol_by_id'     : sol_by_id,
+            'atom_by_id'    : atom_by_id,
+            'atom_ids'      : atom_ids,
+            'index_map'     : index_map,
+            'atom_id_list'  : None, # get_atom_id() order, filled upon usage
+        }
+        self._registry_key = key
+        return self._registry
+
+
     def get_all_protein_atom(self):
         '''
         get a list of all protein atoms
         return all_P_atoms 
         '''
-        all_P_atoms = []
-        for chain in self.chains:
-            for residue in chain:
-                all_P_atoms.extend(residue.atoms)
-        return all_P_atoms
+        return list(self._get_registry()['protein_atoms'])
 
 
     def get_all_residue_unit(self, ifsolvent=0):
-        all_r_list = []
-        for chain in self.chains:
-            for resi in chain:
-                all_r_list.append(resi)
-
-        for resi in self.ligands:
-            all_r_list.append(resi)
+        '''
+        return a list of all residue units: chain residues -> ligands -> metalatoms (-> solvents if ifsolvent)
+        '''
+        all_r_list = list(self._get_registry()['resi_units'])
+        if ifsolvent:
+            all_r_list.extend(self.solvents)
+        return all_r_list
 
-        for resi in self.metalatoms:
-            all_r_list.append(resi)
 
+    def _find_resi_units(self, id, ifsolvent=0):
+        '''
+        find residue units with the id (in the order of get_all_residue_unit)
+        return a list of found residue units
+        '''
+        registry = self._get_registry()
+        out_list = registry['resi_by_id'].get(id, [])
         if ifsolvent:
-            for resi in self.solvents:
-                all_r_list.append(resi)
-
-        return all_r_list
+            out_list = out_list + registry['sol_by_id'].get(id, [])
+        return list(out_list)
 
 
     def get_residue(self, id):
@@ -836,16 +1342,152 @@ class Structure():
         ----------
         return a residue object
         '''
-        all_resi = self.get_all_residue_unit()
-        for resi in all_resi:
-            if resi.id == int(id):
-                return resi
+        resi_list = self._get_registry()['resi_by_id'].get(int(id))
+        if resi_list:
+            return resi_list[0]
+
+
+    def get_atom(self, id):
+        '''
+        return the atom with the atom id (None if not found)
+        '''
+        return self._get_registry()['atom_by_id'].get(int(id))
+
+
+    def get_atom_index(self, ids):
+        '''
+        map atom ids to row indexes in self.coords
+        ids: an int or an array-like of int
+        ----------
+        return an int or an array of int
+        '''
+        index_map = self._get_registry()['index_map']
+        ids = np.asarray(ids, dtype=int)
+        if np.any(ids < 0) or np.any(ids >= len(index_map)) or np.any(index_map[ids] < 0):
+            raise Exception('get_atom_index: atom id not found in the structure')
+        result = index_map[ids]
+        if result.ndim == 0:
+            return int(result)
+        return result
+
+
+    def get_atom_column(self, key):
+        '''
+        per-atom data as an array in the order of self.coords.
+        key:
+            atom_id    : atom.id (-1 for None)
+            resi_index : index of the residue unit (see get_resi_column)
+            atom_name  : atom.name
+            ele        : element
+            type       : atom.type ('' for None)
+        (atom_id and resi_index are cached in the registry. The others are attributes that can be
+         set directly on the atoms and are collected in each call.)
+        '''
+        registry = self._get_registry()
+        col_key = 'atom_'+key
+        if col_key in registry:
+            return registry[col_key]
+        atoms = self.get_atoms()
+        if key == 'atom_id':
+            column = registry['atom_ids']
+        elif key == 'resi_index':
+            column = self.get_atom_resi_index()
+        elif key == 'atom_name':
+            return np.array([atom.name for atom in atoms], dtype=str)
+        elif key == 'ele':
+            for atom in atoms:
+                if atom.ele is None:
+                    atom.get_ele()
+            return np.array([atom.ele for atom in atoms], dtype=str)
+        elif key == 'type':
+            return np.array(['' if atom.type is None else atom.type for atom in atoms], dtype=str)
+        else:
+            raise Exception('get_atom_column: unknown key: '+str(key))
+        registry[col_key] = column
+        return column
+
+    def get_resi_column(self, key):
+        '''
+        per-residue-unit data as an array.
+        residue units: chain residues -> ligands -> metalatoms -> solvents (the order in self.coords)
+        key:
+            id   : resi.id (metalatom.id for metals, -1 for None)
+            kind : 0 residue / 1 ligand / 2 metalatom / 3 solvent
+            name : resi.name (metalatom.resi_name for metals)
+        (id and kind are cached in the registry. name is collected in each call since residues can be renamed directly.)
+        '''
+        registry = self._get_registry()
+        col_key = 'resi_'+key
+        if col_key in registry:
+            return registry[col_key]
+        self._check_pack()
+        units = self._resi_units
+        if key == 'id':
+            column = np.array([unit.id if type(unit.id) == int else -1 for unit in units], dtype=int)
+        elif key == 'kind':
+            n_resi = sum(len(chain) for chain in self.chains)
+            column = np.repeat([0, 1, 2, 3], [n_resi, len(self.ligands), len(self.metalatoms), len(self.solvents)])
+        elif key == 'name':
+            return np.array([unit.resi_name if type(unit) == Metalatom else unit.name for unit in units], dtype=str)
+        else:
+            raise Exception('get_resi_column: unknown key: '+str(key))
+        registry[col_key] = column
+        return column
+
+    def get_cell_list(self, cell_size=4.0):
+        '''
+        spatial index (helper.CellList) of self.coords.
+        Rebuilt only when atoms are added/deleted/moved or a different cell_size is required.
+        '''
+        coords = self.coords
+        cell_list = self._cell_list
+        if cell_list is None or cell_list.cell_size != cell_size or not np.array_equal(cell_list.coords, coords):
+            self._cell_list = CellList(coords, cell_size)
+        return self._cell_list
 
+    def get_atoms_within(self, center_index, cutoff):
+        '''
+        find atoms within the cutoff (Angstrom) of any center atom
+        center_index: row indexes in self.coords of center atoms
+        ---------
+        return a bool array over atoms in the order of self.coords
+        '''
+        result = np.zeros(len(self.coords), dtype=bool)
+        center_coords = self.coords[np.asarray(center_index, dtype=int)]
+        if len(center_coords):
+            atom_index = self.get_cell_list().query_ball(center_coords, cutoff)[1]
+            result[atom_index] = True
+        return result
+
+    def get_atoms_around(self, point, rad):
+        '''
+        find atoms within rad (Angstrom) of a point
+        ---------
+        return (row indexes in self.coords, distances) sorted by the distance
+        '''
+        atom_index, dists = self.get_cell_list().query_ball(point, rad)[1:]
+        order = np.argsort(dists, kind='stable')
+        return atom_index[order], dists[order]
+
+    def get_close_pairs(self, cutoff):
+        '''
+        find all atom pairs within the cutoff (Angstrom)
+        ---------
+        return (i, j, distance) arrays. i < j are row indexes in self.coords
+        '''
+        return self.get_cell_list().query_pairs(cutoff)
 
     def get_atom_id(self):
         '''
         return a list of id of all atoms in the structure
+        (chains -> metalatoms -> ligands -> solvents)
         '''
+        registry = self._get_registry()
+        if registry['atom_id_list'] is None:
+            registry['atom_id_list'] = self._get_atom_id_list()
+        return list(registry['atom_id_list'])
+
+    def _get_atom_id_list(self):
         atom_id_list = []
         for chain in self.chains:
             for res in chain:
@@ -886,28 +1528,7 @@ class Structure():
         requires generate the stru using !SAME! PDB as one that generate the prmtop. 
         '''
         # get type list
-        with open(prmtop_path) as f:
-            type_list=[]
-            line_index=0
-
-            for line in f:
-                
-                line_index=line_index+1 #current line
-                
-                if line.strip() == r'%FLAG POINTERS':
-                    format_flag=line_index
-                if line.strip() == r'%FLAG AMBER_ATOM_TYPE':
-                    type_flag=line_index
-
-                if 'format_flag' in dir():
-                    if line_index == format_flag+2:
-                        N_atom=int(line.split()[0])
-                        del format_flag
-                        
-                if 'type_flag' in dir():
-                    if line_index >= type_flag+2 and line_index <= type_flag+1+ceil(N_atom/5):
-                        for i in line.strip().split():
-                            type_list.append(i)
+        type_list = Prmtop.fromPath(prmtop_path).get_atom_type().tolist()
         # assign type to atom
         for chain in self.chains:
             for res in chain:
@@ -933,8 +1554,9 @@ class Structure():
         '''
         interface with class ONIOM_Frame. Generate a list for sele build. Make sure use same pdb as the one generate the frame.
         ------------
-        resi_list: selected residue list
-        atom_mask: atom selection with the standard grammer of Amber (incomplete)
+        atom_mask: atom selection with the standard grammer of Amber (see Class_AmberMask)
+                   selected atoms are in the order of the structure.
+                   a residue list (e.g.: :108,298 or with chain prefix :A12,B3) selects residues in the order of the list.
         fix_end: fix valence of the cut bond. (default: H)
                 - H: add H to where the original connecting atom is.
                     special fix for classical case:
@@ -942,7 +1564,7 @@ class Structure():
                 = Interface with write_sele_lines:
                     add {fix_flag+element_mark: coord} in sele_lines 
         ------------
-        return a sele list:
+        return a sele list: (a QMSelection. the labels are also compiled to index/element/link atom arrays)
         - Fixing atoms are labeled as qm_atom_id-qm_atom_cnt_id-distance
         - backbone atoms are marked as b at the end (for qmcluster charge calculation)
         - other atoms use _ as place holder
@@ -950,36 +1572,35 @@ class Structure():
         (PDB atom id -> QM atom id)
         '''
         sele_lines = {}
-        #decode atom_mask (maybe in helper later) TODO
-        resi_list = atom_mask[1:].strip().split(',')
-        all_resi_list = self.get_all_residue_unit()
-
-        # decode and get obj
-        sele_stru_objs=[]
-        for resi in resi_list:
-            chain_id = re.match('[A-Z]',resi)
-            resi_id = int(re.match('[0-9]+',resi).group(0))
-            if chain_id == None:
-                for resi in all_resi_list:
-                    if resi_id == resi.id:
-                        resi_obj = resi
-            else:
-                chain_id = chain_id.group(0)
-                resi_obj = self.chains[int(chain_id)-65]._find_resi_id(resi_id)
-
-            sele_stru_objs.append(resi_obj)
-
-        # combine the sele
-        sele_atoms = []
-        for obj in sele_stru_objs:
-            for atom in obj:
-                sele_atoms.append(atom)
+        atoms = self.get_atoms()
+        # decode atom_mask (to row indexes in self.coords)
+        if re.fullmatch(resi_list_pattern, atom_mask.strip()) is None:
+            sele_rows = np.flatnonzero(AmberMask.compile(atom_mask).eval(self)).tolist()
+        else:
+            # a residue list (chain prefix is supported. e.g.: :A12,B3,5-7): in the order of the list
+            row_map = {id(atom): i for i, atom in enumerate(atoms)}
+            sele_rows = []
+            for resi in atom_mask.strip()[1:].split(','):
+                resi = resi.strip()
+                if re.match('[A-Z]', resi) is None:
+                    resi_rows = np.flatnonzero(AmberMask.compile(':'+resi).eval(self)).tolist()
+                else:
+                    resi_obj = self.chains[ord(resi[0])-65]._find_resi_id(int(resi[1:]))
+                    resi_rows = [row_map[id(atom)] for atom in resi_obj]
+                sele_rows.extend(resi_rows)
+            sele_rows = list(dict.fromkeys(sele_rows))
 
+        # cut bonds: {row of the selected atom: [row of the unselected atom, ...]}
+        cut_bonds = {}
         if fix_end != None:
-            self.get_connect(prepi_path=prepi_path)
+            if_sele = np.zeros(len(atoms), dtype=bool)
+            if_sele[sele_rows] = True
+            for i, j in zip(*[rows.tolist() for rows in self.get_bond_graph(prepi_path=prepi_path).get_boundary(if_sele)]):
+                cut_bonds.setdefault(i, []).append(atoms[j])
 
         # operate on the sele objs
-        for atom in sele_atoms:
+        for row in sele_rows:
+            atom = atoms[row]
             # add current atom
             atom.get_ele()
             if type(atom.parent) != Ligand:
@@ -991,18 +1612,17 @@ class Structure():
                 sele_lines[str(atom.id)+'_'] = atom.ele
             
             if fix_end != None:
-                # search for cut bond
-                for cnt_atom in atom.connect:
-                    if not cnt_atom in sele_atoms:
-                        if fix_end == 'H':
-                            d_XH = X_H_bond_length[atom.name]
-                            label = '-'.join((str(atom.id),str(cnt_atom.id),str(d_XH)))
-                            fix_atom = 'H'
-                        if fix_end == 'Me':
-                            #TODO
-                            pass
-                        # write to sele_lines
-                        sele_lines[label] = fix_atom
+                # fix cut bonds
+                for cnt_atom in cut_bonds.get(row, []):
+                    if fix_end == 'H':
+                        d_XH = X_H_bond_length[atom.name]
+                        label = '-'.join((str(atom.id),str(cnt_atom.id),str(d_XH)))
+                        fix_atom = 'H'
+                    if fix_end == 'Me':
+                        #TODO
+                        pass
+                    # write to sele_lines
+                    sele_lines[label] = fix_atom
         # make sele_map (PDB atom id -> QM atom id)
         sele_map = {}
         for i, key in enumerate(sele_lines.keys()):
@@ -1014,7 +1634,7 @@ class Structure():
             print('Selected QM cluster atoms: ')
             print(sele_lines)
 
-        return sele_lines, sele_map
+        return QMSelection(sele_lines), sele_map
 
 
     def get_resi_dist(self, r1, r2, method='mass_center'):
@@ -1063,6 +1683,14 @@ class Structure():
         return len(self.chains)+len(self.metalatoms)+len(self.ligands)+len(self.solvents)
 
 
+    def __setstate__(self, state):
+        '''
+        atoms are unpickled with their own coord copies. Repack to share a single array again.
+        '''
+        self.__dict__.update(state)
+        self._pack()
+
+
     def __getitem__(self, i):
         '''
         pop four elements with fixed order
@@ -1100,6 +1728,7 @@ class Chain(Child):
     set_parent
     get_chain_seq(self)
     _find_resi_name
+    _find_resi_id (hashed by {resi.id: resi}. Rebuilt after add/delete/sort/change of resi.id)
     -------------
     Special method
     -------------
@@ -1115,6 +1744,7 @@ class Chain(Child):
     __len__
         len(obj) = len(obj.child_list)
     '''
+    __slots__ = ('residues', 'id', 'ifsorted', 'seq', 'seq_one', '_resi_index')
 
     '''
     ====
@@ -1141,6 +1771,7 @@ class Chain(Child):
 
         # init
         self.ifsorted = 0
+        self._resi_index = None
     
     @classmethod
     def fromPDB(cls, chain_input, chain_id, input_type='file_str'):
@@ -1229,6 +1860,7 @@ class Chain(Child):
                     if id != None:
                         i.id=id
             self.residues.extend(obj)
+            self._touch()
             
 
         # single building block
@@ -1246,6 +1878,7 @@ class Chain(Child):
                 if id != None:
                     obj.id=id
             self.residues.append(obj)
+            self._touch()
 
         if sort:
             self.sort()
@@ -1271,6 +1904,7 @@ class Chain(Child):
             # TODO
         
         self.residues.sort(key=lambda i: i.id)
+        self._touch()
         # re-id each residue
         for index, resi in enumerate(self.residues):
             resi.id = index+1
@@ -1371,14 +2005,36 @@ class Chain(Child):
         find residues according to the id
         return a found residue
         ''' 
-        out_list = []
-        for resi in self.residues:
-            if resi.id == id:
-                out_list.append(resi)
-        if len(out_list) > 1:
-            print('\033[32;0mShould there be same residue id in chain +'+self.name+str(self.id)+'?+\033[0m')
+        resi = self._get_resi_index().get(id)
+        if resi is None:
+            raise IndexError('no residue with id '+str(id)+' in chain '+str(self.id))
+        if type(resi) == list:
+            print('\033[32;0mShould there be same residue id in chain +'+str(self.id)+'?+\033[0m')
             raise Exception
-        return out_list[0]
+        return resi
+
+    def _get_resi_index(self):
+        '''
+        get the {resi.id: resi} index. (a list of residues for a duplicated id)
+        '''
+        if self._resi_index is None:
+            index = {}
+            for resi in self.residues:
+                if resi.id in index:
+                    if type(index[resi.id]) != list:
+                        index[resi.id] = [index[resi.id]]
+                    index[resi.id].append(resi)
+                else:
+                    index[resi.id] = resi
+            self._resi_index = index
+        return self._resi_index
+
+    def _touch(self, topology=1):
+        '''
+        clean the residue index and report the change to the structure
+        '''
+        self._resi_index = None
+        Child._touch(self, topology)
     
     def _del_resi_name(self, name: str):
         '''
@@ -1388,6 +2044,7 @@ class Chain(Child):
         for i in range(len(self.residues)-1,-1,-1):
             if self.residues[i].name == name:
                 del self.residues[i]
+        self._touch()
 
 
     '''
@@ -1410,6 +2067,9 @@ class Chain(Child):
         Chain_obj.i123 = Chain_obj.residues[123-1] // index mimic (start from 1)
         Chain_obj.HIS = Chain_obj.find_resi_name('HIS') // search mimic
         '''
+        if key.startswith('__'):
+            # python protocols (copy, pickle, ...)
+            raise AttributeError(key)
         if key == 'stru':
             return self.parent
         if key[0] == 'i':
@@ -1433,6 +2093,7 @@ class Chain(Child):
             self._del_resi_name(key)
         if type(key) == Residue:
             self.residues.remove(key)
+        self._touch()
 
     def __len__(self):
         '''
@@ -1467,7 +2128,7 @@ class Residue(Child):
     set_parent
     if_art_resi
     deprotonate
-    _find_atom_name
+    _find_atom_name (hashed by {atom.name: atom}. Rebuilt after add/delete/change of atom.name)
     -------------
     __getitem__
         Residue_obj[int]: Residue_obj.residues[int]    
@@ -1481,6 +2142,7 @@ class Residue(Child):
     __len__
         len(obj) = len(obj.child_list)
     '''
+    __slots__ = ('atoms', '_id', 'name', 'd_atom', 'a_metal', '_atom_index')
 
     '''
     ====
@@ -1499,15 +2161,17 @@ class Residue(Child):
             self.set_parent(parent)
         #adapt some children
         self.atoms = []
+        self._atom_index = None
         for i in atoms:
             i.set_parent(self)
             self.atoms.append(i)
         #set id
-        self.id = resi_id
+        self._id = resi_id
         self.name = resi_name
 
         #clean
         self.d_atom = None
+        self.a_metal = None
     
     @classmethod
     def fromPDB(cls, resi_input, resi_id=None, input_type='PDB_line'):
@@ -1699,15 +2363,54 @@ class Residue(Child):
         find atom according to the name (should find only one atom)
         return the atom (! assume the uniqueness of name)
         ''' 
-        out_list = []
-        for atom in self.atoms:
-            if atom.name == name:
-                out_list.append(atom)
-        if len(out_list) > 1:
+        atom = self._get_atom_index().get(name)
+        if atom is None:
+            raise IndexError('no atom named '+str(name)+' in residue '+str(self.name)+str(self.id))
+        if type(atom) == list:
             print('\033[32;0mShould there be same atom name in residue +'+self.name+str(self.id)+'?+\033[0m')
             raise Exception
-        else:
-            return out_list[0]
+        return atom
+
+    def _get_atom_index(self):
+        '''
+        get the {atom.name: atom} index. (a list of atoms for a duplicated name)
+        '''
+        if self._atom_index is None:
+            index = {}
+            for atom in self.atoms:
+                if atom.name in index:
+                    if type(index[atom.name]) != list:
+                        index[atom.name] = [index[atom.name]]
+                    index[atom.name].append(atom)
+                else:
+                    index[atom.name] = atom
+            self._atom_index = index
+        return self._atom_index
+
+    def _touch(self, topology=1):
+        '''
+        clean the atom index and report the change to the parent
+        '''
+        if topology:
+            self._atom_index = None
+        Child._touch(self, topology)
+
+    @property
+    def chain(self):
+        return self.parent
+
+    @property
+    def id(self):
+        return self._id
+
+    @id.setter
+    def id(self, value):
+        '''
+        keep the {resi.id: resi} index of the parent chain and the structure registry valid
+        '''
+        self._id = value
+        if self.parent is not None:
+            self.parent._touch(topology=0)
 
     def _del_atom_name(self, name: str):
         '''
@@ -1717,6 +2420,7 @@ class Residue(Child):
         for i in range(len(self.atoms)-1,-1,-1):
             if self.atoms[i].name == name:
                 del self.atoms[i]
+        self._touch()
 
     def add(self, obj):
         '''
@@ -1734,7 +2438,8 @@ class Residue(Child):
             if type(obj_ele) != Atom:
                 raise TypeError('residue.Add() method only take Atom')
 
-            obj.set_parent(self)
+            for i in obj:
+                i.set_parent(self)
             self.atoms.extend(obj)
             
 
@@ -1745,6 +2450,7 @@ class Residue(Child):
             
             obj.set_parent(self)
             self.atoms.append(obj)
+        self._touch()
 
     def sort(self):
         '''
@@ -1753,20 +2459,20 @@ class Residue(Child):
         '''
         for index, atom in enumerate(self.atoms):
             atom.id = index+1
+        self._touch(topology=0)
 
     def get_mass_center(self):
         '''
         get mass center of current residue
         '''
-        M_t = 0
-        M_cw = np.array((0.0,0.0,0.0))
+        masses = []
         for atom in self:
             atom.get_ele()
-            a_mass = Ele_mass_map[atom.ele]
-            M_t += a_mass
-            M_cw += a_mass * np.array(atom.coord)
-        
-        M_center = tuple(M_cw/M_t)
+            masses.append(Ele_mass_map[atom.ele])
+        masses = np.array(masses)
+        coords = np.array([atom.coord for atom in self.atoms], dtype=float)
+
+        M_center = tuple(masses @ coords / masses.sum())
 
         return M_center
 
@@ -1789,8 +2495,9 @@ class Residue(Child):
         Residue_obj.i123 = Residue_obj.atoms[123-1] // index mimic (start from 1)
         Residue_obj.CA = Residue_obj.find_atom_name('CA') // search mimic
         '''
-        if key == 'chain':
-            return self.parent
+        if key.startswith('__'):
+            # python protocols (copy, pickle, ...)
+            raise AttributeError(key)
         # judge if a digit str, since a str will always be passed
         if key[0] == 'i':
             key = int(key[1:])
@@ -1807,10 +2514,12 @@ class Residue(Child):
         '''
         if type(key) == int:
             del self.atoms[key]
+            self._touch()
         if type(key) == str:
             return self._del_atom_name(key)
         if type(key) == Atom:
             self.atoms.remove(key)
+            self._touch()
 
     def __len__(self):
         '''
@@ -1829,7 +2538,7 @@ class Atom(Child):
     -------------
     id
     name
-    coord = [x, y, z]
+    coord = [x, y, z] (a view of Structure.coords once the atom is in a structure)
     ele (obtain by method)
 
     parent # resi
@@ -1853,6 +2562,7 @@ class Atom(Child):
     get_ele
     -------------
     '''
+    __slots__ = ('_name', '_coord', 'id', 'ff', 'ele', 'connect', 'type', 'charge')
 
     def __init__(self, atom_name: str, coord: list, ff: str, atom_id = None, parent = None):
         '''
@@ -1864,9 +2574,9 @@ class Atom(Child):
         # add parent if provided
         if parent != None:
             self.set_parent(parent)
-        # get data
-        self.name = atom_name
-        self.coord = coord
+        # get data (set the slots directly: a new atom is not in any index yet)
+        self._name = atom_name
+        self._coord = np.array(coord, dtype=float) if isinstance(coord, np.ndarray) else coord
         self.id = atom_id
         self.ff = ff
 
@@ -1897,6 +2607,43 @@ class Atom(Child):
         return cls(atom_name, coord, ff, atom_id=atom_id)
 
 
+    @property
+    def resi(self):
+        return self.parent
+
+    residue = resi
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        '''
+        keep the {atom.name: atom} index of the parent residue and the name based caches of the structure
+        (bond graph, registry) valid (e.g.: renames in Residue.deprotonate)
+        '''
+        self._name = value
+        if isinstance(self.parent, Residue):
+            self.parent._atom_index = None
+            self.parent._touch(topology=0)
+
+    @property
+    def coord(self):
+        return self._coord
+
+    @coord.setter
+    def coord(self, value):
+        '''
+        write in place when the atom holds a row of Structure.coords. Always copy an input array.
+        '''
+        if isinstance(self._coord, np.ndarray):
+            self._coord[:] = value
+        elif isinstance(value, np.ndarray):
+            self._coord = np.array(value, dtype=float)
+        else:
+            self._coord = value
+
     '''
     ====
     Method
@@ -1912,7 +2659,13 @@ class Atom(Child):
         * require standard Amber format (atom name and C/N terminal name)
         save found list of Atom object to self.connect 
         '''
-        self.connect = []
+        self.connect = self._get_template_connect()
+
+    def _get_template_connect(self):
+        '''
+        return the list of connected Atom objects base on the residue template (see get_connect)
+        '''
+        connect = []
 
         if self.resi.name in rd_solvent_list:
             name_list = resi_cnt_map[self.resi.name][self.name]
@@ -1941,12 +2694,13 @@ class Atom(Child):
                 if name == '+1N':
                     cnt_resi = self.resi.chain._find_resi_id(self.resi.id+1)
                     cnt_atom = cnt_resi._find_atom_name('N')                
-                self.connect.append(cnt_atom)
+                connect.append(cnt_atom)
             except IndexError:
                 if Config.debug >= 1:
                     print('WARNING: '+self.resi.name+str(self.resi.id)+' should have atom: '+name)
                 else:
                     pass
+        return connect
 
     def get_type(self):
         if self.resi.name in rd_solvent_list:
@@ -2140,7 +2894,16 @@ class Atom(Child):
 
 
     def get_around(self, rad):
-        pass
+        '''
+        return a list of atoms within rad (Angstrom) of this atom (sorted by the distance)
+        '''
+        stru = self.parent
+        while stru is not None and not isinstance(stru, Structure):
+            stru = stru.parent
+        if stru is None:
+            raise Exception('Atom.get_around: atom is not in a Structure')
+        atoms = stru.get_atoms()
+        return [atoms[i] for i in stru.get_atoms_around(self.coord, rad)[0] if atoms[i] is not self]
 
     
     def get_ele(self):
@@ -2159,8 +2922,9 @@ class Atom(Child):
     '''
 
     def __getattr__(self, key):
-        if key == 'residue' or key == 'resi':
-            return self.parent
+        if key.startswith('__'):
+            # python protocols (copy, pickle, ...)
+            raise AttributeError(key)
         else:
             Exception('bad key: getattr error')
     
@@ -2192,7 +2956,7 @@ class Metalatom(Atom):
     get_donor_residue(self, method='INC')
     -------------
     '''
-
+    __slots__ = ('resi_name', 'donor_atoms', 'donor_resi', 'parm')
 
     def __init__(self, name, resi_name, coord, ff, id=None, parent=None):
         '''
@@ -2239,27 +3003,29 @@ class Metalatom(Atom):
             R_m = VDW_radius_map[self.ele]
         
         # get target with in check_radius (default: 4A)
-        coord_m = np.array(self.coord)
-        protein_atoms = self.parent.get_all_protein_atom()
-        for atom in protein_atoms:
+        # protein atoms are the first rows of the coordinate array
+        stru = self.parent
+        protein_atoms = stru.get_all_protein_atom()
+        atom_index, dists = stru.get_atoms_around(self.coord, check_radius)
+        order = np.argsort(atom_index)
+        atom_index, dists = atom_index[order], dists[order]
+        if_protein = atom_index < len(protein_atoms)
+        for index, dist in zip(atom_index[if_protein], dists[if_protein]):
+            atom = protein_atoms[index]
             
             #only check donor atom (by atom name)
             if atom.name in Donor_atom_list[atom.ff]:
+                # determine coordination
+                atom.get_ele()
+                if method == 'INC':
+                    R_d = Ionic_radius_map[atom.ele]
+                if method == 'VDW':
+                    R_d = VDW_radius_map[atom.ele]
                 
-                # cut by check_radius
-                dist = np.linalg.norm(np.array(atom.coord) - coord_m)
-                if dist <= check_radius:
-                    # determine coordination
-                    atom.get_ele()
-                    if method == 'INC':
-                        R_d = Ionic_radius_map[atom.ele]
-                    if method == 'VDW':
-                        R_d = VDW_radius_map[atom.ele]
-                    
-                    if dist <= (R_d + R_m):
-                        self.donor_atoms.append(atom)
-                        if Config.debug > 1:
-                            print('Metalatom.get_donor_atom: '+self.name+' find donor atom:' + atom.resi.name +' '+ str(atom.resi.id) + ' ' + atom.name)                     
+                if dist <= (R_d + R_m):
+                    self.donor_atoms.append(atom)
+                    if Config.debug > 1:
+                        print('Metalatom.get_donor_atom: '+self.name+' find donor atom:' + atom.resi.name +' '+ str(atom.resi.id) + ' ' + atom.name)                     
         
 
     def get_donor_residue(self, method='INC'):
@@ -2441,6 +3207,8 @@ class Ligand(Residue):
     set_parent
     -------------
     '''
+    __slots__ = ('net_charge',)
+
     def __init__(self, atoms, id, name, net_charge=None, parent=None):
         self.net_charge = net_charge
         Residue.__init__(self, atoms, id, name, parent)
@@ -2569,6 +3337,8 @@ class Solvent(Residue):
     set_parent
     -------------
     '''
+    __slots__ = ()
+
     def __init__(self, atoms, id, name, parent=None):
         Residue.__init__(self, atoms, id, name, parent)
 
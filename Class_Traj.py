@@ -0,0 +1,663 @@
+import json
+import mmap
+import os
+import numpy as np
+from helper import line_feed
+__doc__='''
+This module read and write Amber trajectory files as NumPy arrays of (n_frame, n_atom, 3)
+-------------------------------------------------------------------------------------
+read_mdcrd(path, n_atom=None, atom_index=None): frames of an ASCII trajectory (.mdcrd/.crd)
+MDCrdFile(path, n_atom=None): random access to frames of an ASCII trajectory
+write_mdcrd(path, coords, box=None): write frames to an ASCII trajectory
+append_mdcrd(path, coords, box=None): write frames to the end of an ASCII trajectory
+open_nc(path): a memory-mapped (n_frame, n_atom, 3) view of the coordinates in a NetCDF trajectory (.nc)
+read_nc(path, start=1, end=-1, step=1, atom_index=None): sampled frames of a NetCDF trajectory
+read_nc_box(path): box of each frame of a NetCDF trajectory
+write_nc(path, coords, box=None): write frames to a NetCDF trajectory
+write_npy(path, coords, box=None, source=None, frame_index=None, atom_index=None): write a .npy frame store (and .json header)
+read_npy_header(path): the JSON header of a .npy frame store
+read_box(path): box of each frame of a .mdcrd/.crd, .nc or .npy trajectory
+convert_traj(in_path, out_path): convert frames of a .mdcrd/.crd, .nc or .npy trajectory to a .npy frame store or a .mdcrd
+open_traj(path, n_atom=None): random access frames of a .mdcrd/.crd, .nc or .npy file (by the extension)
+take_frames(traj, frame_index, atom_index=None): read frames (and only some atoms) of an opened trajectory
+-------------------------------------------------------------------------------------
+atom_index: all readers take a 0-based atom index array to only decode/copy these atoms. (e.g.: the solute)
+            get_atom_index(atom_ids) converts atom ids of a structure or an Amber mask (decode_atom_mask) to it.
+-------------------------------------------------------------------------------------
+mdcrd format: a title line then for each frame 3*n_atom values in 10F8.3 lines
+              and an optional box line (3F8.3) after each frame.
+nc format:    NetCDF classic / 64-bit offset (CDF-1/CDF-2) file with the AMBER conventions.
+              Only the header is parsed; the coordinates are read from the memory map. (no netCDF4/pytraj needed)
+npy format:   (n_frame, n_atom, 3) float32 .npy memory-mapped by readers (no parsing) and a JSON header of the same name
+              {version, dtype, n_frame, n_atom, source, frame_index, atom_index, box}
+* Format: https://ambermd.org/FileFormats.php#trajectory
+          https://ambermd.org/netcdf/nctraj.xhtml
+          https://docs.unidata.ucar.edu/netcdf-c/current/file_format_specifications.html
+===============
+'''
+
+mdcrd_width = 8
+mdcrd_per_line = 10
+
+def open_traj(path, n_atom=None):
+    '''
+    open a trajectory file for random access of frames. The format is determined by the extension:
+    .nc: NetCDF (open_nc) | .npy: (n_frame, n_atom, 3) array (memory-mapped) | others: ASCII (MDCrdFile)
+    n_atom: number of atoms in a frame (only needed for ASCII trajectories, see read_mdcrd)
+    ---------
+    return an array-like of (n_frame, n_atom, 3) that supports len, shape and indexing of frames
+    '''
+    ext = os.path.splitext(path)[1]
+    if ext == '.nc':
+        return open_nc(path)
+    if ext == '.npy':
+        return np.load(path, mmap_mode='r')
+    return MDCrdFile(path, n_atom=n_atom)
+
+def read_mdcrd(path, n_atom=None, if_box=0, atom_index=None):
+    '''
+    read all frames of an ASCII trajectory
+    n_atom: number of atoms in a frame. (e.g.: from Prmtop.get_n_atom)
+            Inferred from the line lengths if not provided. Provide it for trajectories that the line lengths cannot tell:
+            - 3*n_atom % 10 == 0 without box (read as one frame)
+            - 3*n_atom % 10 == 3 without box (read as 3*n_atom % 10 == 0 with box)
+    if_box: also return the box array (n_frame, 3) (None if no box lines)
+    atom_index: 0-based index array of atoms to decode (all atoms by default. see get_atom_index)
+    ---------
+    return a (n_frame, n_atom, 3) float array (and box)
+    '''
+    mdcrd = MDCrdFile(path, n_atom=n_atom)
+    return mdcrd.read(0, len(mdcrd), if_box=if_box, atom_index=atom_index)
+
+def take_frames(traj, frame_index, atom_index=None):
+    '''
+    read frames of *frame_index* (and only atoms of *atom_index*) from a trajectory of open_traj
+    continuous frames are read as a slice (a sequential read of the file)
+    ---------
+    return a (n_frame, n_atom, 3) float array
+    '''
+    if isinstance(traj, MDCrdFile):
+        return traj.take(frame_index, atom_index=atom_index)
+    frame_index = np.asarray(frame_index, dtype=int)
+    if len(frame_index) and np.all(np.diff(frame_index) == 1):
+        coords = traj[frame_index[0]: frame_index[-1]+1]
+    else:
+        coords = traj[frame_index]
+    if atom_index is not None:
+        coords = coords[:, atom_index]
+    return np.asarray(coords, dtype=float)
+
+def get_atom_index(atom_ids):
+    '''
+    convert atom ids (from 1, e.g. from decode_atom_mask or Structure.get_atom_column('atom_id')) to a sorted 0-based atom index
+    for the atom_index of the readers
+    '''
+    return np.unique(np.asarray(atom_ids, dtype=int)) - 1
+
+class MDCrdFile:
+    '''
+    random access to frames of an ASCII trajectory
+    The byte offset of each frame is indexed when open. Frames are decoded only when they are indexed.
+    -------
+    mdcrd = MDCrdFile(path, n_atom=None)  // see read_mdcrd for n_atom
+    len(mdcrd), mdcrd.shape
+    mdcrd[i], mdcrd[i:j:k], mdcrd[index_array]  // (n_atom, 3) or (n_frame, n_atom, 3) float arrays
+    mdcrd.read(i, j, if_box=0)  // frames i to j-1 (and box)
+    '''
+    def __init__(self, path, n_atom=None):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+        mm = self._mm
+        header_end = mm.find(b'\n') + 1 if mm.find(b'\n') >= 0 else len(mm)
+        # lines of the first frame
+        line_width = mdcrd_width * mdcrd_per_line
+        first_lines = []
+        n_need = None if n_atom is None else -(-n_atom*3 // mdcrd_per_line) + 1
+        pos = header_end
+        while pos < len(mm) and (n_need is None or len(first_lines) < n_need):
+            line_end = mm.find(b'\n', pos)
+            line_end = len(mm) if line_end < 0 else line_end + 1
+            first_lines.append(mm[pos:line_end])
+            pos = line_end
+            # enough to infer n_atom and the box: 2 more lines after the first short line
+            if n_need is None and len(first_lines[-1].rstrip()) < line_width:
+                n_need = len(first_lines) + 2
+        lines = [l.rstrip(b'\r\n') for l in first_lines]
+        while lines and lines[-1].strip() == b'':
+            lines.pop()
+        if n_atom is None:
+            n_atom = _infer_mdcrd_n_atom(lines, line_width)
+        self.n_atom = n_atom
+        n_value = n_atom * 3
+        self.n_line = -(-n_value // mdcrd_per_line)
+        self.last_width = (n_value - (self.n_line-1) * mdcrd_per_line) * mdcrd_width
+        # box lines: deterministic from the atom count. A box line is 3 fields while the first
+        # line of the next frame is a full line (or the frame is one line of a different width).
+        self.has_box = 0
+        if len(lines) > self.n_line:
+            self.has_box = int(len(lines[self.n_line].rstrip()) == 3*mdcrd_width and (self.n_line > 1 or self.last_width != 3*mdcrd_width))
+        self.n_frame_line = self.n_line + self.has_box
+        self.offsets = self._index_frames(header_end, sum(len(l) for l in first_lines[:self.n_frame_line]))
+        self.shape = (len(self.offsets) - 1, n_atom, 3)
+
+    def _index_frames(self, header_end, frame_bytes):
+        '''
+        get byte offsets of frames (n_frame+1). Frames of the same byte size are computed directly,
+        otherwise (stripped or mixed line endings) the line ends are scanned by blocks.
+        '''
+        mm = self._mm
+        content_end = len(mm)
+        while content_end > header_end and mm[content_end-1:content_end].isspace():
+            content_end -= 1
+        eol = mm.find(b'\n', header_end)
+        eol_size = 2 if eol > 0 and mm[eol-1:eol] == b'\r' else 1
+        if frame_bytes and (content_end + eol_size - header_end) % frame_bytes == 0:
+            n_frame = (content_end + eol_size - header_end) // frame_bytes
+            return header_end + np.arange(n_frame + 1) * frame_bytes
+        if content_end <= header_end:
+            return np.array([header_end])
+        # line starts
+        block_size = 1 << 26
+        starts = [np.array([header_end])]
+        for block_start in range(header_end, content_end, block_size):
+            block = np.frombuffer(mm[block_start:min(block_start+block_size, content_end)], dtype=np.uint8)
+            starts.append(np.flatnonzero(block == ord('\n')) + block_start + 1)
+        starts = np.concatenate(starts)
+        starts = starts[starts < content_end]
+        if len(starts) % self.n_frame_line:
+            raise Exception('MDCrdFile: '+str(len(starts))+' lines in '+self.path+' do not match frames of '+str(self.n_atom)+' atoms')
+        return np.append(starts[::self.n_frame_line], content_end + eol_size)
+
+    def __reduce__(self):
+        # reopen by path instead of pickling the memory map
+        return (type(self), (self.path, self.n_atom))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            key = range(len(self))[key]
+            return self.read(key, key+1)[0]
+        return self.take(np.arange(len(self))[key])
+
+    def take(self, frame_index, atom_index=None):
+        '''
+        decode frames of *frame_index* (only atoms of *atom_index* if provided)
+        return a (n_frame, n_atom, 3) float array
+        '''
+        frame_index = np.asarray(frame_index, dtype=int)
+        if len(frame_index) == 0:
+            return np.zeros((0, self.n_atom if atom_index is None else len(atom_index), 3))
+        # decode each run of continuous frames at once
+        runs = np.split(frame_index, np.flatnonzero(np.diff(frame_index) != 1) + 1)
+        return np.concatenate([self.read(run[0], run[-1]+1, atom_index=atom_index) for run in runs])
+
+    def get_box(self):
+        '''
+        decode the box line of each frame
+        return a (n_frame, 3) float array or None if there is no box
+        '''
+        if not self.has_box:
+            return None
+        lines = []
+        for start, end in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist()):
+            # the last line of the frame
+            end = min(end, len(self._mm))
+            while end > start and self._mm[end-1:end].isspace():
+                end -= 1
+            lines.append(self._mm[self._mm.rfind(b'\n', start, end)+1:end].rjust(3*mdcrd_width))
+        return _decode_fields(b''.join(lines)).reshape(-1, 3)
+
+    def read(self, start, end, if_box=0, atom_index=None):
+        '''
+        decode frames from *start* to *end*-1
+        atom_index: only decode these atoms (0-based index)
+        ---------
+        return a (n_frame, n_atom, 3) float array (and box (n_frame, 3) or None if if_box)
+        '''
+        n_frame = end - start
+        lines = self._mm[self.offsets[start]:self.offsets[end]].replace(b'\r', b'').split(b'\n')
+        lines = lines[:n_frame * self.n_frame_line]
+        if len(lines) != n_frame * self.n_frame_line:
+            raise Exception('MDCrdFile: '+str(len(lines))+' lines in '+self.path+' do not match frames of '+str(self.n_atom)+' atoms')
+        frame_lines = lines
+        box = None
+        if self.has_box:
+            line_array = np.empty(len(lines), dtype=object)
+            line_array[:] = lines
+            line_array = line_array.reshape(n_frame, self.n_frame_line)
+            frame_lines = line_array[:, :self.n_line].ravel().tolist()
+            box = _decode_fields(b''.join([l.rstrip().rjust(3*mdcrd_width) for l in line_array[:, self.n_line].tolist()])).reshape(n_frame, 3)
+
+        # fixed width: lines join into n_frame * n_value fields (fit lines with stripped or padded trailing spaces otherwise)
+        data = b''.join(frame_lines)
+        if len(data) != n_frame * self.n_atom * 3 * mdcrd_width:
+            widths = ([mdcrd_width * mdcrd_per_line]*(self.n_line-1) + [self.last_width]) * n_frame
+            data = b''.join([l.rstrip().ljust(w) for l, w in zip(frame_lines, widths)])
+        n_atom = self.n_atom
+        if atom_index is not None:
+            field_index = (np.asarray(atom_index, dtype=int)[:, None] * 3 + np.arange(3)).ravel()
+            data = np.frombuffer(data, dtype=np.uint8).reshape(n_frame, n_atom*3, mdcrd_width)[:, field_index].tobytes()
+            n_atom = len(field_index) // 3
+        coords = _decode_fields(data).reshape(n_frame, n_atom, 3)
+        if if_box:
+            return coords, box
+        return coords
+
+def _infer_mdcrd_n_atom(lines, line_width):
+    '''
+    infer the number of atoms from the line lengths of the first frame
+    '''
+    for i, line in enumerate(lines):
+        length = len(line.rstrip())
+        if length < line_width:
+            if length == 3*mdcrd_width and i > 0:
+                # the last line of 3 values if a box line follows. Otherwise taken as a box line after full lines
+                if i+1 < len(lines) and len(lines[i+1].rstrip()) == 3*mdcrd_width:
+                    return (i * mdcrd_per_line + 3) // 3
+                return i * mdcrd_per_line // 3
+            return (i * line_width + length) // (3*mdcrd_width)
+    # all lines are full: read as a single frame (provide n_atom for multiple frames)
+    return len(lines) * mdcrd_per_line // 3
+
+def _decode_fields(data):
+    '''
+    decode a bytes of %8.3f fields into a float array
+    Fixed-point fields are decoded as integers (exact to the 3 decimals) and other ones by the float parser.
+    '''
+    fields = np.frombuffer(data, dtype=np.uint8).reshape(-1, mdcrd_width)
+    if len(fields) == 0:
+        return np.zeros(0)
+    if not np.all(fields[:, 4] == ord('.')):
+        return np.frombuffer(data, dtype='S'+str(mdcrd_width)).astype(float)
+    # digits in uint8 (non-digit bytes wrap over 9) and summed column by column in int32
+    values = np.zeros(len(fields), dtype=np.int32)
+    if_neg = np.zeros(len(fields), dtype=bool)
+    for col in (0, 1, 2, 3, 5, 6, 7):
+        if col < 4:
+            if_neg |= fields[:, col] == ord('-')
+        digit = fields[:, col] - np.uint8(ord('0'))
+        digit[digit > 9] = 0
+        values *= 10
+        values += digit
+    values[if_neg] *= -1
+    return values / 1000
+
+def write_mdcrd(path, coords, box=None, title='default_name'):
+    '''
+    write frames to an ASCII trajectory
+    coords: (n_frame, n_atom, 3) array
+    box   : (n_frame, 3) array or None
+    '''
+    with open(path, 'w') as of:
+        of.write(title+line_feed)
+    append_mdcrd(path, coords, box=box)
+
+def append_mdcrd(path, coords, box=None):
+    '''
+    write frames to the end of an ASCII trajectory (e.g.: write chunk by chunk after write_mdcrd(path, first_chunk))
+    coords: (n_frame, n_atom, 3) array
+    box   : (n_frame, 3) array or None
+    '''
+    coords = np.asarray(coords, dtype=float)
+    coords = coords.reshape(-1, coords.shape[-2]*3)
+    n_value = coords.shape[1]
+    line_template = '%8.3f' * mdcrd_per_line + line_feed
+    n_full = n_value // mdcrd_per_line
+    last_template = '%8.3f' * (n_value - n_full*mdcrd_per_line)
+    last_template = last_template + line_feed if last_template else ''
+    with open(path, 'a') as of:
+        for i, frame in enumerate(coords):
+            values = frame.tolist()
+            of.write((line_template * n_full + last_template) % tuple(values))
+            if box is not None:
+                of.write('%8.3f%8.3f%8.3f' % tuple(box[i]) + line_feed)
+
+# NetCDF classic header tags and types
+nc_dimension = 10
+nc_variable = 11
+nc_attribute = 12
+nc_types = {1: 'b', 2: 'S1', 3: '>i2', 4: '>i4', 5: '>f4', 6: '>f8'}
+nc_type_ids = {v: k for k, v in nc_types.items()}
+nc_streaming = 0xFFFFFFFF
+
+def open_nc(path):
+    '''
+    memory map the coordinates of a NetCDF trajectory
+    ---------
+    return a read-only (n_frame, n_atom, 3) big-endian float32 array view of the file.
+    Frames are only read from the disk when they are used. (copy or astype what you need)
+    '''
+    coords = _map_nc_var(path, 'coordinates')
+    if coords is None:
+        raise Exception('open_nc: no coordinates variable in '+path)
+    return coords
+
+def read_nc_box(path):
+    '''
+    read the box (cell_lengths) of each frame of a NetCDF trajectory
+    return a (n_frame, 3) float array or None if there is no box
+    '''
+    box = _map_nc_var(path, 'cell_lengths')
+    if box is None:
+        return None
+    return box.astype(float)
+
+def _map_nc_var(path, name):
+    '''
+    memory map a per frame variable of a NetCDF file as a (n_frame, ...) array view (None if the variable does not exist)
+    '''
+    header = _read_nc_header(path)
+    if name not in header['vars']:
+        return None
+    var = header['vars'][name]
+    if not var['is_rec']:
+        raise Exception('_map_nc_var: '+name+' in '+path+' is not a per frame variable')
+    shape = tuple(header['dims'][d] for d in var['dims'][1:])
+    itemsize = var['dtype'].itemsize
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # the last frame could be incomplete if the file is still being written
+    size = len(mm) - var['begin'] - int(np.prod(shape)) * itemsize
+    n_frame = min(header['n_rec'], size // header['rec_size'] + 1) if size >= 0 else 0
+    strides = tuple(int(np.prod(shape[i+1:])) * itemsize for i in range(len(shape)))
+    return np.ndarray((n_frame,) + shape, dtype=var['dtype'], buffer=mm, offset=var['begin'], strides=(header['rec_size'],) + strides)
+
+def read_nc(path, start=1, end=-1, step=1, atom_index=None):
+    '''
+    read sampled frames of a NetCDF trajectory
+    start, end, step: frames to read. 1-based and end included (same as trajin of cpptraj). end=-1 for the last frame
+    atom_index: 0-based index array of atoms to read (all atoms by default)
+    ---------
+    return a (n_frame, n_atom, 3) float array
+    '''
+    coords = open_nc(path)
+    coords = coords[_get_frame_slice(start, end, step)]
+    if atom_index is not None:
+        coords = coords[:, np.asarray(atom_index)]
+    return coords.astype(float)
+
+def _get_frame_slice(start=1, end=-1, step=1):
+    '''
+    convert a cpptraj style (1-based, end included, -1 for the last) frame range to a slice
+    '''
+    return slice(start-1, None if end == -1 else end, step)
+
+def _read_nc_header(path):
+    '''
+    parse the header of a NetCDF classic or 64-bit offset file
+    ---------
+    return a dict of:
+        dims:     {name: length} (the record dimension has length n_rec)
+        attrs:    global attributes {name: value}
+        vars:     {name: {dims, attrs, dtype, begin, vsize, is_rec}}
+        n_rec:    number of records (frames)
+        rec_size: bytes of a record
+    '''
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+        if magic[:3] != b'CDF' or magic[3] not in (1, 2):
+            if magic[:4] == b'\x89HDF':
+                raise Exception('_read_nc_header: '+path+' is a NetCDF4 (HDF5) file. Only classic/64-bit offset files are supported. (ioutformat=0 in Amber)')
+            raise Exception('_read_nc_header: '+path+' is not a NetCDF classic file')
+        offset_size = 4 * magic[3]
+        n_rec = _nc_read_int(f)
+        dims = []
+        rec_dim = None
+        for i, (name, length) in enumerate(_nc_read_list(f, nc_dimension, lambda: (_nc_read_name(f), _nc_read_int(f)))):
+            if length == 0:
+                rec_dim = i
+            dims.append([name, length])
+        attrs = _nc_read_attrs(f)
+        vars = {}
+        for var in _nc_read_list(f, nc_variable, lambda: _nc_read_var(f, offset_size)):
+            name, dim_ids, v_attrs, nc_type, vsize, begin = var
+            vars[name] = {
+                'dims': tuple(dims[j][0] for j in dim_ids),
+                'attrs': v_attrs,
+                'dtype': np.dtype(nc_types[nc_type]),
+                'begin': begin,
+                'vsize': vsize,
+                'is_rec': int(len(dim_ids) > 0 and dim_ids[0] == rec_dim),
+            }
+    rec_vars = [v for v in vars.values() if v['is_rec']]
+    rec_size = sum(v['vsize'] for v in rec_vars)
+    # a single record variable is not padded
+    if len(rec_vars) == 1:
+        dim_len = dict(dims)
+        rec_size = int(np.prod([dim_len[d] for d in rec_vars[0]['dims'][1:]])) * rec_vars[0]['dtype'].itemsize
+    if n_rec == nc_streaming:
+        n_rec = (os.path.getsize(path) - rec_vars[0]['begin']) // rec_size if rec_vars else 0
+    if rec_dim is not None:
+        dims[rec_dim][1] = n_rec
+    return {'dims': dict(dims), 'attrs': attrs, 'vars': vars, 'n_rec': n_rec, 'rec_size': rec_size}
+
+def _nc_read_int(f, size=4):
+    return int.from_bytes(f.read(size), 'big')
+
+def _nc_read_name(f):
+    n = _nc_read_int(f)
+    name = f.read(n).decode()
+    f.read(-n % 4)
+    return name
+
+def _nc_read_list(f, tag, read_item):
+    '''
+    read a dim/att/var list (ABSENT is a zero tag and a zero count)
+    '''
+    list_tag = _nc_read_int(f)
+    n = _nc_read_int(f)
+    if list_tag == 0 and n == 0:
+        return []
+    if list_tag != tag:
+        raise Exception('_read_nc_header: wrong list tag '+str(list_tag)+' (expecting '+str(tag)+')')
+    return [read_item() for i in range(n)]
+
+def _nc_read_attrs(f):
+    '''
+    read an attribute list to a dict (char attributes are str and the others are arrays)
+    '''
+    def read_attr():
+        name = _nc_read_name(f)
+        nc_type = _nc_read_int(f)
+        n = _nc_read_int(f)
+        dtype = np.dtype(nc_types[nc_type])
+        data = f.read(n * dtype.itemsize)
+        f.read(-(n * dtype.itemsize) % 4)
+        if nc_type == 2:
+            return name, data.decode(errors='replace').rstrip('\x00')
+        return name, np.frombuffer(data, dtype=dtype)
+    return dict(_nc_read_list(f, nc_attribute, read_attr))
+
+def _nc_read_var(f, offset_size):
+    name = _nc_read_name(f)
+    n_dim = _nc_read_int(f)
+    dim_ids = [_nc_read_int(f) for i in range(n_dim)]
+    attrs = _nc_read_attrs(f)
+    nc_type = _nc_read_int(f)
+    vsize = _nc_read_int(f)
+    begin = _nc_read_int(f, offset_size)
+    return name, dim_ids, attrs, nc_type, vsize, begin
+
+def write_nc(path, coords, box=None, time=None, title='default_name'):
+    '''
+    write frames to a NetCDF (64-bit offset) trajectory with the AMBER conventions
+    coords: (n_frame, n_atom, 3) array
+    box   : (n_frame, 3) array of the cell lengths or None (angles are 90.0)
+    time  : (n_frame,) array of the time in ps or None (frame indexes)
+    '''
+    coords = np.asarray(coords, dtype='>f4')
+    n_frame, n_atom = coords.shape[:2]
+    if time is None:
+        time = np.arange(n_frame)
+    dims = [('frame', 0), ('spatial', 3), ('atom', n_atom)]
+    # (name, dims, attrs, type, fixed data or record data)
+    vars = [('spatial', (1,), {}, 'S1', np.frombuffer(b'xyz', dtype='S1')),
+            ('time', (0,), {'units': 'picosecond'}, '>f4', np.asarray(time, dtype='>f4').reshape(n_frame, 1)),
+            ('coordinates', (0, 2, 1), {'units': 'angstrom'}, '>f4', coords.reshape(n_frame, -1))]
+    if box is not None:
+        dims += [('cell_spatial', 3), ('label', 5), ('cell_angular', 3)]
+        box = np.asarray(box, dtype='>f8').reshape(n_frame, 3)
+        vars += [('cell_spatial', (3,), {}, 'S1', np.frombuffer(b'abc', dtype='S1')),
+                 ('cell_angular', (5, 4), {}, 'S1', np.frombuffer(b'alphabeta gamma', dtype='S1')),
+                 ('cell_lengths', (0, 3), {'units': 'angstrom'}, '>f8', box),
+                 ('cell_angles', (0, 3), {'units': 'degree'}, '>f8', np.full((n_frame, 3), 90.0, dtype='>f8'))]
+    attrs = {'title': title, 'application': 'AMBER', 'program': 'EnzyHTP', 'programVersion': '1.0',
+             'Conventions': 'AMBER', 'ConventionVersion': '1.0'}
+
+    def pad(data):
+        return data + b'\x00' * (-len(data) % 4)
+    def name_bytes(name):
+        return _nc_int(len(name)) + pad(name.encode())
+    def attrs_bytes(attrs):
+        if not attrs:
+            return _nc_int(0) + _nc_int(0)
+        out = _nc_int(nc_attribute) + _nc_int(len(attrs))
+        for name, value in attrs.items():
+            out += name_bytes(name) + _nc_int(2) + _nc_int(len(value)) + pad(value.encode())
+        return out
+    def vsize(var):
+        size = int(np.prod([dims[d][1] for d in var[1] if dims[d][1] != 0])) * np.dtype(var[3]).itemsize
+        return size + (-size % 4)
+    def header_bytes(begins):
+        out = b'CDF\x02' + _nc_int(n_frame)
+        out += _nc_int(nc_dimension) + _nc_int(len(dims))
+        for name, length in dims:
+            out += name_bytes(name) + _nc_int(length)
+        out += attrs_bytes(attrs)
+        out += _nc_int(nc_variable) + _nc_int(len(vars))
+        for var, begin in zip(vars, begins):
+            out += name_bytes(var[0]) + _nc_int(len(var[1])) + b''.join(_nc_int(d) for d in var[1])
+            out += attrs_bytes(var[2]) + _nc_int(nc_type_ids[var[3]]) + _nc_int(vsize(var)) + begin.to_bytes(8, 'big')
+        return out
+
+    fix_vars = [var for var in vars if var[1][0] != 0]
+    rec_vars = [var for var in vars if var[1][0] == 0]
+    header_size = len(header_bytes([0]*len(vars)))
+    begins = {}
+    offset = header_size
+    for var in fix_vars:
+        begins[var[0]] = offset
+        offset += vsize(var)
+    for var in rec_vars:
+        begins[var[0]] = offset
+        offset += vsize(var)
+    with open(path, 'wb') as of:
+        of.write(header_bytes([begins[var[0]] for var in vars]))
+        for var in fix_vars:
+            of.write(pad(var[4].tobytes()))
+        # records: each record has a frame of all record variables
+        of.write(b''.join(pad(var[4][i].tobytes()) for i in range(n_frame) for var in rec_vars))
+
+def _nc_int(value):
+    return int(value).to_bytes(4, 'big')
+
+# sampled frame store: float32 .npy of (n_frame, n_atom, 3) and a JSON header of the same name
+npy_store_version = 1
+
+def get_npy_header_path(path):
+    return os.path.splitext(path)[0]+'.json'
+
+def write_npy(path, coords, box=None, source=None, frame_index=None, atom_index=None):
+    '''
+    write frames to a float32 .npy frame store and its JSON header (path with .json)
+    coords     : (n_frame, n_atom, 3) array
+    box        : (n_frame, 3) array or None
+    source     : path of the trajectory the frames were sampled from
+    frame_index: 0-based index of the frames in the source
+    atom_index : 0-based index of the atoms in the source (None for all atoms)
+    * float32 keeps 3 decimals of coordinates below 1000 (as mdcrd %8.3f)
+    '''
+    coords = np.asarray(coords, dtype=np.float32)
+    np.save(path, coords)
+    _write_npy_header(path, coords.shape, box, source, frame_index, atom_index)
+
+def _write_npy_header(path, shape, box, source, frame_index, atom_index):
+    header = {
+        'version': npy_store_version,
+        'dtype': 'float32',
+        'n_frame': int(shape[0]),
+        'n_atom': int(shape[1]),
+        'source': source,
+        'frame_index': None if frame_index is None else np.asarray(frame_index).tolist(),
+        'atom_index': None if atom_index is None else np.asarray(atom_index).tolist(),
+        'box': None if box is None else np.asarray(box, dtype=float).round(6).tolist(),
+    }
+    with open(get_npy_header_path(path), 'w') as of:
+        json.dump(header, of)
+
+def read_npy_header(path):
+    '''
+    read the JSON header of a .npy frame store
+    return a dict of version, dtype, n_frame, n_atom, source, frame_index, atom_index and box
+    (a plain .npy without the header gives the values from the array with None for the rest)
+    '''
+    header_path = get_npy_header_path(path)
+    if not os.path.isfile(header_path):
+        n_frame, n_atom = np.load(path, mmap_mode='r').shape[:2]
+        return {'version': None, 'dtype': None, 'n_frame': n_frame, 'n_atom': n_atom,
+                'source': None, 'frame_index': None, 'atom_index': None, 'box': None}
+    with open(header_path) as f:
+        return json.load(f)
+
+def read_box(path, n_atom=None):
+    '''
+    read the box of each frame of a .mdcrd/.crd, .nc or .npy trajectory
+    return a (n_frame, 3) float array or None if there is no box
+    '''
+    ext = os.path.splitext(path)[1]
+    if ext == '.nc':
+        return read_nc_box(path)
+    if ext == '.npy':
+        box = read_npy_header(path)['box']
+        return None if box is None else np.array(box, dtype=float)
+    return MDCrdFile(path, n_atom=n_atom).get_box()
+
+def convert_traj(in_path, out_path, n_atom=None, frame_index=None, atom_index=None, window=20):
+    '''
+    convert frames of a .mdcrd/.crd, .nc or .npy trajectory to a .npy frame store or a .mdcrd (by the extension of out_path)
+    Frames are converted by chunks of *window* frames. (the memory does not grow with the number of frames)
+    n_atom     : number of atoms of an ASCII input (see read_mdcrd)
+    frame_index: 0-based index of frames to convert (all frames by default)
+    atom_index : 0-based index of atoms to convert (all atoms by default)
+    The source, frame and atom index in the header of a .npy output refer to the original trajectory
+    if the input is also a .npy frame store.
+    ---------
+    return out_path
+    '''
+    traj = open_traj(in_path, n_atom=n_atom)
+    if frame_index is None:
+        frame_index = np.arange(len(traj))
+    frame_index = np.asarray(frame_index, dtype=int)
+    box = read_box(in_path, n_atom=n_atom)
+    if box is not None:
+        box = box[frame_index]
+    n_out_atom = traj.shape[1] if atom_index is None else len(atom_index)
+
+    if os.path.splitext(out_path)[1] == '.npy':
+        # header index relative to the source of a frame store
+        source, src_frame_index, src_atom_index = in_path, frame_index, atom_index
+        if os.path.splitext(in_path)[1] == '.npy':
+            in_header = read_npy_header(in_path)
+            if in_header['source'] is not None:
+                source = in_header['source']
+                if in_header['frame_index'] is not None:
+                    src_frame_index = np.array(in_header['frame_index'], dtype=int)[frame_index]
+                if in_header['atom_index'] is not None:
+                    in_atom_index = np.array(in_header['atom_index'], dtype=int)
+                    src_atom_index = in_atom_index if atom_index is None else in_atom_index[atom_index]
+        out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=(len(frame_index), n_out_atom, 3))
+        for i in range(0, len(frame_index), window):
+            out[i:i+window] = take_frames(traj, frame_index[i:i+window], atom_index=atom_index)
+        out.flush()
+        del out
+        _write_npy_header(out_path, (len(frame_index), n_out_atom), box, source, src_frame_index, src_atom_index)
+    else:
+        with open(out_path, 'w') as of:
+            of.write(os.path.basename(in_path)+line_feed)
+        for i in range(0, len(frame_index), window):
+            append_mdcrd(out_path, take_frames(traj, frame_index[i:i+window], atom_index=atom_index),
+                         box=None if box is None else box[i:i+window])
+    return out_path
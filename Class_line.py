@@ -1,3 +1,4 @@
+import numpy as np
 from helper import line_feed
 from AmberMaps import Resi_Ele_map
 
@@ -8,7 +9,9 @@ class PDB_line(object):
     line: PDB_line(line) --> PDB_line
     lines: PDB_line.fromlines(lines) --> [PDB_line, ...]
     '''
-
+    __slots__ = ('line', 'line_type', 'atom_id', 'atom_name', 'resi_name', 'resi_id', 'chain_id',
+                 'atom_x', 'atom_y', 'atom_z',
+                 'AL_id', 'insert_code', 'occupancy', 'temp_factor', 'seg_id', 'element', 'charge')
 
     def __init__(self,line):
         '''
@@ -126,6 +129,111 @@ class PDB_line(object):
     def get_charge(self):
         self.charge = self.line[78:80].strip()
         return self.charge
-   
 
-        
+
+
+class PDB_columns(object):
+    '''
+    Columnar decoder for the ATOM/HETATM records of a PDB file. Functions used internally.
+    Decode each fixed-width column of all records at once into typed NumPy arrays instead of
+    making a PDB_line object per line.
+    Generate from:
+    file_str: PDB_columns.fromstr(file_str) --> PDB_columns
+    -------------
+    atom_id   : int array
+    atom_name : str array
+    resi_name : str array
+    resi_id   : int array
+    chain_id  : str array (the chain column in the file)
+    coord     : (N, 3) float array
+    element   : str array
+    chain_index : int array. Number of 'TER' lines before the record. (same as splitting
+                  the file by line_feed+'TER' in Structure.fromPDB)
+    '''
+
+    # (start, end) of each fixed-width field
+    col_map = {
+        'line_type' : (0, 6),
+        'atom_id'   : (6, 11),
+        'atom_name' : (12, 16),
+        'resi_name' : (17, 20),
+        'chain_id'  : (21, 22),
+        'resi_id'   : (22, 26),
+        'coord'     : (30, 54),
+        'element'   : (76, 78),
+    }
+    width = 80
+
+    def __init__(self, atom_id, atom_name, resi_name, resi_id, chain_id, coord, element, chain_index):
+        self.atom_id = atom_id
+        self.atom_name = atom_name
+        self.resi_name = resi_name
+        self.resi_id = resi_id
+        self.chain_id = chain_id
+        self.coord = coord
+        self.element = element
+        self.chain_index = chain_index
+
+    @classmethod
+    def fromstr(cls, file_str):
+        '''
+        decode all ATOM/HETATM records in file_str
+        return a PDB_columns object
+        '''
+        lines = file_str.split(line_feed)
+        # pad every line to the fixed width and view the file as a (n_line, width) byte matrix
+        # (one byte per character: non-latin-1 characters e.g. in REMARK/TITLE become '?')
+        buffer = ''.join([line[:cls.width].ljust(cls.width) for line in lines]).encode('latin-1', errors='replace')
+        matrix = np.frombuffer(buffer, dtype=np.uint8).reshape(len(lines), cls.width)
+
+        # chain index: a TER line starts a new chain (except the first line that do not follow a LF)
+        if_ter = cls._get_field(matrix, (0, 3)) == b'TER'
+        if_ter[0] = False
+        chain_index = np.cumsum(if_ter)
+
+        line_type = np.char.strip(cls._get_field(matrix, cls.col_map['line_type']))
+        if_atom = (line_type == b'ATOM') | (line_type == b'HETATM')
+        matrix = matrix[if_atom]
+
+        atom_id = cls._get_field(matrix, cls.col_map['atom_id']).astype(int)
+        atom_name = cls._get_str_field(matrix, cls.col_map['atom_name'])
+        resi_name = cls._get_str_field(matrix, cls.col_map['resi_name'])
+        resi_id = cls._get_field(matrix, cls.col_map['resi_id']).astype(int)
+        chain_id = cls._get_field(matrix, cls.col_map['chain_id']).astype(str)
+        # x, y, z are three 8-width fields in a row
+        c_start, c_end = cls.col_map['coord']
+        coord = np.ascontiguousarray(matrix[:, c_start:c_end]).view('S8').astype(float)
+        element = cls._get_str_field(matrix, cls.col_map['element'])
+
+        return cls(atom_id, atom_name, resi_name, resi_id, chain_id, coord, element, chain_index[if_atom])
+
+    @staticmethod
+    def _get_field(matrix, cols):
+        '''
+        cut a column field from the byte matrix. return a bytes array
+        '''
+        start, end = cols
+        return np.ascontiguousarray(matrix[:, start:end]).view('S'+str(end-start)).ravel()
+
+    @classmethod
+    def _get_str_field(cls, matrix, cols):
+        '''
+        cut a column field from the byte matrix. return a stripped str array
+        '''
+        return np.char.strip(cls._get_field(matrix, cols)).astype(str)
+
+    def get_resi_bounds(self):
+        '''
+        get start index of each residue. A new residue begins when the residue id or the chain index changes.
+        return an array of start indexes with the number of records appended at the end
+        '''
+        n = len(self)
+        if n == 0:
+            return np.array([0])
+        if_new = np.ones(n, dtype=bool)
+        if_new[1:] = (self.resi_id[1:] != self.resi_id[:-1]) | (self.chain_index[1:] != self.chain_index[:-1])
+        return np.append(np.flatnonzero(if_new), n)
+
+    def __len__(self):
+        return len(self.atom_id)
+
@@ -123,7 +123,7 @@ class Traj_calc:
         return new_prmtop_path
 
 
-    def make_dry_frags(self, frag_str, igb=5, if_sol=0):
+    def make_dry_frags(self, frag_str, igb=5, if_sol=0, cache_path=None):
         '''
         Define MMPBSA fragments
         Make dry prmtop files for the MMPB(GB)SA calculation
@@ -138,6 +138,7 @@ class Traj_calc:
                 * DO NOT use original chain id in the pdb file. Count from A and from 1.
         igb:        gb method used
         if_sol:     if use also generate solvent prmtop with tleap. (Because Parmed cannot use in the amber instance on many clusters)
+        cache_path: dir to cache the parsed structure of self.pdb (see Structure.fromPDB). (default: None, no cache)
                 
         update self.dc_prmtop, self.dl_prmtop, self.dr_prmtop
         '''
@@ -152,20 +153,15 @@ class Traj_calc:
         frag1_chains = frag1_str[1].split('+')
         frag2_chains = frag2_str[1].split('+')
 
-        # make new pdb files TODO add method to copy chains to make a new stru_obj. Solve problem that there could be potential metal or ligand
+        # make new pdb files (ligands, metalatoms and solvents are kept in both fragments)
         frag1_path = self.pdb[:-4]+'_frag1.pdb'
         frag2_path = self.pdb[:-4]+'_frag2.pdb'
-        stru1 = Structure.fromPDB(self.pdb)
-        for i in range(len(stru1.chains)-1,-1,-1):
-            if stru1.chains[i].id not in frag1_chains:
-                del stru1.chains[i]
+        stru = Structure.fromPDB(self.pdb, cache_path=cache_path)
+        stru1 = stru.subset(chains=frag1_chains)
         # san check
         if len(stru1.chains) == 0: raise TrajCalcERROR('ERROR: PDB'+ self.pdb+' do not contain chain: '+repr(frag1_chains))
         stru1.build(frag1_path)
-        stru2 = Structure.fromPDB(self.pdb)
-        for i in range(len(stru2.chains)-1,-1,-1):
-            if stru2.chains[i].id not in frag2_chains:
-                del stru2.chains[i]
+        stru2 = stru.subset(chains=frag2_chains)
         # san check
         if len(stru2.chains) == 0: raise TrajCalcERROR('ERROR: PDB '+ self.pdb +' do not contain chain: '+repr(frag2_chains))
         stru2.build(frag2_path)
@@ -47,6 +47,7 @@ class ClusterJob():
         ifcomplete()
         wait_to_end()
         wait_to_array_end()
+        iter_array_end()
     '''
 
     def __init__(self, cluster: ClusterInterface, sub_script_str: str, sub_dir=None, sub_script_path=None) -> None:
@@ -423,44 +424,74 @@ class ClusterJob():
         Return:
         return a list of not completed job. (error + canceled)
         '''
-        # san check
-        for job in jobs:
-            if job.cluster.NAME != jobs[0].cluster.NAME:
-                raise TypeError(f'array job need to use the same cluster! while {job.cluster.NAME} and {jobs[0].cluster.NAME} are found.')
-        # default value
-        if array_size == 0:
-            array_size = len(jobs)
-        # set up array job
+        finished_job = list(cls.iter_array_end(jobs, period, array_size, sub_dir, sub_scirpt_path))
+
+        # summarize
+        n_complete = list(filter(lambda x: x.state[0][0] == 'complete', finished_job))
+        n_error = list(filter(lambda x: x.state[0][0] == 'error', finished_job))
+        n_cancel = list(filter(lambda x: x.state[0][0] == 'cancel', finished_job))
+        if Config.debug > 0:
+            print(f'Job array finished: {len(n_complete)} complete {len(n_error)} error {len(n_cancel)} cancel')
+        
+        return n_error + n_cancel
+
+    @classmethod
+    def iter_array_end(
+            cls, 
+            jobs, 
+            period: int, 
+            array_size: int = 0, 
+            sub_dir = None, 
+            sub_scirpt_path = None
+        ):
+        '''
+        submit an array of jobs in a way that only {array_size} number of jobs is submitted simultaneously.
+        Yield each job when it ends. (in the order of ending)
+        
+        Args:
+        jobs:
+            an iterable of ClusterJob object to be execute. It can be lazy (e.g.: a generator that
+            configs a job once its input file is written): a job is taken only when there is a free
+            slot in the array, so it is submitted as soon as it is available.
+        period:
+            the time cycle for update job state change (Unit: s)
+        array_size:
+            how many jobs are allowed to submit simultaneously. (default: 0 means no limit)
+        sub_dir, sub_scirpt_path:
+            see wait_to_array_end
+
+        Return:
+        a generator of ended jobs (complete + error + canceled)
+        '''
+        jobs = iter(jobs)
+        first_job = None
         current_active_job = []
-        total_job_num = len(jobs)
-        finished_job = []
-        i = 0 # submitted job number
-        while len(finished_job) < total_job_num:
-            # before every job finishes, run
+        if_all_taken = False
+        while not if_all_taken or current_active_job:
             # 1. make up the running chunk to the array size
-            while len(current_active_job) < array_size and i < len(jobs):
-                jobs[i].submit(sub_dir, sub_scirpt_path)
-                current_active_job.append(jobs[i])
-                i += 1
+            while not if_all_taken and (array_size == 0 or len(current_active_job) < array_size):
+                job = next(jobs, None)
+                if job is None:
+                    if_all_taken = True
+                    break
+                # san check
+                if first_job is None:
+                    first_job = job
+                if job.cluster.NAME != first_job.cluster.NAME:
+                    raise TypeError(f'array job need to use the same cluster! while {job.cluster.NAME} and {first_job.cluster.NAME} are found.')
+                job.submit(sub_dir, sub_scirpt_path)
+                current_active_job.append(job)
             # 2. check every job in the array to detect completion of jobs and deal with some error
             for j in range(len(current_active_job)-1,-1,-1):
                 job = current_active_job[j]
                 if job.get_state()[0] not in ['pend', 'run']:
                     if Config.debug > 1:
                         cls._action_end_with(job)
-                    finished_job.append(job)
                     del current_active_job[j]
+                    yield job
             # 3. wait a period before next check
-            time.sleep(period)
-        
-        # summarize
-        n_complete = list(filter(lambda x: x.state[0][0] == 'complete', finished_job))
-        n_error = list(filter(lambda x: x.state[0][0] == 'error', finished_job))
-        n_cancel = list(filter(lambda x: x.state[0][0] == 'cancel', finished_job))
-        if Config.debug > 0:
-            print(f'Job array finished: {len(n_complete)} complete {len(n_error)} error {len(n_cancel)} cancel')
-        
-        return n_error + n_cancel
+            if current_active_job:
+                time.sleep(period)
 
     ### misc ###
     def require_job_id(self) -> None:
@@ -6,15 +6,24 @@ import math
 from subprocess import CompletedProcess, SubprocessError, run
 import time
 import os
+import queue
+import threading
+import hashlib
+import zipfile
+import gc
+from contextlib import contextmanager
 import numpy as np
 
 from Class_Conf import Config
+from Class_AmberMask import AmberMask
 '''
 ====
 Tree
 ====
 '''
 class Child():
+    __slots__ = ('parent',)
+
     def __init__(self):
         self.parent = None
     def set_parent(self, parent_obj):
@@ -22,6 +31,15 @@ class Child():
 
         return self
 
+    def _touch(self, topology=1):
+        '''
+        report a change of the tree to the root object
+        topology: 1 - children are added/deleted/reordered
+                  0 - only ids are changed
+        '''
+        if self.parent is not None:
+            self.parent._touch(topology)
+
 '''
 Text
 '''
@@ -36,6 +54,81 @@ def mkdir(dir):
     else:
         os.makedirs(dir)
 
+@contextmanager
+def gc_paused():
+    '''
+    pause the cyclic garbage collector in the block. (for building a large number of objects at once)
+    '''
+    if_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if if_enabled:
+            gc.enable()
+
+def get_file_hash(*items):
+    '''
+    return a sha1 hex digest of items (str or bytes)
+    '''
+    sha = hashlib.sha1()
+    for item in items:
+        if isinstance(item, str):
+            item = item.encode()
+        sha.update(item)
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+def load_array_cache(cache_dir, key):
+    '''
+    load the arrays saved by save_array_cache under the key. return a dict or None if not cached.
+    The file is marked as recently used.
+    '''
+    path = os.path.join(cache_dir, key+'.npz')
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+        # missing, truncated or foreign file: a cache miss
+        return None
+    os.utime(path)
+    return arrays
+
+def save_array_cache(cache_dir, key, arrays, max_size=None):
+    '''
+    save a dict of arrays to cache_dir/key.npz
+    max_size: size cap of cache_dir in MB. remove least recently used files beyond it.
+    '''
+    mkdir(cache_dir)
+    path = os.path.join(cache_dir, key+'.npz')
+    # write to a temp file and rename to be safe with concurrent readers
+    tmp_path = path+'.'+str(os.getpid())+'.tmp'
+    with open(tmp_path, 'wb') as of:
+        np.savez(of, **arrays)
+    os.replace(tmp_path, path)
+
+    if max_size is not None:
+        files = []
+        for name in os.listdir(cache_dir):
+            if name.endswith('.npz'):
+                f_path = os.path.join(cache_dir, name)
+                try:
+                    f_stat = os.stat(f_path)
+                except OSError:
+                    continue
+                files.append((f_stat.st_mtime, f_stat.st_size, f_path))
+        files.sort()
+        total = sum(f[1] for f in files)
+        for mtime, size, f_path in files:
+            if total <= max_size * 1024**2 or f_path == path:
+                break
+            try:
+                os.remove(f_path)
+            except OSError:
+                pass
+            total -= size
+    return path
+
 def is_empty_dir(dir_path):
     '''
     check if the dir_path is an empty dir
@@ -108,6 +201,26 @@ def get_field_strength_value(p0, c0, p1, p2=None, d1=None):
     return Ed
 
 
+def get_field_strength_values(p0, c0, p1, d1):
+    '''
+    vectorized get_field_strength_value of many point charges, points and directions
+    return field strength E of each *p0(c0)* at *p1* in direction of *d1* (Unit: kcal/(mol*e*Ang))
+    point charges:  c0 (n_charge,) in p0 (..., n_charge, 3)
+    points:         p1 (..., 3)
+    directions:     d1 (..., 3) (not need to be normalized)
+    (... are broadcasted. e.g.: frames or probes)
+    -------
+    return a (..., n_charge) array
+    '''
+    k = 332.4   # kcal*Ang/(mol*e^2) (see get_field_strength_value)
+    d1 = np.asarray(d1, dtype=float)
+    d1 = d1 / np.sqrt(np.einsum('...i,...i->...', d1, d1))[..., np.newaxis]
+    r = np.asarray(p1, dtype=float)[..., np.newaxis, :] - p0
+    r_m2 = np.einsum('...i,...i->...', r, r)
+    # E = kq/r^2 * r/|r| projected to d1
+    return (k * np.asarray(c0, dtype=float)) * np.einsum('...ci,...i->...c', r, d1) / (r_m2 * np.sqrt(r_m2))
+
+
 def get_center(p1, p2):
     '''
     return the center of p1 and p2
@@ -126,6 +239,234 @@ def round_by(num: float, cutnum: float) -> int:
         int_part += 1
     return int(int_part)
 
+
+def get_bond_components(n_atom, bonds):
+    '''
+    label connected atoms
+    n_atom: number of atoms
+    bonds : (n_bond, 2) array of atom indexes
+    return an array of the component index of each atom (components are numbered by their first atom)
+    '''
+    labels = np.arange(n_atom)
+    bonds = np.asarray(bonds, dtype=int).reshape(-1, 2)
+    i, j = bonds[:, 0], bonds[:, 1]
+    while True:
+        # hook each bond to the smaller label and compress the label tree
+        low = np.minimum(labels[i], labels[j])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, labels[i], low)
+        np.minimum.at(new_labels, labels[j], low)
+        while True:
+            jumped = new_labels[new_labels]
+            if np.array_equal(jumped, new_labels):
+                break
+            new_labels = jumped
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+
+class BondGraph():
+    '''
+    bond graph of atoms in the compressed sparse row (CSR) form.
+    Neighbors of atom i are indices[indptr[i]:indptr[i+1]] (in the order the edges are given).
+    -------------
+    BondGraph(n_atom, edges)         edges: (n_edge, 2) directed (i -> j) pairs. Repeated ones are dropped.
+    BondGraph.fromBonds(n_atom, bonds) bonds: (n_bond, 2) pairs. Both directions are added.
+    -------------
+    n_atom
+    indptr  : (n_atom+1,) array
+    indices : (n_edge,) array of neighbor indexes
+    -------------
+    Method
+    -------------
+    get_neighbors(i)
+    get_neighbor_lists(): [[j, ...], ...] of all atoms
+    get_degree()
+    get_pairs(): (n_bond, 2) array of bonded (i, j) with i < j
+    get_boundary(if_sele): bonds cut by a selection
+    '''
+
+    def __init__(self, n_atom, edges):
+        self.n_atom = int(n_atom)
+        edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+        # drop repeated edges (keep the first) then group by the source atom (stable)
+        first_index = np.sort(np.unique(edges[:, 0]*self.n_atom + edges[:, 1], return_index=True)[1])
+        edges = edges[first_index]
+        edges = edges[np.argsort(edges[:, 0], kind='stable')]
+        self.indices = edges[:, 1].copy()
+        self.indptr = np.zeros(self.n_atom+1, dtype=int)
+        np.cumsum(np.bincount(edges[:, 0], minlength=self.n_atom), out=self.indptr[1:])
+
+    @classmethod
+    def fromBonds(cls, n_atom, bonds):
+        '''
+        add both directions of each bond. (i -> j then j -> i for each bond in the order given)
+        '''
+        bonds = np.asarray(bonds, dtype=int).reshape(-1, 2)
+        return cls(n_atom, np.stack((bonds, bonds[:, ::-1]), axis=1).reshape(-1, 2))
+
+    def get_neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def get_neighbor_lists(self):
+        indices = self.indices.tolist()
+        indptr = self.indptr.tolist()
+        return [indices[indptr[i]:indptr[i+1]] for i in range(self.n_atom)]
+
+    def get_degree(self):
+        return np.diff(self.indptr)
+
+    def _get_sources(self):
+        return np.repeat(np.arange(self.n_atom), self.get_degree())
+
+    def get_pairs(self):
+        '''
+        return a (n_bond, 2) array of bonded (i, j) with i < j. (sorted by i then in the neighbor order)
+        '''
+        src = self._get_sources()
+        if_upper = src < self.indices
+        return np.stack((src[if_upper], self.indices[if_upper]), axis=1)
+
+    def get_boundary(self, if_sele):
+        '''
+        find bonds cut by a selection
+        if_sele: bool array over atoms
+        return (i, j) arrays of bonds with selected i and unselected j (sorted by i then in the neighbor order)
+        '''
+        if_sele = np.asarray(if_sele, dtype=bool)
+        src = self._get_sources()
+        if_cut = if_sele[src] & ~if_sele[self.indices]
+        return src[if_cut], self.indices[if_cut]
+
+    def __repr__(self):
+        return 'BondGraph(n_atom='+str(self.n_atom)+', n_edge='+str(len(self.indices))+')'
+
+
+class CellList():
+    '''
+    spatial index of a set of points for radius queries.
+    Points are binned into cubic cells of cell_size. A query only checks points in the cells around.
+    Only occupied cells are indexed, so the memory does not depend on the extent of the coordinates.
+    -------------
+    CellList(coords, cell_size=4.0)
+    -------------
+    coords    : (N, 3) array (a copy is kept)
+    cell_size : edge length of a cell (Angstrom). Queries with a radius larger than this check more cells.
+    -------------
+    Method
+    -------------
+    query_ball(points, r): all (point, coord) pairs within r
+    query_pairs(r): all (i, j) pairs of coords within r (i < j)
+    '''
+
+    def __init__(self, coords, cell_size=4.0):
+        self.coords = np.array(coords, dtype=float).reshape(-1, 3)
+        self.cell_size = float(cell_size)
+        self.origin = self.coords.min(axis=0) if len(self.coords) else np.zeros(3)
+        cells = self._get_cell(self.coords)
+        # only occupied cells are indexed (a far away point does not grow the index):
+        # axis_cells: occupied cell numbers along each axis. A cell is keyed by its ranks in them.
+        # cell_keys: sorted keys of occupied cells; points of cell_keys[k] are order[cell_start[k]:cell_start[k+1]]
+        self.axis_cells = [np.unique(cells[:, i]) for i in range(3)]
+        keys, if_found = self._get_key(cells)
+        self.order = np.argsort(keys, kind='stable')
+        self.cell_keys, counts = np.unique(keys, return_counts=True)
+        self.cell_start = np.zeros(len(self.cell_keys)+1, dtype=int)
+        np.cumsum(counts, out=self.cell_start[1:])
+
+    def _get_cell(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def _get_key(self, cells):
+        '''
+        return (keys, if_found): a int64 key of each cell and if the cell is in the occupied rows/columns/layers
+        '''
+        keys = np.zeros(len(cells), dtype=np.int64)
+        if_found = np.ones(len(cells), dtype=bool)
+        for i, axis_cells in enumerate(self.axis_cells):
+            rank = np.searchsorted(axis_cells, cells[:, i])
+            if_in = rank < len(axis_cells)
+            if_in[if_in] = axis_cells[rank[if_in]] == cells[if_in, i]
+            if_found &= if_in
+            keys = keys * (len(axis_cells) + 1) + rank
+        return keys, if_found
+
+    def _get_offsets(self, r, half=0):
+        '''
+        cell offsets to check for radius r. half=1: only half of them (for pairs within the same set)
+        '''
+        reach = max(1, int(np.ceil(r / self.cell_size)))
+        span = np.arange(-reach, reach+1)
+        offsets = np.stack(np.meshgrid(span, span, span, indexing='ij'), axis=-1).reshape(-1, 3)
+        if half:
+            # keep (0,0,0) and offsets that are lexicographically positive
+            sign = np.sign(offsets[:, 0])*9 + np.sign(offsets[:, 1])*3 + np.sign(offsets[:, 2])
+            offsets = offsets[sign >= 0]
+        return offsets
+
+    def _gather(self, q_cells, offset):
+        '''
+        for each query cell shifted by offset: return (query index, point index) of all points in that cell
+        '''
+        keys, if_found = self._get_key(q_cells + offset)
+        # look up the occupied cells
+        k = np.searchsorted(self.cell_keys, keys)
+        if_found &= k < len(self.cell_keys)
+        if_found[if_found] = self.cell_keys[k[if_found]] == keys[if_found]
+        q_index = np.flatnonzero(if_found)
+        k = k[q_index]
+        start = self.cell_start[k]
+        counts = self.cell_start[k+1] - start
+        total = counts.sum()
+        # expand each [start, start+count) range
+        pos = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+        return np.repeat(q_index, counts), self.order[pos]
+
+    def query_ball(self, points, r):
+        '''
+        find all coords within r of each point
+        return (point_index, coord_index, distance) arrays sorted by point_index
+        '''
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        q_cells = self._get_cell(points)
+        q_all = []
+        p_all = []
+        for offset in self._get_offsets(r):
+            q_index, p_index = self._gather(q_cells, offset)
+            q_all.append(q_index)
+            p_all.append(p_index)
+        return self._filter(points, np.concatenate(q_all), np.concatenate(p_all), r, sort=1)
+
+    def query_pairs(self, r):
+        '''
+        find all pairs of coords within r
+        return (i, j, distance) arrays with i < j
+        '''
+        cells = self._get_cell(self.coords)
+        i_all = []
+        j_all = []
+        for offset in self._get_offsets(r, half=1):
+            i_index, j_index = self._gather(cells, offset)
+            if not offset.any():
+                # same cell: each pair once
+                keep = i_index < j_index
+                i_index, j_index = i_index[keep], j_index[keep]
+            i_all.append(i_index)
+            j_all.append(j_index)
+        i_index, j_index, dist = self._filter(self.coords, np.concatenate(i_all), np.concatenate(j_all), r)
+        return np.minimum(i_index, j_index), np.maximum(i_index, j_index), dist
+
+    def _filter(self, points, q_index, p_index, r, sort=0):
+        dist = np.linalg.norm(points[q_index] - self.coords[p_index], axis=1)
+        keep = dist <= r
+        q_index, p_index, dist = q_index[keep], p_index[keep], dist[keep]
+        if sort:
+            order = np.lexsort((p_index, q_index))
+            q_index, p_index, dist = q_index[order], p_index[order], dist[order]
+        return q_index, p_index, dist
+
 '''
 Cheminfo
 '''
@@ -212,29 +553,27 @@ def decode_atom_mask(stru, mask, ifsolvent=0):
     '''
     decode atom mask and return a list of atom ids.
     Base on the correponding structure obj.
-    ===Only support residues in whole now & do not discrimminate chains start id count from 1===
+    mask: Amber mask (see Class_AmberMask). e.g.: :1-10,15  :LIG<:5.0&!:WAT  @CA
+    ifsolvent: 0: exclude atoms of solvents
+    atom ids are in the order of the structure.
     '''
-    atom_ids = []
+    if_sele = AmberMask.compile(mask).eval(stru)
+    if not ifsolvent:
+        if_sele &= stru.get_resi_column('kind')[stru.get_atom_column('resi_index')] != 3
+    return stru.get_atom_column('atom_id')[if_sele].tolist()
 
-    resi_ids = mask[1:].strip().split(',')
-    for i in range(len(resi_ids)-1, -1, -1):
-        if '-' in resi_ids[i]:
-            r1 = int(resi_ids[i].split('-')[0])
-            r2 = int(resi_ids[i].split('-')[1])
-            resi_ids.extend(list(range(r1, r2+1)))
-            del resi_ids[i]
-    # clean
-    resi_ids = [int(i) for i in resi_ids]
-    resi_ids.sort()
 
-    all_resi = stru.get_all_residue_unit(ifsolvent=ifsolvent)
-    for r_id in resi_ids:
-        for resi in all_resi:
-            if resi.id == r_id:
-                for atom in resi:
-                    atom_ids.append(atom.id)
-
-    return atom_ids
+def get_index_ranges(index):
+    '''
+    compress sorted integers to a range string for masks. e.g.: [1,2,3,5,7,8] -> '1-3,5,7-8'
+    '''
+    index = np.asarray(index, dtype=int)
+    if len(index) == 0:
+        return ''
+    breaks = np.flatnonzero(np.diff(index) != 1)
+    starts = index[np.append(0, breaks + 1)]
+    ends = index[np.append(breaks, len(index) - 1)]
+    return ','.join(str(a) if a == b else str(a)+'-'+str(b) for a, b in zip(starts.tolist(), ends.tolist()))
 
 
 def write_data(tag, data, out_path):
@@ -259,6 +598,31 @@ def chunked(iter_, size):
     '''
     return (iter_[position : position + size] for position in range(0, len(iter_), size))
 
+def iter_in_background(iter_, buffer=1):
+    '''
+    run iter_ in a background thread and return a generator of its items (in order)
+    the worker stays up to {buffer} items ahead of the consumer. (0 means no limit)
+    An exception in the worker is raised in the consumer.
+    '''
+    items = queue.Queue(maxsize=buffer)
+    end = object()
+    def worker():
+        try:
+            for item in iter_:
+                items.put((item, None))
+        except BaseException as e:
+            items.put((end, e))
+        else:
+            items.put((end, None))
+    threading.Thread(target=worker, daemon=True).start()
+    while True:
+        item, e = items.get()
+        if item is end:
+            if e is not None:
+                raise e
+            return
+        yield item
+
 def get_localtime(time_stamp=None):
     if time_stamp is None:
         return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
@@ -308,6 +308,50 @@ def test_ClusterJob_wait_to_array_end_ACCRE():
         assert job.job_id is not None
         assert job.state[0][0] in ('complete', 'cancel', 'error')
 
+
+class FakeCluster(clusters.accre.Accre):
+    '''
+    a cluster that runs nothing: each job ends at the second state check
+    '''
+    n_check = {}
+    n_active = []
+
+    @classmethod
+    def submit_job(cls, sub_dir, script_path, debug=0):
+        job_id = str(len(cls.n_check))
+        cls.n_check[job_id] = 0
+        cls.n_active.append(sum(n < 2 for n in cls.n_check.values()))
+        return job_id, f'{sub_dir}/slurm-{job_id}.out'
+
+    @classmethod
+    def get_job_state(cls, job_id):
+        cls.n_check[job_id] += 1
+        if cls.n_check[job_id] < 2:
+            return ('run', 'RUNNING')
+        return ('complete', 'COMPLETED')
+
+
+def test_ClusterJob_iter_array_end(tmp_path):
+    configured = []
+    def config_jobs():
+        # a lazy array (e.g.: input files still being written)
+        for i in range(7):
+            configured.append(i)
+            yield ClusterJob(FakeCluster(), sub_script_str='echo', sub_dir=str(tmp_path), sub_script_path=f'{tmp_path}/test_{i}.cmd')
+    ended_jobs = []
+    for job in ClusterJob.iter_array_end(config_jobs(), period=0, array_size=3):
+        assert job.state[0][0] == 'complete'
+        # a job is taken only when there is a free slot
+        assert len(configured) <= len(ended_jobs) + 4
+        ended_jobs.append(job)
+    assert sorted(int(job.job_id) for job in ended_jobs) == list(range(7))
+    assert max(FakeCluster.n_active) == 3
+    assert os.path.isfile(f'{tmp_path}/test_6.cmd')
+    # the whole array
+    jobs = [ClusterJob(FakeCluster(), sub_script_str='echo', sub_dir=str(tmp_path), sub_script_path=f'{tmp_path}/test_{i}.cmd') for i in range(4)]
+    assert ClusterJob.wait_to_array_end(jobs, period=0) == []
+    assert all(job.state[0][0] == 'complete' for job in jobs)
+
 ### utilities ###
 @pytest.mark.clean
 def test_clean_files():
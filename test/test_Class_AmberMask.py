@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from Class_Structure import Structure
+from Class_AmberMask import AmberMask
+from Class_Conf import Config
+from helper import decode_atom_mask
+
+Config.debug = 0
+test_pdb = './test/testfile_Class_PDB/FAcD.pdb'
+
+
+def _brute_sele(stru, if_resi, if_atom):
+    '''
+    reference selection by looping over residue units and atoms
+    '''
+    result = []
+    for resi in stru.get_all_residue_unit():
+        atoms = [resi] if resi.__class__.__name__ == 'Metalatom' else resi
+        for atom in atoms:
+            if if_resi(resi) and if_atom(atom):
+                result.append(atom.id)
+    return sorted(result)
+
+
+def test_parse_tree():
+    assert AmberMask(':1-3,LIG').tree == ('sele', [('id', 1, 3), ('name', 'LIG')], None)
+    assert AmberMask(':1@CA,N').tree == ('sele', [('id', 1, 1)], [('name', 'CA'), ('name', 'N')])
+    assert AmberMask('@/C').tree == ('sele', None, [('ele', 'C')])
+    assert AmberMask('!:1 | :2 & @CA').tree == ('or', ('not', ('sele', [('id', 1, 1)], None)),
+                                                ('and', ('sele', [('id', 2, 2)], None), ('sele', None, [('name', 'CA')])))
+    assert AmberMask(':LIG<:5').tree == ('dist', ('sele', [('name', 'LIG')], None), '<', ':', 5.0)
+    assert AmberMask.compile(':1') is AmberMask.compile(':1')
+    for bad in ('', ':1 &', '(:1', ':1 )', ':1,,2'):
+        with pytest.raises(Exception):
+            AmberMask(bad)
+
+
+def test_eval_match_brute_force():
+    stru = Structure.fromPDB(test_pdb)
+    cases = {
+        ':1-5,10': (lambda r: r.id in (1, 2, 3, 4, 5, 10), lambda a: True),
+        ':1-20@CA,N': (lambda r: 1 <= r.id <= 20, lambda a: a.name in ('CA', 'N')),
+        ':HI*': (lambda r: r.name.startswith('HI'), lambda a: True),
+        '@H?': (lambda r: True, lambda a: len(a.name) == 2 and a.name[0] == 'H'),
+        ':1-30 & !@/H': (lambda r: 1 <= r.id <= 30, lambda a: (a.get_ele(), a.ele)[1] != 'H'),
+    }
+    for mask, (if_resi, if_atom) in cases.items():
+        ids = sorted(AmberMask.compile(mask).get_atom_ids(stru))
+        assert ids == _brute_sele(stru, if_resi, if_atom), mask
+    n_atom = len(stru.coords)
+    assert AmberMask('*').eval(stru).sum() == n_atom
+    assert (AmberMask(':1-10 | !:1-10').eval(stru)).all()
+
+
+def test_eval_distance():
+    stru = Structure.fromPDB(test_pdb)
+    coords = stru.coords
+    center = AmberMask(':10').eval(stru)
+    d_min = np.min(np.linalg.norm(coords[:, None, :] - coords[center][None, :, :], axis=2), axis=1)
+    assert np.array_equal(AmberMask(':10<@4.0').eval(stru), d_min <= 4.0)
+    assert np.array_equal(AmberMask(':10>@4.0').eval(stru), d_min > 4.0)
+    # residue level: whole residues with any atom in range
+    resi_sele = AmberMask(':10<:4.0').eval(stru)
+    resi_index = stru.get_atom_column('resi_index')
+    assert set(resi_index[resi_sele]) == set(resi_index[d_min <= 4.0])
+
+
+def test_decode_atom_mask():
+    stru = Structure.fromPDB(test_pdb)
+    ids = decode_atom_mask(stru, ':3-4,1')
+    ref = [atom.id for r_id in (1, 3, 4) for resi in stru._find_resi_units(r_id, ifsolvent=0) for atom in resi]
+    assert ids == ref
+
+
+def test_eval_follow_attribute_changes():
+    '''
+    atom type, atom name and residue name set directly on the objects are used in the next evaluation
+    '''
+    stru = Structure.fromPDB(test_pdb)
+    assert AmberMask('@%CT').eval(stru).sum() == 0
+    assert AmberMask(':ASP').eval(stru).sum() > 0
+    for atom in stru.get_atoms():
+        atom.type = 'CT'
+    assert AmberMask('@%CT').eval(stru).sum() == len(stru.coords)
+    assert stru.copy().get_atoms()[0].type == 'CT'
+    n_asp = AmberMask(':ASP').eval(stru).sum()
+    for resi in stru.get_all_residue_unit():
+        if resi.name == 'ASP':
+            resi.name = 'ASH'
+    assert AmberMask(':ASP').eval(stru).sum() == 0
+    assert AmberMask(':ASH').eval(stru).sum() == n_asp
+    stru.chains[0][0][0].name = 'XX'
+    assert AmberMask('@XX').get_atoms(stru) == [stru.chains[0][0][0]]
@@ -0,0 +1,160 @@
+import numpy as np
+import pytest
+
+from Class_ONIOM_Frame import Frame
+from Class_Traj import write_mdcrd
+from Class_Conf import Config
+from test_Class_Traj import _get_coords
+
+Config.debug = 0
+
+
+def test_fromMDCrd(tmp_path):
+    path = str(tmp_path / 'test.mdcrd')
+    prmtop_path = str(tmp_path / 'test.prmtop')
+    coords = _get_coords(3, 11)
+    write_mdcrd(path, coords)
+    with open(prmtop_path, 'w') as of:
+        of.write('%VERSION  VERSION_STAMP = V0001.000\n%FLAG POINTERS\n%FORMAT(10I8)\n      11       1\n')
+    frames = Frame.fromMDCrd(path, prmtop_path=prmtop_path)
+    assert len(frames) == 3
+    assert np.array_equal(frames[2].coord, coords[2])
+    assert frames[1][4].tolist() == coords[1, 4].tolist()
+    assert frames[0].coord.base is frames[1].coord.base
+
+
+def _write_g_out(path, steps):
+    '''
+    write a gaussian output like file with an Input and a Standard orientation block for each step
+    '''
+    dash = ' ' + '-'*69 + '\n'
+    with open(path, 'w') as of:
+        of.write(' Entering Gaussian System, Link 0=g16\n')
+        for coords in steps:
+            for title in ('Input orientation:', 'Standard orientation:'):
+                of.write(' '*25 + title + '\n' + dash)
+                of.write(' Center     Atomic      Atomic             Coordinates (Angstroms)\n')
+                of.write(' Number     Number       Type             X           Y           Z\n' + dash)
+                for i, (x, y, z) in enumerate(coords):
+                    of.write('%7d%11d%12d%16.6f%12.6f%12.6f\n' % (i+1, 6, 0, x, y, z))
+                of.write(dash)
+            of.write(' SCF Done:  E(RB3LYP) =  -100.000000000     A.U. after   10 cycles\n')
+        of.write(' Normal termination of Gaussian 16\n')
+
+
+def test_fromGaussinOut(tmp_path):
+    from Class_ONIOM_Frame import getOrientations
+    path = str(tmp_path / 'test.out')
+    steps = np.random.default_rng(0).uniform(-20, 20, (7, 4, 3)).round(6)
+    _write_g_out(path, steps)
+    frame = Frame.fromGaussinOut(path)
+    assert np.array_equal(frame.coord, steps[-1])
+    assert np.array_equal(getOrientations(path), steps)
+    # every k-th and the last step
+    assert np.array_equal(getOrientations(path, every=3), steps[[0, 3, 6]])
+    assert np.array_equal(getOrientations(path, every=4), steps[[0, 4, 6]])
+    # no coordinate
+    _write_g_out(path, [])
+    assert len(Frame.fromGaussinOut(path).coord) == 0
+    assert getOrientations(path).shape == (0, 0, 3)
+
+
+def _write_oniom_template(path, n_atom, seed=0):
+    '''
+    write an ONIOM gjf template like the one of PDB2QMMM (with a chk_place_holder line)
+    '''
+    rng = np.random.default_rng(seed)
+    coords = rng.uniform(-50, 50, (n_atom, 3))
+    lines = ['%chk=chk_place_holder.chk', '%nprocshared=24', '%mem=48000MB',
+             '# oniom(b3lyp/6-31g(d):amber=softonly)', '', 'title', '', '0 1 0 1 0 1']
+    for i, (x, y, z) in enumerate(coords):
+        layer = 'H' if i % 7 == 0 else 'L'
+        link = ' H-HC 1' if i % 11 == 3 else ''
+        lines.append('%-16s %2s   %-14.8f %-14.8f %-14.8f %s%s' % ('C-CT-%.6f' % (i/1000-0.5), '0', x, y, z, layer, link))
+    lines += ['', ' 1 2 1.0 3 1.0', ' 2', '', 'HrmBnd1    N-CX-C3  1.0  80.0', '']
+    with open(path, 'w') as of:
+        of.write('\n'.join(lines))
+    return coords
+
+
+def test_ONIOMTemplate(tmp_path):
+    from Class_ONIOM_Frame import ONIOMTemplate
+    t_path = str(tmp_path / 'QMMM.gjf')
+    _write_oniom_template(t_path, 23)
+    template = ONIOMTemplate.fromPath(t_path)
+    assert ONIOMTemplate.fromPath(t_path) is template
+    assert template.n_atom == 23
+    coords = _get_coords(3, 23)
+    text = template.render(coords[1], chk_path='a.chk').split('\n')
+    assert text[0] == '%chk=a.chk'
+    assert text[7] == '0 1 0 1 0 1'
+    assert text[8] == ' {:<20} {:<3}{:>15.8f}{:>15.8f}{:>15.8f} H'.format('C-CT--0.500000', '0', *coords[1, 0])
+    assert text[11] == ' {:<20} {:<3}{:>15.8f}{:>15.8f}{:>15.8f} L H-HC 1'.format('C-CT--0.497000', '0', *coords[1, 3])
+    assert text[31:] == ['', ' 1 2 1.0 3 1.0', ' 2', '', 'HrmBnd1    N-CX-C3  1.0  80.0', '']
+    assert template.render(coords[1]).startswith('%nprocshared=24\n%mem')
+
+    # write frames (also the per frame Frame.write_to_template and parallel)
+    frames = [Frame(coord) for coord in coords]
+    gjf_paths, chk_paths = template.write_frames(frames)
+    assert gjf_paths[2] == str(tmp_path / 'QMMM_newcoord_2.gjf') and chk_paths[2] == str(tmp_path / 'QMMM_newcoord_2.chk')
+    with open(gjf_paths[2]) as f:
+        text = f.read()
+    assert frames[2].write_to_template(t_path, out_path=str(tmp_path / 'single.gjf'), ifchk=0) == str(tmp_path / 'single.gjf')
+    with open(str(tmp_path / 'single.gjf')) as f:
+        assert f.read() == text.replace('%chk='+chk_paths[2]+'\n', '')
+    par_paths = template.write_frames(coords, out_path=str(tmp_path / 'par.gjf'), ifchk=0, n_proc=2)
+    with open(par_paths[2]) as f:
+        assert f.read() == text.replace('%chk='+chk_paths[2]+'\n', '')
+    with pytest.raises(Exception):
+        template.render(coords[1, :20])
+
+
+def _get_sele_list(n_atom, seed=0):
+    '''
+    a sele list like the one of Structure.get_sele_list: backbone (b), other (_) and link atom (id1-id2-d) labels
+    '''
+    rng = np.random.default_rng(seed)
+    sele_list = {}
+    for atom_id in sorted(rng.choice(np.arange(1, n_atom+1), n_atom//2, replace=False).tolist()):
+        sele_list[str(atom_id)+('b' if atom_id % 3 else '_')] = 'CNOS'[atom_id % 4]
+        if atom_id % 5 == 0:
+            sele_list['-'.join((str(atom_id), str(n_atom-atom_id+1), '1.09'))] = 'H'
+    sele_list['1'] = 'Fe'
+    return sele_list
+
+
+def test_QMSelection(tmp_path):
+    from Class_ONIOM_Frame import QMSelection
+    from helper import set_distance
+    sele_list = _get_sele_list(40)
+    sele = QMSelection(sele_list)
+    assert sele == sele_list and QMSelection.compile(sele) is sele
+    assert len(sele.index) == len(sele.element) == len(sele_list)
+    assert len(sele.link_line) == len([key for key in sele_list if '-' in key]) > 0
+    # coordinates of all frames
+    coords = _get_coords(5, 40)
+    sele_coords = sele.get_coords(coords)
+    assert sele_coords.shape == (5, len(sele_list), 3)
+    for key, line_coord in zip(sele_list, sele_coords[3]):
+        if '-' in key:
+            id1, id2, d = key.split('-')
+            assert np.allclose(line_coord, set_distance(coords[3, int(id1)-1], coords[3, int(id2)-1], float(d)))
+        else:
+            assert np.array_equal(line_coord, coords[3, int(key.rstrip('b_'))-1])
+    assert np.array_equal(sele.get_coords(coords[3])[0], sele_coords[3])
+
+    # batch writing is the same as writing each frame
+    frames = [Frame(coord) for coord in coords]
+    paths = sele.write_frames(frames, str(tmp_path / 'qm_cluster.gjf'), g_route='# hf/3-21g', g_cores=8, g_mem_cores=2000, chrgspin=(-1, 2), ifchk=1)
+    assert paths[4] == str(tmp_path / 'qm_cluster_4.gjf')
+    frames[4].write_sele_lines(sele_list, out_path=str(tmp_path / 'single.gjf'), g_route='# hf/3-21g', g_cores=8, g_mem_cores=2000, chrgspin=(-1, 2), ifchk=1)
+    with open(paths[4]) as f_batch, open(str(tmp_path / 'single.gjf')) as f_single:
+        text = f_batch.read()
+        assert text.replace('qm_cluster_4.chk', 'single.chk') == f_single.read()
+    lines = text.split('\n')
+    assert lines[:8] == ['%chk='+str(tmp_path / 'qm_cluster_4.chk'), '%mem=15000MB', '%nprocshared=8', '# hf/3-21g', '', 'Title Card Required', '', '-1 2']
+    assert lines[-2:] == ['', '']
+    assert lines[8] == '{:<5}{:>15.8f}{:>15.8f}{:>15.8f}'.format(sele.element[0], *sele_coords[4, 0])
+    xyz_paths = sele.write_frames(coords, str(tmp_path / 'qm_cluster.xyz'), g_route=None, g_cores=None, g_mem_cores=None, ff='xyz')
+    with open(xyz_paths[0]) as f:
+        assert f.readline() == str(len(sele_list))+'\n'
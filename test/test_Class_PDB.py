@@ -2,6 +2,7 @@ import copy
 from glob import glob
 from random import choice
 import os
+import numpy as np
 import pytest
 
 from Class_PDB import PDB
@@ -9,6 +10,7 @@ from Class_Conf import Config
 from core.clusters import accre
 from helper import is_empty_dir
 from AmberMaps import Resi_list, Resi_map2
+from test_Class_Prmtop import _make_prmtop_from_stru
 
 test_file_paths = []
 test_file_dirs = []
@@ -333,6 +335,215 @@ def test_make_single_g16_job_loop():
         pass# assert len(job.sub_script_str.splitlines()) == len(jobs[0].sub_script_str.splitlines())
 
 
+def test_get_oniom_g16_coord(tmp_path):
+    from Class_Structure import Structure
+    prepi_path = {'FAH':'test/testfile_Class_PDB/ligands/ligand_FAH.prepin'}
+    pdb_obj = PDB('test/testfile_Class_PDB/FAcD.pdb', wk_dir=str(tmp_path))
+    pdb_obj.stru = Structure.fromPDB(pdb_obj.path)
+    n_atom = len(pdb_obj.stru.coords)
+    pdb_obj.chrg_list_all = [0.1]*n_atom
+    resi = pdb_obj.stru.chains[0][10]
+    pdb_obj.layer = [[atom.id for atom in resi]]
+    pdb_obj.stru.get_connectivty_table(prepi_path=prepi_path)
+    lines = pdb_obj._get_oniom_g16_coord(prepi_path=prepi_path).splitlines()
+    assert len(lines) == n_atom
+    assert lines[resi.CA.id-1] == resi.CA.build_oniom('h', 0.1).rstrip()
+    # link atoms: C of the previous residue and N of the next one
+    prev_c = pdb_obj.stru.chains[0][9].C
+    assert lines[prev_c.id-1] == prev_c.build_oniom('l', 0.1, cnt_info=['H', '', resi.N.id]).rstrip()
+    assert sum(' H- ' in line for line in lines) == 2
+    # a low layer atom is connecting 2 higher layer atoms
+    pdb_obj.layer = [[pdb_obj.stru.chains[0][9].CA.id, pdb_obj.stru.chains[0][11].CA.id] + [atom.id for atom in resi if atom.name not in ('CA',)]]
+    with pytest.raises(Exception):
+        pdb_obj._get_oniom_g16_coord(prepi_path=prepi_path)
+
+
+def test_pdb_reuse_prmtop_stru(tmp_path):
+    import pickle
+    from Class_Structure import Structure
+    Config.debug = 0
+    Structure.fromPDB('./test/testfile_Class_PDB/FAcD.pdb').subset(metalatoms=[]).build(str(tmp_path / 'ref.pdb'))
+    ref = Structure.fromPDB(str(tmp_path / 'ref.pdb'))
+    ref.get_connect(prepi_path={'FAH': './test/testfile_Class_PDB/ligands/ligand_FAH.prepin'})
+    prmtop_path = str(tmp_path / 'ref.prmtop')
+    _make_prmtop_from_stru(ref, prmtop_path)
+    coords = ref.coords[np.argsort(ref.get_atom_column('atom_id'))]
+
+    pdb_obj = PDB(str(tmp_path / 'ref.pdb'), wk_dir=str(tmp_path))
+    pdb_obj.prmtop_path = prmtop_path
+    pdb_obj.get_stru()
+    pdb_stru = pdb_obj.stru
+    stru = pdb_obj._get_prmtop_stru(coords)
+    assert pdb_obj._get_prmtop_stru(coords + 1.0) is stru
+    # self.stru still is the structure of the pdb file
+    assert pdb_obj.stru is pdb_stru and stru is not pdb_stru
+    assert np.allclose(stru.get_atom(10).coord, coords[9] + 1.0)
+    # picklable with the prmtop
+    assert pickle.loads(pickle.dumps(stru)).prmtop.get_n_atom() == len(coords)
+
+
+def test_pdb_frames_from_nc(tmp_path):
+    from Class_Structure import Structure
+    from Class_Traj import write_mdcrd, write_nc
+    Config.debug = 0
+    Structure.fromPDB('./test/testfile_Class_PDB/FAcD.pdb').subset(metalatoms=[]).build(str(tmp_path / 'ref.pdb'))
+    ref = Structure.fromPDB(str(tmp_path / 'ref.pdb'))
+    ref.get_connect(prepi_path={'FAH': './test/testfile_Class_PDB/ligands/ligand_FAH.prepin'})
+    prmtop_path = str(tmp_path / 'ref.prmtop')
+    _make_prmtop_from_stru(ref, prmtop_path)
+    coords = ref.coords[np.argsort(ref.get_atom_column('atom_id'))]
+    rng = np.random.default_rng(0)
+    traj = (coords + rng.normal(0, 0.1, (6,) + coords.shape)).round(3)
+    write_mdcrd(str(tmp_path / 'prod.mdcrd'), traj[1::2])
+    write_nc(str(tmp_path / 'prod.nc'), traj)
+
+    pdb_obj = PDB(str(tmp_path / 'ref.pdb'), wk_dir=str(tmp_path))
+    pdb_obj.prmtop_path = prmtop_path
+    pdb_obj.mdcrd = str(tmp_path / 'prod.mdcrd')
+    E_mdcrd = pdb_obj.get_field_strength(':1-20', a1=2000, a2=2001)
+    pdb_obj.nc = str(tmp_path / 'prod.nc')
+    assert pdb_obj.sample_nc(start=2, step=2) == (2, -1, 2)
+    assert pdb_obj.mdcrd is None
+    pdb_obj.frames = None
+    E_nc = pdb_obj.get_field_strength(':1-20', a1=2000, a2=2001)
+    assert len(E_nc) == 3
+    # float32 coordinates in the nc file
+    assert np.allclose(E_nc, E_mdcrd, rtol=1e-4)
+
+
+def test_pdb_keep_mask(tmp_path):
+    from Class_Structure import Structure
+    from Class_Traj import read_mdcrd, write_nc
+    Config.debug = 0
+    Structure.fromPDB('./test/testfile_Class_PDB/FAcD.pdb').subset(metalatoms=[]).build(str(tmp_path / 'ref.pdb'))
+    ref = Structure.fromPDB(str(tmp_path / 'ref.pdb'))
+    ref.get_connect(prepi_path={'FAH': './test/testfile_Class_PDB/ligands/ligand_FAH.prepin'})
+    prmtop_path = str(tmp_path / 'ref.prmtop')
+    _make_prmtop_from_stru(ref, prmtop_path)
+    coords = ref.coords[np.argsort(ref.get_atom_column('atom_id'))]
+    rng = np.random.default_rng(0)
+    write_nc(str(tmp_path / 'prod.nc'), (coords + rng.normal(0, 0.1, (4,) + coords.shape)).round(3))
+
+    pdb_obj = PDB(str(tmp_path / 'ref.pdb'), wk_dir=str(tmp_path))
+    pdb_obj.prmtop_path = prmtop_path
+    pdb_obj.nc = str(tmp_path / 'prod.nc')
+    pdb_obj.sample_nc()
+    E_full = pdb_obj.get_field_strength(':1-20', a1=200, a2=201)
+
+    # structure of the kept atoms with the ids of the full system
+    o_path = pdb_obj.nc2mdcrd(engine='numpy', keep_mask=':1-30')
+    n_keep = len(pdb_obj.traj_atom_index)
+    assert pdb_obj.traj_atom_index[-1] + 1 == ref.chains[0][29][-1].id
+    assert read_mdcrd(o_path, n_atom=n_keep).shape == (4, n_keep, 3)
+    pdb_obj.frames = None
+    assert np.allclose(pdb_obj.get_field_strength(':1-20', a1=200, a2=201), E_full, rtol=1e-4)
+    assert len(pdb_obj._prmtop_stru.coords) == n_keep
+    assert pdb_obj._prmtop_stru.get_atom_column('atom_id')[-1] == n_keep
+    assert pdb_obj._prmtop_stru.get_bond_graph().get_pairs().max() < n_keep
+    # the structure of self.path is not replaced
+    assert pdb_obj.stru is None
+    with pytest.raises(Exception, match='keep_mask'):
+        pdb_obj.PDB2QMMM()
+
+    pdb_obj.sample_nc(step=2, keep_mask=':1-30')
+    pdb_obj.frames = None
+    assert np.allclose(pdb_obj.get_field_strength(':1-20', a1=200, a2=201), E_full[::2], rtol=1e-4)
+    assert np.isnan(pdb_obj.frames[0].coord[-1]).all()
+
+    # a frame store records the kept atoms
+    pdb_obj.nc2mdcrd(o_path=str(tmp_path / 'prod.npy'), keep_mask=':1-30', step=2)
+    pdb_obj.traj_atom_index = None
+    pdb_obj.frames = None
+    assert np.allclose(pdb_obj.get_field_strength(':1-20', a1=200, a2=201), E_full[::2], rtol=1e-4)
+    assert len(pdb_obj.traj_atom_index) == n_keep
+
+    # cpptraj strips the other atoms
+    pdb_obj.nc2mdcrd(keep_mask=':1-30')
+    with open(pdb_obj.cache_path+'/cpptraj_nc2mdcrd.in') as f:
+        assert 'strip !@1-'+str(n_keep)+'\n' in f.read()
+
+
+def test_pdb_qmcluster_stream(tmp_path):
+    from Class_Structure import Structure
+    from Class_Traj import write_nc
+    Config.debug = 0
+    Structure.fromPDB('./test/testfile_Class_PDB/FAcD.pdb').subset(metalatoms=[]).build(str(tmp_path / 'ref.pdb'))
+    ref = Structure.fromPDB(str(tmp_path / 'ref.pdb'))
+    prepi_path = {'FAH': './test/testfile_Class_PDB/ligands/ligand_FAH.prepin'}
+    ref.get_connect(prepi_path=prepi_path)
+    prmtop_path = str(tmp_path / 'ref.prmtop')
+    _make_prmtop_from_stru(ref, prmtop_path)
+    coords = ref.coords[np.argsort(ref.get_atom_column('atom_id'))]
+    rng = np.random.default_rng(0)
+    write_nc(str(tmp_path / 'prod.nc'), (coords + rng.normal(0, 0.1, (5,) + coords.shape)).round(3))
+
+    pdb_obj = PDB(str(tmp_path / 'ref.pdb'), wk_dir=str(tmp_path))
+    pdb_obj.prmtop_path = prmtop_path
+    pdb_obj.prepi_path = prepi_path
+    pdb_obj.nc = str(tmp_path / 'prod.nc')
+    pdb_obj.sample_nc()
+    # a local "g16" that copies the input to the output
+    g16_exe = Config.Gaussian.g16_exe
+    Config.Gaussian.g16_exe = 'cat'
+    try:
+        ended = []
+        outs = pdb_obj.PDB2QMCluster(':108,298', g_route='# hf/3-21g', if_cluster_job=0, o_dir=str(tmp_path / 'stream'),
+                                     stream=1, callback=ended.append)
+        outs_list = pdb_obj.PDB2QMCluster(':108,298', g_route='# hf/3-21g', if_cluster_job=0, o_dir=str(tmp_path / 'list'))
+    finally:
+        Config.Gaussian.g16_exe = g16_exe
+    assert outs == [str(tmp_path / 'stream' / ('qm_cluster_'+str(i)+'.out')) for i in range(5)]
+    assert sorted(ended) == outs
+    for out, out_list in zip(outs, outs_list):
+        with open(out) as f, open(out_list) as f_list:
+            text = f.read()
+            assert text == f_list.read()
+        with open(out[:-3]+'gjf') as f:
+            assert text == f.read()
+
+
+def test_field_strength_engine(tmp_path):
+    from Class_Structure import Structure
+    from Class_Traj import write_nc
+    Config.debug = 0
+    Structure.fromPDB('./test/testfile_Class_PDB/FAcD.pdb').subset(metalatoms=[]).build(str(tmp_path / 'ref.pdb'))
+    ref = Structure.fromPDB(str(tmp_path / 'ref.pdb'))
+    prmtop_path = str(tmp_path / 'ref.prmtop')
+    _make_prmtop_from_stru(ref, prmtop_path)
+    coords = ref.coords[np.argsort(ref.get_atom_column('atom_id'))]
+    rng = np.random.default_rng(0)
+    write_nc(str(tmp_path / 'prod.nc'), coords + rng.normal(0, 0.1, (7,) + coords.shape))
+
+    pdb_obj = PDB(str(tmp_path / 'ref.pdb'), wk_dir=str(tmp_path))
+    pdb_obj.prmtop_path = prmtop_path
+    pdb_obj.nc = str(tmp_path / 'prod.nc')
+    pdb_obj.sample_nc()
+    probes = [dict(a1=2000, a2=2001), dict(a1=2000, a2=2001, bond_p1='a1'), dict(a1=2000, d1=(1.0, -2.0, 0.5), bond_p1='a1'),
+              dict(a1=2000, p2=(10.0, 20.0, 30.0)), dict(p1=(1.0, 2.0, 3.0), a2=2001, bond_p1='a1'), dict(p1=(1.0, 2.0, 3.0), d1=(0.0, 0.0, 2.0), bond_p1='a1')]
+    for probe in probes:
+        E_python = pdb_obj.get_field_strength(':1-100', engine='python', **probe)
+        E_numpy = pdb_obj.get_field_strength(':1-100', window=3, **probe)
+        assert len(E_numpy) == 7
+        assert np.allclose(E_numpy, E_python, rtol=1e-9, atol=1e-9)
+    with pytest.raises(Exception):
+        pdb_obj.get_field_strength(':1-100', a1=2000, a2=2001, engine='cuda')
+
+    # many probes in one pass
+    Es = pdb_obj.get_field_strengths(':1-100', probes, window=4)
+    assert Es.shape == (7, len(probes))
+    for E, probe in zip(Es.T, probes):
+        assert np.allclose(E, pdb_obj.get_field_strength(':1-100', engine='python', **probe), rtol=1e-9, atol=1e-9)
+    Es_by_resi, E_resis, resi_ids = pdb_obj.get_field_strengths(':1-100', probes, by_residue=1)
+    assert np.array_equal(Es_by_resi, Es)
+    assert resi_ids == list(range(1, 101))
+    assert E_resis.shape == (7, len(probes), 100)
+    assert np.allclose(E_resis.sum(axis=-1), Es)
+    for i in (0, 41, 99):
+        assert np.allclose(E_resis[:, :, i], pdb_obj.get_field_strengths(':'+str(resi_ids[i]), probes))
+    with pytest.raises(Exception):
+        pdb_obj.get_field_strengths(':1-100', [dict(a1=2000)])
+
+
 ### utilities ###
 @pytest.mark.clean
 def test_clean_files():
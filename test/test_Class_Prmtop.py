@@ -0,0 +1,183 @@
+import numpy as np
+import pytest
+
+from Class_Prmtop import Prmtop
+from Class_PDB import PDB
+
+
+def _write_section(lines, flag, fmt, values, per_line, width, kind, comment=None):
+    lines.append('%FLAG '+flag)
+    if comment is not None:
+        lines.append('%COMMENT '+comment)
+    lines.append('%FORMAT('+fmt+')')
+    if len(values) == 0:
+        lines.append('')
+    for i in range(0, len(values), per_line):
+        row = values[i:i+per_line]
+        if kind == 'a':
+            lines.append(''.join('{:<{w}}'.format(v, w=width) for v in row))
+        elif kind == 'I':
+            lines.append(''.join('{:>{w}d}'.format(v, w=width) for v in row))
+        else:
+            lines.append(''.join('{:>{w}.8E}'.format(v, w=width) for v in row))
+
+
+def _make_prmtop(path, n_atom=23):
+    '''
+    write a prmtop-like file with the sections used in the code
+    '''
+    rng = np.random.default_rng(0)
+    names = ['N', 'H1', 'CA', 'HA', 'CB', 'HB2', 'C', 'O'] * 3
+    names = names[:n_atom]
+    types = ['N3', 'H', 'CX', 'HP', 'CT', 'HC', 'C', 'O'] * 3
+    types = types[:n_atom]
+    charges = rng.uniform(-1, 1, n_atom).round(6) * 18.2223
+    bonds_h = [0, 3, 1, 6, 9, 2]
+    bonds = [0, 6, 3, 6, 12, 4, 12, 15, 5]
+    lines = ['%VERSION  VERSION_STAMP = V0001.000  DATE = 01/01/22  00:00:00']
+    _write_section(lines, 'TITLE', '20a4', ['default_name'], 1, 80, 'a')
+    _write_section(lines, 'POINTERS', '10I8', [n_atom, 5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3], 10, 8, 'I')
+    _write_section(lines, 'ATOM_NAME', '20a4', names, 20, 4, 'a', comment='atom names')
+    _write_section(lines, 'CHARGE', '5E16.8', list(charges), 5, 16, 'E')
+    _write_section(lines, 'RESIDUE_POINTER', '10I8', [1, 9, 17], 10, 8, 'I')
+    _write_section(lines, 'AMBER_ATOM_TYPE', '20a4', types, 20, 4, 'a')
+    _write_section(lines, 'BONDS_INC_HYDROGEN', '10I8', bonds_h, 10, 8, 'I')
+    _write_section(lines, 'BONDS_WITHOUT_HYDROGEN', '10I8', bonds, 10, 8, 'I')
+    _write_section(lines, 'SOLTY', '5E16.8', [], 5, 16, 'E')
+    with open(path, 'w') as of:
+        of.write('\n'.join(lines)+'\n')
+    return names, types, charges
+
+
+def test_prmtop_sections(tmp_path):
+    path = str(tmp_path / 'test.prmtop')
+    names, types, charges = _make_prmtop(path)
+    prmtop = Prmtop(path)
+    assert prmtop.get_n_atom() == 23
+    assert prmtop.get_atom_name().tolist() == names
+    assert prmtop.get_atom_type().tolist() == types
+    assert np.array_equal(prmtop.get_resi_pointer(), [0, 8, 16])
+    assert np.array_equal(prmtop.get_bonds(), [[0, 1], [2, 3], [0, 2], [2, 4], [4, 5]])
+    assert len(prmtop.get_section('SOLTY')) == 0
+    assert ''.join(prmtop.get_section('TITLE')) == 'default_name'
+    # same as reading the values with float()
+    with open(path) as f:
+        lines = f.read().split('%FLAG CHARGE\n')[1].split('%FLAG')[0].split('\n')[1:]
+    ref = [float(i)/18.2223 for line in lines for i in line.split()]
+    assert PDB.get_charge_list(path) == ref
+    with pytest.raises(Exception):
+        prmtop.get_section('NOT_A_FLAG')
+
+
+def test_prmtop_stripped_lines(tmp_path):
+    '''
+    trailing spaces stripped from the inner lines of a section should not shift the fields
+    '''
+    path = str(tmp_path / 'test.prmtop')
+    names, types, charges = _make_prmtop(path)
+    with open(path) as f:
+        lines = [line.rstrip() for line in f]
+    with open(path, 'w') as of:
+        of.write('\n'.join(lines)+'\n')
+    prmtop = Prmtop(path)
+    assert prmtop.get_atom_name().tolist() == names
+    assert prmtop.get_atom_type().tolist() == types
+    assert np.allclose(prmtop.get_charge(), charges/18.2223)
+    # a line with more fields than the %FORMAT
+    with open(path, 'w') as of:
+        of.write('\n'.join(lines).replace('%FORMAT(20a4)', '%FORMAT(10a4)')+'\n')
+    with pytest.raises(Exception):
+        Prmtop(path).get_atom_name()
+
+
+def test_prmtop_cache(tmp_path):
+    path = str(tmp_path / 'test.prmtop')
+    _make_prmtop(path)
+    prmtop = Prmtop.fromPath(path)
+    assert Prmtop.fromPath(path) is prmtop
+    # rewrite the file -> read again
+    _make_prmtop(path, n_atom=20)
+    new = Prmtop.fromPath(path)
+    assert new is not prmtop
+    assert new.get_n_atom() == 20
+
+
+def _make_prmtop_from_stru(stru, path):
+    '''
+    write a prmtop-like file of a structure (atoms in the order of stru.coords; ids must be 1..N in this order)
+    Each chain, ligand, metalatom and solvent residue is a molecule.
+    '''
+    atoms = stru.get_atoms()
+    units = stru._resi_units
+    resi_index = stru.get_atom_resi_index()
+    resi_pointer = (np.flatnonzero(np.diff(np.append(-1, resi_index))) + 1).tolist()
+    mol_sizes = [sum(len(resi) for resi in chain) for chain in stru.chains]
+    mol_sizes += [len(lig) for lig in stru.ligands] + [1]*len(stru.metalatoms) + [len(sol) for sol in stru.solvents]
+    bonds = []
+    for atom in atoms:
+        if atom.connect is not None:
+            bonds.extend((atom.id-1, cnt.id-1) for cnt in atom.connect if cnt.id > atom.id)
+    bond_values = []
+    for i, j in bonds:
+        bond_values.extend([i*3, j*3, 1])
+    lines = ['%VERSION  VERSION_STAMP = V0001.000  DATE = 01/01/22  00:00:00']
+    _write_section(lines, 'POINTERS', '10I8', [len(atoms)]+[0]*10+[len(units)], 10, 8, 'I')
+    _write_section(lines, 'ATOM_NAME', '20a4', [atom.name for atom in atoms], 20, 4, 'a')
+    _write_section(lines, 'CHARGE', '5E16.8', list(np.random.default_rng(0).uniform(-18.2, 18.2, len(atoms))), 5, 16, 'E')
+    _write_section(lines, 'RESIDUE_LABEL', '20a4', [u.resi_name if u in stru.metalatoms else u.name for u in units], 20, 4, 'a')
+    _write_section(lines, 'RESIDUE_POINTER', '10I8', resi_pointer, 10, 8, 'I')
+    _write_section(lines, 'BONDS_INC_HYDROGEN', '10I8', [], 10, 8, 'I')
+    _write_section(lines, 'BONDS_WITHOUT_HYDROGEN', '10I8', bond_values, 10, 8, 'I')
+    _write_section(lines, 'ATOMS_PER_MOLECULE', '10I8', mol_sizes, 10, 8, 'I')
+    with open(path, 'w') as of:
+        of.write('\n'.join(lines)+'\n')
+
+
+def test_structure_fromPrmtop(tmp_path):
+    from Class_Structure import Structure
+    from Class_Conf import Config
+    Config.debug = 0
+    # a structure with sequential atom ids (metalatom lines do not read back: keep none)
+    Structure.fromPDB('./test/testfile_Class_PDB/FAcD.pdb').subset(metalatoms=[]).build(str(tmp_path / 'ref.pdb'))
+    ref = Structure.fromPDB(str(tmp_path / 'ref.pdb'))
+    for chain in ref.chains:
+        for resi in chain:
+            for atom in resi:
+                atom.get_connect()
+    prmtop_path = str(tmp_path / 'ref.prmtop')
+    _make_prmtop_from_stru(ref, prmtop_path)
+
+    stru = Structure.fromPrmtop(prmtop_path, ref.coords[np.argsort(ref.get_atom_column('atom_id'))])
+    assert (len(stru.chains), len(stru.ligands), len(stru.metalatoms), len(stru.solvents)) == \
+           (len(ref.chains), len(ref.ligands), len(ref.metalatoms), len(ref.solvents))
+    stru.build(str(tmp_path / 'new.pdb'))
+    assert (tmp_path / 'new.pdb').read_text() == (tmp_path / 'ref.pdb').read_text()
+    atom = stru.chains[0][5].CA
+    ref_atom = ref.chains[0][5].CA
+    # connectivity is filled upon request
+    assert atom.connect is None
+    stru.get_connect()
+    assert sorted(a.id for a in atom.connect) == sorted(a.id for a in ref_atom.connect)
+    # the bond graph come from the prmtop (no prepin needed for the ligand)
+    assert len(stru.get_bond_graph().get_pairs()) == len(Prmtop.fromPath(prmtop_path).get_bonds())
+    with pytest.raises(Exception):
+        Structure.fromPrmtop(prmtop_path, ref.coords[:10])
+
+    # molecules from bonds if no ATOMS_PER_MOLECULE: same chains for the bonded protein
+    with open(prmtop_path) as f:
+        text = f.read()
+    with open(prmtop_path, 'w') as of:
+        of.write(text.split('%FLAG ATOMS_PER_MOLECULE')[0])
+    stru = Structure.fromPrmtop(prmtop_path, ref.coords[np.argsort(ref.get_atom_column('atom_id'))])
+    assert len(stru.chains) == 1 and len(stru.chains[0]) == len(ref.chains[0])
+
+
+def test_read_inpcrd():
+    from Class_Prmtop import read_inpcrd
+    coords = read_inpcrd('./test/testfile_Class_PDB/MD_test/FAcD_RA124M_ff.inpcrd')
+    assert coords.shape == (36627, 3)
+    with open('./test/testfile_Class_PDB/MD_test/FAcD_RA124M_ff.inpcrd') as f:
+        first = f.readlines()[2]
+    assert np.allclose(coords[0], [float(first[i:i+12]) for i in (0, 12, 24)])
+    assert np.allclose(coords[1], [float(first[i:i+12]) for i in (36, 48, 60)])
+
@@ -0,0 +1,361 @@
+import numpy as np
+import pickle
+import pytest
+
+from Class_Structure import Structure
+from Class_line import PDB_line, PDB_columns
+from Class_Conf import Config
+from helper import decode_atom_mask
+
+Config.debug = 0
+test_pdb = './test/testfile_Class_PDB/FAcD.pdb'
+
+
+def test_pdb_columns_match_pdb_line():
+    '''
+    columnar decoding should give the same values as PDB_line
+    '''
+    with open(test_pdb) as f:
+        file_str = f.read()
+    cols = PDB_columns.fromstr(file_str)
+    pdb_ls = [l for l in PDB_line.fromlines(file_str) if l.line_type in ('ATOM', 'HETATM')]
+
+    assert len(cols) == len(pdb_ls)
+    for i in (0, 1, len(pdb_ls)//2, len(pdb_ls)-1):
+        assert cols.atom_id[i] == pdb_ls[i].atom_id
+        assert cols.atom_name[i] == pdb_ls[i].atom_name
+        assert cols.resi_name[i] == pdb_ls[i].resi_name
+        assert cols.resi_id[i] == pdb_ls[i].resi_id
+        assert list(cols.coord[i]) == [pdb_ls[i].atom_x, pdb_ls[i].atom_y, pdb_ls[i].atom_z]
+    # non-latin-1 text in other records
+    cols_remark = PDB_columns.fromstr('REMARK   1 Δ-mutant 酵素\nTITLE     ∆G test\n'+file_str)
+    assert len(cols_remark) == len(cols)
+    assert np.array_equal(cols_remark.coord, cols.coord)
+    assert np.array_equal(cols_remark.atom_name, cols.atom_name)
+
+
+def test_fromPDB_chains_by_TER():
+    '''
+    chains are split by TER and metal/ligand/solvent are separated
+    '''
+    stru = Structure.fromPDB(test_pdb)
+    assert [chain.id for chain in stru.chains] == ['A']
+    assert [lig.name for lig in stru.ligands] == ['FAH']
+    assert len(stru.metalatoms) == 7
+    assert len(stru.chains[0]) == 297
+    assert stru.chains[0][0].name == 'ASP'
+    assert stru.chains[0][0][0].name == 'N'
+    assert list(stru.chains[0][0][0].coord) == [-16.697, -92.460, 95.147]
+
+
+def test_coords_are_shared_with_atoms():
+    '''
+    Atom.coord is a view of Structure.coords
+    '''
+    stru = Structure.fromPDB(test_pdb)
+    atoms = stru.get_atoms()
+    assert stru.coords.shape == (len(atoms), 3)
+    assert atoms[0] is stru.chains[0][0][0]
+    assert atoms[-1] is stru.metalatoms[-1]
+
+    stru.translate((1.0, 0.0, 0.0))
+    assert np.allclose(atoms[0].coord, [-15.697, -92.460, 95.147])
+    atoms[0].coord = [0.0, 0.0, 0.0]
+    assert np.allclose(stru.coords[0], 0.0)
+
+
+def test_coords_repack_after_delete():
+    '''
+    deleting atoms/residues invalidates the packed array
+    '''
+    stru = Structure.fromPDB(test_pdb)
+    n_atom = len(stru.coords)
+    resi = stru.chains[0][0]
+    n_resi_atom = len(resi)
+    del resi['H1']
+    assert len(stru.coords) == n_atom - 1
+    del stru.chains[0][0]
+    assert len(stru.coords) == n_atom - n_resi_atom
+    assert stru.get_atoms()[0] is stru.chains[0][0][0]
+    assert stru.coords[0] is not stru.chains[0][0][0].coord
+    assert np.shares_memory(stru.coords, stru.chains[0][0][0].coord)
+
+
+def test_slots_attribute_access_and_pickle():
+    '''
+    __slots__ objects keep the attribute-style access and can be pickled
+    '''
+    stru = Structure.fromPDB(test_pdb)
+    chain = stru.chains[0]
+    lig = stru.ligands[0]
+    atom = chain[0][0]
+    assert not hasattr(atom, '__dict__')
+    assert not hasattr(lig, '__dict__')
+    assert chain.i3 is chain[2]
+    assert chain[0].CA.name == 'CA'
+    assert getattr(lig, lig[0].name) is lig[0]
+    assert atom.resi is chain[0]
+    assert atom.charge is None
+
+    stru2 = pickle.loads(pickle.dumps(stru, protocol=5))
+    assert np.array_equal(stru2.coords, stru.coords)
+    assert np.shares_memory(stru2.coords, stru2.chains[0][0][0].coord)
+
+
+def test_resi_and_atom_index_consistency():
+    '''
+    {resi.id: resi} and {atom.name: atom} indexes follow add/delete/sort/rename
+    '''
+    stru = Structure.fromPDB(test_pdb)
+    chain = stru.chains[0]
+    resi = chain._find_resi_id(5)
+    assert resi is chain[4]
+
+    # rename (like Residue.deprotonate)
+    h1 = resi.H
+    h1.name = 'HX'
+    assert resi._find_atom_name('HX') is h1
+    with pytest.raises(IndexError):
+        resi._find_atom_name('H')
+    # delete
+    del resi['HX']
+    with pytest.raises(IndexError):
+        resi._find_atom_name('HX')
+    # delete residue and re-id by sort
+    del chain[0]
+    with pytest.raises(IndexError):
+        chain._find_resi_id(1)
+    chain.sort(sort_resi=0)
+    assert chain._find_resi_id(4) is resi
+    # duplicated name
+    resi.CA.name = 'CB'
+    with pytest.raises(Exception):
+        resi._find_atom_name('CB')
+
+
+def test_registry_follow_version():
+    '''
+    the flat registry is reused until add/sort/deletion
+    '''
+    stru = Structure.fromPDB(test_pdb)
+    registry = stru._get_registry()
+    assert stru._get_registry() is registry
+    lig = stru.ligands[0]
+    assert stru.get_residue(lig.id) is lig
+    assert decode_atom_mask(stru, ':'+str(lig.id)) == [atom.id for atom in lig]
+    first_atom = stru.chains[0][0][0]
+    assert stru.get_atom(first_atom.id) is first_atom
+    assert stru.get_atom_index(first_atom.id) == 0
+    assert list(stru.get_atom_index([lig[0].id, first_atom.id])) == [stru.get_atoms().index(lig[0]), 0]
+
+    del stru.chains[0][0]
+    assert stru._get_registry() is not registry
+    assert stru.get_atom(first_atom.id) is None
+    n_resi = len(stru.get_all_residue_unit())
+    stru.sort()
+    assert stru.get_residue(1) is stru.chains[0][0]
+    assert stru.get_atom_id()[:3] == [1, 2, 3]
+    assert len(stru.get_all_residue_unit()) == n_resi
+
+
+def test_spatial_index_queries():
+    '''
+    cell list queries should match brute force distances
+    '''
+    stru = Structure.fromPDB(test_pdb)
+    coords = stru.coords
+    i, j, d = stru.get_close_pairs(3.0)
+    sub = coords[:800]
+    dist = np.linalg.norm(sub[:, None, :] - sub[None, :, :], axis=2)
+    ref = set(zip(*[x.tolist() for x in np.nonzero(np.triu(dist <= 3.0, 1))]))
+    in_sub = j < 800
+    assert set(zip(i[in_sub].tolist(), j[in_sub].tolist())) == ref
+
+    atom = stru.chains[0][10][1]
+    around = atom.get_around(5.0)
+    d_all = np.linalg.norm(coords - np.array(atom.coord), axis=1)
+    assert len(around) == (d_all <= 5.0).sum() - 1
+    assert atom not in around
+    # moving atoms rebuilds the index
+    stru.translate((100.0, 0, 0))
+    assert len(atom.get_around(5.0)) == len(around)
+    assert stru.get_cell_list().coords[0, 0] == stru.coords[0, 0]
+
+
+def test_fromPDB_cache(tmp_path):
+    '''
+    a cache hit should give the same structure as parsing
+    '''
+    stru_cache = Config.stru_cache
+    Config.stru_cache = 1
+    try:
+        cache_path = str(tmp_path)
+        stru = Structure.fromPDB(test_pdb, cache_path=cache_path)
+        assert len(list((tmp_path / 'stru').iterdir())) == 1
+        cached = Structure.fromPDB(test_pdb, cache_path=cache_path, input_name='cached')
+        assert cached.name == 'cached'
+        assert np.array_equal(cached.coords, stru.coords)
+        for key in ('chain_id', 'unit_kind', 'unit_chain', 'unit_id', 'unit_name', 'unit_size', 'atom_name', 'atom_id'):
+            assert np.array_equal(cached._get_snapshot()[key], stru._get_snapshot()[key])
+        assert cached.metalatoms[0].ele == stru.metalatoms[0].ele
+        assert cached.chains[0][0].chain is cached.chains[0]
+        # a different ligand_list is a different key
+        Structure.fromPDB(test_pdb, cache_path=cache_path, ligand_list=['FAH'])
+        assert len(list((tmp_path / 'stru').iterdir())) == 2
+        # switch off
+        Config.stru_cache = 0
+        Structure.fromPDB(test_pdb, cache_path=cache_path, ligand_list=['XXX'])
+        assert len(list((tmp_path / 'stru').iterdir())) == 2
+    finally:
+        Config.stru_cache = stru_cache
+
+
+def test_copy_and_subset():
+    stru = Structure.fromPDB(test_pdb)
+    stru.chains[0][0][0].get_ele()
+    stru.chains[0][0][0].charge = -0.5
+    new = stru.copy(name='new')
+    assert new.name == 'new'
+    assert np.array_equal(new.coords, stru.coords)
+    assert not np.shares_memory(new.coords, stru.coords)
+    assert new.chains[0][0][0] is not stru.chains[0][0][0]
+    assert new.chains[0][0][0].resi is new.chains[0][0]
+    assert new.chains[0][0].chain is new.chains[0]
+    assert new.metalatoms[0].parent is new
+    assert new.chains[0][0][0].ele == 'N' and new.chains[0][0][0].charge == -0.5
+
+    lig = stru.subset(chains=[], metalatoms=[], solvents=[])
+    assert (len(lig.chains), len(lig.ligands), len(lig.metalatoms)) == (0, len(stru.ligands), 0)
+    assert np.array_equal(lig.coords, stru.coords[stru.get_resi_column('kind')[stru.get_atom_column('resi_index')] == 1])
+    heavy = stru.subset(ligands=[298], metalatoms=[], mask='!@/H')
+    assert len(heavy.ligands) == 1
+    assert all(atom.name[0] != 'H' for resi in heavy.chains[0] for atom in resi)
+
+
+def _build_by_atom(stru, keep_id=0):
+    '''
+    lines of Structure.build made by Atom.build one by one (the reference of the batch writer)
+    '''
+    lines = []
+    r_id = 0
+    a_id = 0
+    def add(atom, c_id=None, new_resi=0):
+        nonlocal a_id, r_id
+        a_id += 1
+        r_id += new_resi
+        if keep_id:
+            lines.append(atom.build(c_id=c_id))
+        else:
+            lines.append(atom.build(a_id=a_id, r_id=r_id, c_id=c_id))
+    for chain in stru.chains:
+        for resi in chain:
+            for i, atom in enumerate(resi):
+                add(atom, new_resi=(i == 0))
+        lines.append('TER\n')
+    c_id = chr(len(stru.chains)+64)
+    for unit in stru.ligands + stru.metalatoms:
+        c_id = chr(ord(c_id)+1)
+        for i, atom in enumerate([unit] if unit in stru.metalatoms else unit):
+            add(atom, c_id, new_resi=(i == 0))
+        lines.append('TER\n')
+    if stru.solvents:
+        c_id = chr(ord(c_id)+1)
+        for solvent in stru.solvents:
+            for i, atom in enumerate(solvent):
+                add(atom, c_id, new_resi=(i == 0))
+        lines.append('TER\n')
+    return ''.join(lines)+'END\n'
+
+
+def test_build_match_atom_build(tmp_path):
+    stru = Structure.fromPDB(test_pdb)
+    stru.build(str(tmp_path / 'out.pdb'))
+    assert (tmp_path / 'out.pdb').read_text() == _build_by_atom(stru)
+    # keep_id (metalatoms do not have a residue id)
+    stru = stru.subset(metalatoms=[])
+    stru.build(str(tmp_path / 'out_id.pdb'), keep_id=1)
+    assert (tmp_path / 'out_id.pdb').read_text() == _build_by_atom(stru, keep_id=1)
+
+
+def test_bond_graph_and_connect():
+    prepi_path = {'FAH': './test/testfile_Class_PDB/ligands/ligand_FAH.prepin'}
+    stru = Structure.fromPDB(test_pdb)
+    with pytest.raises(Exception):
+        stru.get_bond_graph()
+    graph = stru.get_bond_graph(prepi_path=prepi_path)
+    assert graph is stru.get_bond_graph(prepi_path=prepi_path)
+    # chain atoms: same as the residue template of each atom
+    stru.get_connect(prepi_path=prepi_path)
+    atoms = stru.get_atoms()
+    for atom in atoms[:300]:
+        assert atom.connect == atom._get_template_connect()
+    # ligand: bonds of the prepin (coordinate lines and LOOP)
+    index_pairs, name_pairs = Structure._read_prepi_bonds(prepi_path['FAH'])
+    lig = stru.ligands[0]
+    for a, b in index_pairs:
+        assert lig[b] in lig[a].connect and lig[a] in lig[b].connect
+    for name_a, name_b in name_pairs:
+        assert lig._find_atom_name(name_b) in lig._find_atom_name(name_a).connect
+    assert sum(map(len, (atom.connect for atom in lig))) == 2*(len(index_pairs)+len(name_pairs))
+    # rebuilt after a rename (bonds of chain atoms are by name)
+    registry = stru._get_registry()
+    resi = stru.chains[0][3]
+    atom_ca, atom_cb = resi.CA, resi.CB
+    atom_ca.name, atom_cb.name = 'CB', 'CA'
+    graph_renamed = stru.get_bond_graph(prepi_path=prepi_path)
+    assert graph_renamed is not graph
+    assert stru._get_registry() is not registry
+    graph = graph_renamed
+    # rebuilt after a change of the structure
+    del stru.chains[0][5]
+    assert stru.get_bond_graph(prepi_path=prepi_path) is not graph
+    assert stru.get_bond_graph(prepi_path=prepi_path).n_atom == len(stru.get_atoms())
+
+
+def test_sele_list_link_atoms():
+    '''
+    link atoms from the bond graph should be the same as searching atom.connect of each selected atom
+    '''
+    prepi_path = {'FAH': './test/testfile_Class_PDB/ligands/ligand_FAH.prepin'}
+    stru = Structure.fromPDB(test_pdb)
+    for mask in (':108,298', ':1-20', ':A108,A110'):
+        sele_lines, sele_map = stru.get_sele_list(mask, fix_end='H', prepi_path=prepi_path)
+        # the old path
+        stru.get_connect(prepi_path=prepi_path)
+        sele_atoms = [atom for atom in stru.get_atoms() if str(atom.id)+'b' in sele_lines or str(atom.id)+'_' in sele_lines]
+        links = []
+        for atom in sele_atoms:
+            for cnt_atom in atom.connect:
+                if cnt_atom not in sele_atoms:
+                    links.append((str(atom.id), str(cnt_atom.id)))
+        assert [tuple(key.split('-')[:2]) for key in sele_lines if '-' in key] == links
+        assert len(links) > 0
+        # compiled link atom table
+        assert [(str(i+1), str(j+1)) for i, j in zip(sele_lines.link_atom, sele_lines.link_partner)] == links
+
+
+def test_sele_list_masks(tmp_path):
+    '''
+    Amber masks (also with atom names ending in digits) and residue lists (in the order of the list)
+    '''
+    stru = Structure.fromPDB(test_pdb)
+    for mask in (':10@CA,C1', ':10@CA,CB,H1', ':1@H1,H2'):
+        sele_lines, sele_map = stru.get_sele_list(mask, fix_end=None)
+        assert [int(key) for key in sele_map] == decode_atom_mask(stru, mask)
+    sele_lines, sele_map = stru.get_sele_list(':10@CA,C1', fix_end=None)
+    assert len(sele_lines) == 1
+    # residues in the order of the list
+    sele_lines, sele_map = stru.get_sele_list(':12,3', fix_end=None)
+    assert [int(key) for key in sele_map] == [atom.id for atom in stru.chains[0][11]] + [atom.id for atom in stru.chains[0][2]]
+    sele_lines, sele_map = stru.get_sele_list(':1-2,A12', fix_end=None)
+    assert [int(key) for key in sele_map] == [atom.id for resi in stru.chains[0][:2] for atom in resi] + [atom.id for atom in stru.chains[0][11]]
+
+    # chain-prefixed residue list of a 2-chain structure
+    with open(test_pdb) as f:
+        lines = [line for line in f.read().split('\n') if line.startswith('ATOM') and int(line[22:26]) <= 20]
+    lines_b = ['{}{:>5}{}'.format(line[:6], i+len(lines)+1, line[11:]) for i, line in enumerate(lines)]
+    (tmp_path / 'two_chain.pdb').write_text('\n'.join(lines + ['TER'] + lines_b + ['TER', 'END', '']))
+    stru = Structure.fromPDB(str(tmp_path / 'two_chain.pdb'))
+    assert [chain.id for chain in stru.chains] == ['A', 'B']
+    sele_lines, sele_map = stru.get_sele_list(':A12,B3', fix_end=None)
+    assert [int(key) for key in sele_map] == [atom.id for atom in stru.chains[0][11]] + [atom.id for atom in stru.chains[1][2]]
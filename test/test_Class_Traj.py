@@ -0,0 +1,181 @@
+import numpy as np
+import pytest
+
+from Class_ONIOM_Frame import Frame
+from Class_Traj import read_mdcrd, write_mdcrd
+from Class_Conf import Config
+
+Config.debug = 0
+
+
+def _get_coords(n_frame, n_atom, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-99.9, 999.9, (n_frame, n_atom, 3)).round(3)
+
+
+@pytest.mark.parametrize('n_atom', [2, 7, 11, 20])
+@pytest.mark.parametrize('if_box', [0, 1])
+def test_read_mdcrd(tmp_path, n_atom, if_box):
+    path = str(tmp_path / 'test.mdcrd')
+    coords = _get_coords(4, n_atom)
+    box = np.full((4, 3), 61.25) if if_box else None
+    write_mdcrd(path, coords, box=box)
+    new_coords, new_box = read_mdcrd(path, n_atom=n_atom, if_box=1)
+    assert new_coords.shape == (4, n_atom, 3)
+    assert np.array_equal(new_coords, coords)
+    if if_box:
+        assert np.array_equal(new_box, box)
+    else:
+        assert new_box is None
+    # infer n_atom from the file (3*n_atom % 10 is not 0 or 3, or with box)
+    if if_box or (n_atom*3) % 10 not in (0, 3):
+        assert np.array_equal(read_mdcrd(path), coords)
+
+
+def test_read_mdcrd_stripped_and_bad(tmp_path):
+    path = str(tmp_path / 'test.mdcrd')
+    coords = _get_coords(3, 5)
+    coords[0, 0] = [-0.5, 0.0, -12.25]
+    write_mdcrd(path, coords, box=np.ones((3, 3)))
+    with open(path) as f:
+        text = f.read()
+    # trailing spaces and CRLF
+    with open(path, 'w', newline='') as of:
+        of.write(text.replace('\n', '    \r\n'))
+    assert np.array_equal(read_mdcrd(path, n_atom=5), coords)
+    with pytest.raises(Exception):
+        read_mdcrd(path, n_atom=4)
+
+
+def test_MDCrdFile_index_lines(tmp_path):
+    from Class_Traj import MDCrdFile
+    path = str(tmp_path / 'test.mdcrd')
+    coords = _get_coords(4, 5)
+    write_mdcrd(path, coords, box=np.ones((4, 3)))
+    with open(path) as f:
+        lines = f.read().split('\n')
+    # frames of different byte sizes: trailing spaces in some lines and no line feed at the end
+    lines[3] += '   '
+    with open(path, 'w') as of:
+        of.write('\n'.join(lines).rstrip())
+    mdcrd = MDCrdFile(path)
+    assert mdcrd.shape == (4, 5, 3)
+    assert np.array_equal(mdcrd[::-1], coords[::-1])
+    assert np.array_equal(mdcrd[3], coords[3])
+    # empty trajectory
+    with open(path, 'w') as of:
+        of.write('default_name\n')
+    assert len(MDCrdFile(path, n_atom=5)) == 0
+
+
+def test_read_nc(tmp_path):
+    from Class_Traj import open_nc, read_nc, write_nc
+    path = str(tmp_path / 'test.nc')
+    coords = _get_coords(5, 7).astype(np.float32)
+    box = np.full((5, 3), 61.25)
+    write_nc(path, coords, box=box)
+    mm_coords = open_nc(path)
+    assert mm_coords.shape == (5, 7, 3)
+    assert not mm_coords.flags.writeable
+    assert np.array_equal(read_nc(path), coords)
+    # cpptraj style range (1-based, end included) and atom subset
+    assert np.array_equal(read_nc(path, start=2, end=4, step=2, atom_index=[6, 0]), coords[1:4:2][:, [6, 0]])
+    assert np.array_equal(read_nc(path, start=3), coords[2:])
+    # incomplete last frame of a running MD (header from the end of the writing)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(str(tmp_path / 'part.nc'), 'wb') as of:
+        of.write(data[:-80])
+    assert np.array_equal(read_nc(str(tmp_path / 'part.nc')), coords[:4])
+    # not a NetCDF classic file
+    write_mdcrd(str(tmp_path / 'test.mdcrd'), coords)
+    with pytest.raises(Exception, match='not a NetCDF classic file'):
+        read_nc(str(tmp_path / 'test.mdcrd'))
+    frames = Frame.fromNC(path, end=2)
+    assert len(frames) == 2
+    assert np.array_equal(frames[1].coord, coords[1])
+
+
+@pytest.mark.parametrize('ext', ['mdcrd', 'nc', 'npy'])
+def test_FrameSet(tmp_path, ext):
+    import pickle
+    from Class_ONIOM_Frame import FrameSet
+    from Class_Traj import write_nc
+    path = str(tmp_path / ('test.'+ext))
+    coords = _get_coords(7, 11)
+    if ext == 'nc':
+        coords = coords.astype(np.float32).astype(float)
+    if ext == 'mdcrd':
+        write_mdcrd(path, coords, box=np.full((7, 3), 50.0))
+    elif ext == 'nc':
+        write_nc(path, coords)
+    else:
+        np.save(path, coords)
+    frames = FrameSet(path, n_atom=11, window=3)
+    assert len(frames) == 7
+    assert np.array_equal(frames[4].coord, coords[4])
+    assert np.array_equal(frames[-1].coord, coords[-1])
+    # only the window of the frame is in memory
+    assert frames._window[0] == 6 and len(frames._window[1]) == 1
+    sub = frames[1::2]
+    assert len(sub) == 3
+    assert np.array_equal(np.array([frame.coord for frame in sub]), coords[1::2])
+    assert [len(chunk) for chunk in frames.iter_chunks()] == [3, 3, 1]
+    assert np.array_equal(np.concatenate(list(frames[[5, 0, 6]].iter_chunks(2))), coords[[5, 0, 6]])
+    with pytest.raises(IndexError):
+        frames[7]
+    # atom subset
+    solute = FrameSet(path, n_atom=11, atom_index=[0, 1, 2], window=3)
+    assert np.array_equal(solute[2].coord, coords[2, :3])
+    assert np.array_equal(pickle.loads(pickle.dumps(sub))[2].coord, coords[5])
+
+
+def test_atom_index(tmp_path):
+    from Class_ONIOM_Frame import FrameSet
+    from Class_Traj import get_atom_index
+    path = str(tmp_path / 'test.mdcrd')
+    coords = _get_coords(5, 13)
+    write_mdcrd(path, coords, box=np.full((5, 3), 50.0))
+    atom_index = get_atom_index([12, 2, 3, 2])
+    assert atom_index.tolist() == [1, 2, 11]
+    assert np.array_equal(read_mdcrd(path, n_atom=13, atom_index=atom_index), coords[:, atom_index])
+    # a stripped file read back with the atom ids of the full system
+    write_mdcrd(str(tmp_path / 'strip.mdcrd'), coords[:, atom_index])
+    frames = FrameSet(str(tmp_path / 'strip.mdcrd'), n_atom=3, expand_to=(13, atom_index))
+    assert np.array_equal(frames[4].coord[atom_index], coords[4, atom_index])
+    assert np.isnan(frames[4].coord[0]).all()
+
+
+def test_npy_store(tmp_path):
+    import json
+    from Class_ONIOM_Frame import FrameSet
+    from Class_Traj import convert_traj, read_box, read_npy_header, write_nc, write_npy
+    coords = _get_coords(6, 9)
+    box = np.full((6, 3), 50.0) + np.arange(6)[:, None]
+    nc_path = str(tmp_path / 'prod.nc')
+    write_nc(nc_path, coords, box=box)
+    assert np.array_equal(read_box(nc_path), box)
+
+    # nc -> npy (sampled and stripped) -> mdcrd -> npy
+    npy_path = convert_traj(nc_path, str(tmp_path / 'prod.npy'), frame_index=[1, 3, 5], atom_index=[0, 4, 8], window=2)
+    header = read_npy_header(npy_path)
+    assert header['n_frame'] == 3 and header['n_atom'] == 3
+    assert header['source'] == nc_path and header['frame_index'] == [1, 3, 5] and header['atom_index'] == [0, 4, 8]
+    assert np.array_equal(read_box(npy_path), box[[1, 3, 5]])
+    frames = FrameSet(npy_path)
+    assert isinstance(frames.traj, np.memmap)
+    assert np.allclose(frames[2].coord, coords[5, [0, 4, 8]], atol=1e-4)
+
+    mdcrd_path = convert_traj(npy_path, str(tmp_path / 'prod.mdcrd'))
+    assert np.array_equal(read_mdcrd(mdcrd_path, n_atom=3), coords[1::2][:, [0, 4, 8]])
+    assert np.array_equal(read_box(mdcrd_path, n_atom=3), box[[1, 3, 5]])
+    # index in the header refer to the original trajectory
+    npy2_path = convert_traj(npy_path, str(tmp_path / 'sub.npy'), frame_index=[2], atom_index=[1])
+    header = read_npy_header(npy2_path)
+    assert header['source'] == nc_path and header['frame_index'] == [5] and header['atom_index'] == [4]
+
+    write_npy(str(tmp_path / 'frames.npy'), coords)
+    with open(str(tmp_path / 'frames.json')) as f:
+        assert json.load(f)['n_atom'] == 9
+    convert_traj(str(tmp_path / 'frames.npy'), str(tmp_path / 'frames.mdcrd'))
+    assert np.array_equal(read_mdcrd(str(tmp_path / 'frames.mdcrd'), n_atom=9), coords)
@@ -0,0 +1,680 @@
+import copy
+import numpy as np
+import gc
+import os
+import sys
+import re
+import time
+import tracemalloc
+import pytest
+
+from Class_Structure import Structure, Chain
+from Class_line import PDB_columns
+from helper import line_feed
+
+bench_pdb = './test/testfile_Class_PDB/MD_test/FAcD_RA124M_ff.pdb'
+
+
+def _timeit(func, n=3):
+    '''
+    return the best wall time of n runs and the result of the last run
+    (gc is disabled during timing like timeit does)
+    '''
+    best = None
+    for i in range(n):
+        gc.collect()
+        gc.disable()
+        try:
+            t0 = time.perf_counter()
+            result = func()
+            dt = time.perf_counter() - t0
+        finally:
+            gc.enable()
+        if best is None or dt < best:
+            best = dt
+    return best, result
+
+
+def _dump_chains(chains):
+    return [(c.id, [(r.id, r.name, [(a.id, a.name, list(a.coord)) for a in r]) for r in c]) for c in chains]
+
+
+@pytest.mark.bench
+def test_bench_pdb_columns_reader():
+    '''
+    compare the columnar reader with the PDB_line path on a solvated Amber PDB
+    '''
+    with open(bench_pdb) as f:
+        file_str = f.read()
+
+    def pdb_line_path():
+        chains = []
+        for index, chain_str in enumerate(file_str.split(line_feed+'TER')):
+            if chain_str.strip() != 'END' and chain_str.strip() != '':
+                chain = Chain.fromPDB(chain_str, chr(65+index))
+                if len(chain):
+                    chains.append(chain)
+        return chains
+
+    def columns_path():
+        return Structure._get_raw_chains(PDB_columns.fromstr(file_str))
+
+    t_old, old_chains = _timeit(pdb_line_path)
+    t_new, new_chains = _timeit(columns_path)
+    print('PDB_line: {:.3f} s | PDB_columns: {:.3f} s | speedup: {:.2f}x'.format(t_old, t_new, t_old/t_new))
+
+    assert _dump_chains(new_chains) == _dump_chains(old_chains)
+
+
+def _get_tree_objs(stru):
+    '''
+    return all Chain/Residue/Atom level objects of a structure
+    '''
+    objs = []
+    for chain in stru.chains:
+        objs.append(chain)
+        for resi in chain:
+            objs.append(resi)
+            objs.extend(resi.atoms)
+    for resi in stru.ligands + stru.solvents:
+        objs.append(resi)
+        objs.extend(resi.atoms)
+    objs.extend(stru.metalatoms)
+    return objs
+
+
+class _DictObj:
+    pass
+
+
+def _dict_layout_copy(obj):
+    '''
+    copy the object to the dict-backed layout (the layout before __slots__)
+    '''
+    mirror = _DictObj()
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            try:
+                setattr(mirror, name, object.__getattribute__(obj, name))
+            except AttributeError:
+                continue
+    return mirror
+
+
+def _traced_size(func):
+    '''
+    return memory allocated and kept by func
+    '''
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+@pytest.mark.bench
+def test_bench_structure_memory():
+    '''
+    report bytes per atom of the Chain/Residue/Atom objects with __slots__ and with the old dict-backed layout.
+    Also report the total memory of Structure.fromPDB per atom.
+    '''
+    total, stru = _traced_size(lambda: Structure.fromPDB(bench_pdb))
+    n_atom = len(stru.coords)
+
+    objs = _get_tree_objs(stru)
+    assert not any(hasattr(obj, '__dict__') for obj in objs)
+    slots_size, slots_objs = _traced_size(lambda: [copy.copy(obj) for obj in objs])
+    dict_size, dict_objs = _traced_size(lambda: [_dict_layout_copy(obj) for obj in objs])
+    print('objects per atom: dict-backed {:.1f} B | __slots__ {:.1f} B | Structure.fromPDB total {:.1f} B'.format(
+        dict_size/n_atom, slots_size/n_atom, total/n_atom))
+
+    assert slots_size < dict_size
+
+
+@pytest.mark.bench
+def test_bench_spatial_index():
+    '''
+    compare radius queries with the cell list and with brute force distances
+    '''
+    stru = Structure.fromPDB(bench_pdb)
+    coords = stru.coords
+    # solvent shell: atoms within 5 A of any protein atom
+    centers = np.arange(len(stru.get_all_protein_atom()))
+
+    def brute_force():
+        result = np.zeros(len(coords), dtype=bool)
+        for i in centers:
+            result |= np.linalg.norm(coords - coords[i], axis=1) <= 5.0
+        return result
+
+    def cell_list():
+        stru._cell_list = None
+        return stru.get_atoms_within(centers, 5.0)
+
+    t_old, old_result = _timeit(brute_force, n=1)
+    t_new, new_result = _timeit(cell_list)
+    t_pair, pairs = _timeit(lambda: stru.get_close_pairs(3.0))
+    print('atoms within 5 A of the protein: brute force {:.3f} s | cell list (incl. build) {:.3f} s | speedup: {:.2f}x'.format(
+        t_old, t_new, t_old/t_new))
+    print('all pairs within 3 A: {:.3f} s ({} pairs)'.format(t_pair, len(pairs[0])))
+
+    assert np.array_equal(old_result, new_result)
+
+
+@pytest.mark.bench
+def test_bench_build(tmp_path):
+    '''
+    compare the batch writer of Structure.build with writing Atom.build lines one by one
+    '''
+    stru = Structure.fromPDB(bench_pdb)
+    old_path = str(tmp_path / 'old.pdb')
+    new_path = str(tmp_path / 'new.pdb')
+
+    def by_atom():
+        with open(old_path, 'w') as of:
+            a_id = 0
+            atoms = stru.get_atoms()
+            resi_index = stru.get_atom_resi_index()
+            c_id = chr(len(stru.chains)+64)
+            for chain in stru.chains:
+                for resi in chain:
+                    for atom in resi:
+                        a_id += 1
+                        of.write(atom.build(a_id=a_id, r_id=resi_index[a_id-1]+1))
+                of.write('TER'+line_feed)
+            for unit in stru.ligands + stru.metalatoms:
+                c_id = chr(ord(c_id)+1)
+                for atom in (unit if unit in stru.ligands else [unit]):
+                    a_id += 1
+                    of.write(atom.build(a_id=a_id, r_id=resi_index[a_id-1]+1, c_id=c_id))
+                of.write('TER'+line_feed)
+            c_id = chr(ord(c_id)+1)
+            for atom in atoms[a_id:]:
+                a_id += 1
+                of.write(atom.build(a_id=a_id, r_id=resi_index[a_id-1]+1, c_id=c_id))
+            of.write('TER'+line_feed)
+            of.write('END'+line_feed)
+
+    t_old, _ = _timeit(by_atom)
+    t_new, _ = _timeit(lambda: stru.build(new_path))
+    print('Atom.build per line: {:.3f} s | batch writer: {:.3f} s | speedup: {:.2f}x'.format(t_old, t_new, t_old/t_new))
+
+    with open(old_path) as f1, open(new_path) as f2:
+        assert f1.read() == f2.read()
+
+
+def _old_oniom_g16_coord(pdb_obj):
+    '''
+    the previous _get_oniom_g16_coord: str += per atom and list membership of the layer (uses atom.connect)
+    '''
+    coord = ''
+    for chain in pdb_obj.stru.chains:
+        for res in chain:
+            for atom in res:
+                if atom.id in pdb_obj.layer[0]:
+                    coord += atom.build_oniom('h', pdb_obj.chrg_list_all[atom.id-1])
+                else:
+                    cnt_info = None
+                    for cnt_atom in atom.connect:
+                        if cnt_atom.id in pdb_obj.layer[0]:
+                            cnt_info = ['H', cnt_atom.get_pseudo_H_type(atom), cnt_atom.id]
+                    coord += atom.build_oniom('l', pdb_obj.chrg_list_all[atom.id-1], cnt_info=cnt_info)
+    for lig in pdb_obj.stru.ligands:
+        for atom in lig:
+            layer = 'h' if atom.id in pdb_obj.layer[0] else 'l'
+            coord += atom.build_oniom(layer, pdb_obj.chrg_list_all[atom.id-1], if_lig=1)
+    for atom in pdb_obj.stru.metalatoms:
+        layer = 'h' if atom.id in pdb_obj.layer[0] else 'l'
+        coord += atom.build_oniom(layer, pdb_obj.chrg_list_all[atom.id-1])
+    for sol in pdb_obj.stru.solvents:
+        for atom in sol:
+            layer = 'h' if atom.id in pdb_obj.layer[0] else 'l'
+            coord += atom.build_oniom(layer, pdb_obj.chrg_list_all[atom.id-1], if_sol=1)
+    return coord
+
+
+def _get_big_stru(n_atom=50000):
+    '''
+    the bench pdb with extra (shifted) waters appended up to n_atom atoms. Atom ids are 1..n_atom
+    '''
+    stru = Structure.fromPDB(bench_pdb)
+    extra = stru.copy()
+    extra.coords[:] += 100.0
+    n_old = len(stru.coords)
+    sols = []
+    for sol in extra.solvents:
+        if n_old + sum(len(s) for s in sols) + len(sol) > n_atom:
+            break
+        sols.append(sol)
+    a_id = n_old
+    for i, sol in enumerate(sols):
+        sol.id = stru.solvents[-1].id + i + 1
+        for atom in sol:
+            a_id += 1
+            atom.id = a_id
+    stru.add(sols)
+    return stru
+
+
+@pytest.mark.bench
+def test_bench_oniom_g16_coord(tmp_path):
+    '''
+    compare the one-pass ONIOM coordinate writer with the per atom str += one on a ~50k atom system
+    '''
+    from Class_PDB import PDB
+    prepi_path = {'FAH': './test/testfile_Class_PDB/ligands/ligand_FAH.prepin'}
+    stru = _get_big_stru()
+    pdb_obj = PDB(bench_pdb, wk_dir=str(tmp_path))
+    pdb_obj.stru = stru
+    rng = np.random.default_rng(0)
+    pdb_obj.chrg_list_all = rng.uniform(-1, 1, len(stru.coords)).round(6).tolist()
+    # QM region: residue 100-130 and the ligand
+    high_ids = [atom.id for resi in stru.chains[0][99:130] for atom in resi] + [atom.id for atom in stru.ligands[0]]
+    pdb_obj.layer = [high_ids]
+    stru.get_connectivty_table(prepi_path=prepi_path)
+
+    t_old, old_coord = _timeit(lambda: _old_oniom_g16_coord(pdb_obj), n=1)
+    t_new, new_coord = _timeit(lambda: pdb_obj._get_oniom_g16_coord(prepi_path=prepi_path))
+    print('ONIOM coordinate section of {} atoms: per atom {:.3f} s | one pass {:.3f} s | speedup: {:.2f}x'.format(
+        len(stru.coords), t_old, t_new, t_old/t_new))
+    assert old_coord == new_coord
+    assert ' H- ' in new_coord
+
+
+# patterns of the regex mdcrd reader (reference)
+digit_pattern = r'[ ,\-,0-9][ ,\-,0-9][ ,\-,0-9][0-9]\.[0-9][0-9][0-9]'
+frame_sep_pattern = digit_pattern * 3 + line_feed
+
+
+def _old_read_mdcrd(mdcrd_file):
+    '''
+    the regex line reader of Frame.fromMDCrd before the fixed-width one (reference)
+    '''
+    coords = []
+    coord = []
+    atom_coord = []
+    counter = 1
+    end_flag_1 = 0
+    fake_end_flag = 0
+    #os.system('echo >> '+mdcrd_file)
+    debug_counter = 0
+
+    with open(mdcrd_file) as f:
+        while True:
+            # use the while True format to detect the EOF
+            line=f.readline()            
+
+            if re.match(digit_pattern, line) == None:
+                # not data line // could be faster here
+                if not end_flag_1 and not fake_end_flag:
+                    continue
+            
+            if fake_end_flag:
+                # if next line of fake end is the file end 
+                if line == '':
+                    break
+
+            if end_flag_1:
+                debug_counter += 1
+                if re.match(frame_sep_pattern, line) != None:
+                    # last line is a fake end line
+                    coord.append(holder)
+                    coords.append(coord)
+                    # empty for next loop
+                    coord = []
+                    end_flag_1 = 0
+                    fake_end_flag = 1
+                    continue
+                else:                        
+                    # last line is a real end line
+                    coords.append(coord)
+                    # empty for next loop
+                    coord = []
+                    end_flag_1 = 0
+                    if line == '':
+                        #the last line
+                        break
+                    if line == line_feed:
+                        if Config.debug >= 1:
+                            print("Frame.fromMDCrd: WARNING: unexpected empty line detected. Treat as EOF. exit reading")
+                        break
+                    # do not skip if normal next line
+
+            else:
+                if re.match(frame_sep_pattern, line) != None:
+                    # find line that mark the end of a frame // possible fake line
+                    # store the last frame and empty the holder
+                    end_flag_1 = 1 
+                    lp = re.split(' +', line.strip())
+                    # hold the info
+                    holder = [float(lp[0]), float(lp[1]), float(lp[2])]
+                    continue
+            
+
+            # normal data lines
+            lp = re.split(' +', line.strip())
+            for i in lp:
+                if counter < 3:
+                    atom_coord.append(float(i))
+                    counter = counter + 1
+                else:
+                    atom_coord.append(float(i))
+                    coord.append(atom_coord)
+                    # empty for next atom
+                    atom_coord = []        
+                    counter = 1
+    return coords
+
+
+@pytest.mark.bench
+def test_bench_mdcrd_reader(tmp_path):
+    '''
+    compare the fixed-width NumPy mdcrd reader with the regex line reader on 100 frames of 50k atoms
+    '''
+    from Class_Traj import read_mdcrd, write_mdcrd
+    n_frame, n_atom = 100, 50000
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(-99, 99, (n_frame, n_atom, 3)).round(3)
+    path = str(tmp_path / 'bench.mdcrd')
+    write_mdcrd(path, coords, box=np.full((n_frame, 3), 80.0))
+
+    t_old, old_coords = _timeit(lambda: _old_read_mdcrd(path), n=1)
+    t_new, new_coords = _timeit(lambda: read_mdcrd(path, n_atom=n_atom))
+    print('mdcrd of {} frames x {} atoms: regex {:.3f} s | fixed-width {:.3f} s | speedup: {:.2f}x'.format(
+        n_frame, n_atom, t_old, t_new, t_old/t_new))
+    assert new_coords.shape == (n_frame, n_atom, 3)
+    assert np.array_equal(np.array(old_coords), new_coords)
+    assert np.array_equal(new_coords, coords)
+
+
+@pytest.mark.bench
+def test_bench_frameset_memory(tmp_path):
+    '''
+    compare the peak memory of going through 100 frames x 50k atoms with a list of frames and a FrameSet
+    '''
+    from Class_ONIOM_Frame import Frame, FrameSet
+    from Class_Traj import write_mdcrd
+    n_frame, n_atom = 100, 50000
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / 'bench.mdcrd')
+    write_mdcrd(path, rng.uniform(-99, 99, (n_frame, n_atom, 3)).round(3))
+
+    def peak(func):
+        gc.collect()
+        tracemalloc.start()
+        result = func()
+        size = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return size, result
+    def center_sum(frames):
+        return sum(float(frame.coord[:100].sum()) for frame in frames)
+
+    m_list, s_list = peak(lambda: center_sum(Frame.fromMDCrd(path, n_atom=n_atom)))
+    m_set, s_set = peak(lambda: center_sum(FrameSet(path, n_atom=n_atom, window=10)))
+    print('peak memory of {} frames x {} atoms: list {:.1f} MB | FrameSet {:.1f} MB'.format(
+        n_frame, n_atom, m_list/1e6, m_set/1e6))
+    assert s_list == s_set
+    assert m_set < m_list / 5
+
+
+def _old_fromGaussinOut(g_out_file):
+    '''
+    the two pass line reader of Frame.fromGaussinOut before the reverse search (reference)
+    '''
+    coord = []
+    f_counter = 0
+    f_counter_2 = 0
+    coord_flag = 0
+    skip4 = 0
+    with open(g_out_file) as f:
+        for line in f:
+            if line.strip() == 'Input orientation:':
+                f_counter = f_counter + 1
+    with open(g_out_file) as f:
+        for line in f:
+            if line.strip() == 'Input orientation:':
+                f_counter_2 = f_counter_2 + 1
+                if f_counter_2 == f_counter:
+                    coord_flag = 1
+            if coord_flag:
+                if skip4 <= 4:
+                    skip4 = skip4 + 1
+                    continue
+                if line.strip() == '---------------------------------------------------------------------':
+                    coord_flag = 0
+                    break
+                lp = line.strip().split()
+                coord.append([float(lp[3]), float(lp[4]), float(lp[5])])
+    return coord
+
+
+@pytest.mark.bench
+def test_bench_gaussian_out(tmp_path):
+    '''
+    compare the reverse search of the last Input orientation with the two pass reader on a ~100 MB ONIOM optimization log
+    '''
+    from Class_ONIOM_Frame import Frame
+    from test_Class_ONIOM_Frame import _write_g_out
+    path = str(tmp_path / 'opt.out')
+    steps = np.random.default_rng(0).uniform(-50, 50, (100, 7000, 3)).round(6)
+    _write_g_out(path, steps)
+
+    t_old, old_coord = _timeit(lambda: _old_fromGaussinOut(path), n=1)
+    t_new, frame = _timeit(lambda: Frame.fromGaussinOut(path))
+    print('last geometry of a {:.0f} MB log: two pass {:.3f} s | reverse search {:.4f} s | speedup: {:.1f}x'.format(
+        os.path.getsize(path)/1e6, t_old, t_new, t_old/t_new))
+    assert np.array_equal(np.array(old_coord), frame.coord)
+
+
+def _old_write_to_template(coord, t_file_path, out_path, chk_path):
+    '''
+    the per line regex template writer of Frame.write_to_template before ONIOMTemplate (reference)
+    '''
+    ChrgSpin_pattern = r'(?: ?\-?\+?[0-9] [0-9])+'
+    with open(t_file_path) as f:
+        with open(out_path,'w') as of:
+            coord_b_flag = 0
+            coord_e_flag = 0
+            coord_index = 0
+            for line in f:
+                if re.search('chk_place_holder', line.strip()) != None:
+                    of.write(r'%chk='+chk_path + line_feed)
+                    continue
+                if re.match(ChrgSpin_pattern, line.strip()) != None:
+                    coord_b_flag = 1
+                    of.write(line)
+                    continue
+                if coord_b_flag:
+                    if line == line_feed:
+                        coord_e_flag = 1
+                if coord_b_flag and not coord_e_flag:
+                    lp = line.strip().split()
+                    line_coord = coord[coord_index]
+                    label = '{:<20}'.format(lp[0])
+                    freeze_mark = '{:<3}'.format(lp[1])
+                    x = '{:>15.8f}'.format(line_coord[0])
+                    y = '{:>15.8f}'.format(line_coord[1])
+                    z = '{:>15.8f}'.format(line_coord[2])
+                    layer_mark = lp[5]
+                    new_line = ' '+label+' '+freeze_mark+x+y+z+' '+layer_mark
+                    if len(lp) > 6:
+                        new_line = new_line + ' ' + lp[6] + ' ' + lp[7]
+                    new_line = new_line + line_feed
+                    of.write(new_line)
+                    coord_index = coord_index+1
+                    continue
+                of.write(line)
+    return out_path
+
+
+@pytest.mark.bench
+def test_bench_oniom_template(tmp_path):
+    '''
+    compare writing 20 frames of a 30k atom ONIOM template with the per line writer and the parsed template
+    '''
+    from Class_ONIOM_Frame import ONIOMTemplate
+    from test_Class_ONIOM_Frame import _write_oniom_template
+    n_frame, n_atom = 20, 30000
+    t_path = str(tmp_path / 'QMMM.gjf')
+    coords = _write_oniom_template(t_path, n_atom) + np.random.default_rng(1).normal(0, 0.5, (n_frame, n_atom, 3))
+
+    def old():
+        return [_old_write_to_template(coord, t_path, str(tmp_path / ('old_'+str(i)+'.gjf')), str(tmp_path / ('old_'+str(i)+'.chk')))
+                for i, coord in enumerate(coords)]
+    def new(n_proc=1):
+        ONIOMTemplate._cache.clear()
+        return ONIOMTemplate.fromPath(t_path).write_frames(coords, out_path=str(tmp_path / 'new.gjf'), n_proc=n_proc)[0]
+    t_old, old_paths = _timeit(old, n=1)
+    t_new, new_paths = _timeit(new)
+    t_par, par_paths = _timeit(lambda: new(n_proc=4), n=1)
+    print('{} frames of a {} atom ONIOM template: per line {:.3f} s | parsed template {:.3f} s | 4 processes {:.3f} s | speedup: {:.2f}x'.format(
+        n_frame, n_atom, t_old, t_new, t_par, t_old/t_new))
+    for old_path, new_path in zip(old_paths, new_paths):
+        with open(old_path) as f_old, open(new_path) as f_new:
+            assert f_old.read().replace(old_path[:-3]+'chk', '') == f_new.read().replace(new_path[:-3]+'chk', '')
+
+
+def _old_write_sele_lines(coord, sele_list, g_route, g_cores, g_mem_cores, out_path, chrgspin=None):
+    '''
+    the per key Frame.write_sele_lines before QMSelection (reference. ff='gjf', ifchk=0)
+    '''
+    def get_fix_val_coord(id1, id2, d):
+        for index, line in enumerate(coord):
+            if int(id1) == index + 1:
+                p1 = line
+                break
+        for index, line in enumerate(coord):
+            if int(id2) == index + 1:
+                p2 = line
+                break
+        p1 = np.array(p1)
+        p2 = np.array(p2)
+        v1 = (p2 - p1)/np.linalg.norm(p1 - p2)
+        return tuple(p1 + v1 * float(d))
+
+    sele_lines = []
+    for sele in sele_list.keys():
+        if '-' in sele:
+            fix_info = sele.split('-')
+            sele_lines.append((sele_list[sele], get_fix_val_coord(fix_info[0], fix_info[1], fix_info[2])))
+            continue
+        if sele[-1] not in '1234567890':
+            sele_id = sele[:-1]
+        else:
+            sele_id = sele
+        sele_lines.append((sele_list[sele], coord[int(sele_id)-1]))
+    with open(out_path, 'w') as of:
+        of.write(f'%mem={int(g_cores)*int(g_mem_cores)-1000}MB{line_feed}')
+        of.write(f'%nprocshared={g_cores}{line_feed}')
+        of.write(g_route+line_feed)
+        of.write(line_feed)
+        of.write('Title Card Required'+line_feed)
+        of.write(line_feed)
+        if chrgspin == None:
+            of.write('0 1'+line_feed)
+        else:
+            of.write(str(chrgspin[0])+' '+str(chrgspin[1])+line_feed)
+        for atom, line_coord in sele_lines:
+            label = '{:<5}'.format(atom)
+            x = '{:>15.8f}'.format(line_coord[0])
+            y = '{:>15.8f}'.format(line_coord[1])
+            z = '{:>15.8f}'.format(line_coord[2])
+            of.write(label+x+y+z+line_feed)
+        of.write(line_feed)
+    return out_path
+
+
+@pytest.mark.bench
+def test_bench_qm_cluster_gjf(tmp_path):
+    '''
+    compare writing QM cluster gjfs of 100 frames of a 10k atom system with the per key writer and the compiled selection
+    '''
+    from Class_ONIOM_Frame import QMSelection
+    from test_Class_ONIOM_Frame import _get_sele_list
+    n_frame, n_atom, shift = 100, 10000, 5000
+    coords = np.random.default_rng(0).uniform(-50, 50, (n_frame, n_atom, 3))
+    # ~300 atoms (with link atoms) in the middle of the coordinates
+    sele_list = {}
+    for key, ele in _get_sele_list(500, seed=1).items():
+        sele_list[re.sub('(?<![0-9.])[0-9]+(?=[b_-]|$)', lambda m: str(int(m.group(0))+shift), key)] = ele
+    kwargs = dict(g_route='# hf/3-21g', g_cores=8, g_mem_cores=2000, chrgspin=(0, 1))
+
+    def old():
+        return [_old_write_sele_lines(coord, sele_list, out_path=str(tmp_path / ('old_'+str(i)+'.gjf')), **kwargs)
+                for i, coord in enumerate(coords)]
+    def new():
+        return QMSelection(sele_list).write_frames(coords, str(tmp_path / 'new.gjf'), **kwargs)
+    t_old, old_paths = _timeit(old, n=1)
+    t_new, new_paths = _timeit(new)
+    print('{} frames of a {} line QM cluster: per key {:.3f} s | compiled selection {:.3f} s | speedup: {:.2f}x'.format(
+        n_frame, len(sele_list), t_old, t_new, t_old/t_new))
+    for old_path, new_path in zip(old_paths, new_paths):
+        with open(old_path) as f_old, open(new_path) as f_new:
+            assert f_old.read() == f_new.read()
+
+
+@pytest.mark.bench
+def test_bench_field_strength(tmp_path):
+    '''
+    compare the field strength of ~5k charges in 50 frames by the per charge loop and the broadcast engine
+    '''
+    from Class_PDB import PDB
+    from Class_ONIOM_Frame import Frame
+    from test_Class_Prmtop import _make_prmtop_from_stru
+    Structure.fromPDB('./test/testfile_Class_PDB/FAcD.pdb').subset(metalatoms=[]).build(str(tmp_path / 'ref.pdb'))
+    ref = Structure.fromPDB(str(tmp_path / 'ref.pdb'))
+    prmtop_path = str(tmp_path / 'ref.prmtop')
+    _make_prmtop_from_stru(ref, prmtop_path)
+    coords = ref.coords[np.argsort(ref.get_atom_column('atom_id'))]
+    n_frame = 50
+    pdb_obj = PDB(str(tmp_path / 'ref.pdb'), wk_dir=str(tmp_path))
+    pdb_obj.prmtop_path = prmtop_path
+    pdb_obj.frames = [Frame(coord) for coord in coords + np.random.default_rng(0).normal(0, 0.1, (n_frame,) + coords.shape)]
+    mask = '!:298'
+    pdb_obj.get_field_strength(mask, a1=2000, a2=2001) # build the structure once
+    t_old, E_old = _timeit(lambda: pdb_obj.get_field_strength(mask, a1=2000, a2=2001, engine='python'), n=1)
+    t_new, E_new = _timeit(lambda: pdb_obj.get_field_strength(mask, a1=2000, a2=2001))
+    print('field strength of {} charges in {} frames: per charge loop {:.3f} s | broadcast {:.3f} s | speedup: {:.2f}x'.format(
+        len(coords) - len(ref.ligands[0]), n_frame, t_old, t_new, t_old/t_new))
+    assert np.allclose(E_new, E_old, rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.bench
+def test_bench_field_strength_probes(tmp_path):
+    '''
+    compare 8 probes of ~5k charges in 200 frames of a mdcrd file by one get_field_strength call per probe and one get_field_strengths pass
+    '''
+    from Class_PDB import PDB
+    from Class_Traj import write_mdcrd
+    from test_Class_Prmtop import _make_prmtop_from_stru
+    Structure.fromPDB('./test/testfile_Class_PDB/FAcD.pdb').subset(metalatoms=[]).build(str(tmp_path / 'ref.pdb'))
+    ref = Structure.fromPDB(str(tmp_path / 'ref.pdb'))
+    prmtop_path = str(tmp_path / 'ref.prmtop')
+    _make_prmtop_from_stru(ref, prmtop_path)
+    coords = ref.coords[np.argsort(ref.get_atom_column('atom_id'))]
+    n_frame = 200
+    write_mdcrd(str(tmp_path / 'prod.mdcrd'), coords + np.random.default_rng(0).normal(0, 0.1, (n_frame,) + coords.shape))
+    pdb_obj = PDB(str(tmp_path / 'ref.pdb'), wk_dir=str(tmp_path))
+    pdb_obj.prmtop_path = prmtop_path
+    pdb_obj.mdcrd = str(tmp_path / 'prod.mdcrd')
+    mask = '!:298'
+    # bonds and points in the ligand (not in the charges)
+    lig_ids = [atom.id for atom in ref.ligands[0]]
+    probes = [dict(a1=lig_ids[i], a2=lig_ids[i+1]) for i in range(4)] + [dict(a1=lig_ids[i], a2=lig_ids[-1], bond_p1='a1') for i in range(4)]
+    pdb_obj.get_field_strength(mask, **probes[0]) # build the structure once
+
+    def old():
+        Es = []
+        for probe in probes:
+            pdb_obj.frames = None
+            Es.append(pdb_obj.get_field_strength(mask, **probe))
+        return np.array(Es).T
+    def new():
+        pdb_obj.frames = None
+        return pdb_obj.get_field_strengths(mask, probes)
+    t_old, E_old = _timeit(old)
+    t_new, E_new = _timeit(new)
+    print('{} probes of {} charges in {} frames: a call per probe {:.3f} s | one pass {:.3f} s | speedup: {:.2f}x'.format(
+        len(probes), len(coords) - len(ref.ligands[0]), n_frame, t_old, t_new, t_old/t_new))
+    assert np.allclose(E_new, E_old, rtol=1e-9, atol=1e-9)
@@ -11,4 +11,102 @@ def test_run_cmd_fail_case():
 @pytest.mark.accre
 def test_run_cmd_no_retry():
     cmd = 'squeue -u $USER'
-    assert len(helper.run_cmd(cmd).stdout) != 0
\ No newline at end of file
+    assert len(helper.run_cmd(cmd).stdout) != 0
+
+
+def test_array_cache_lru(tmp_path):
+    import os
+    import numpy as np
+    cache_dir = str(tmp_path)
+    big = {'a': np.zeros(200000)} # ~1.6 MB
+    for key in ('k1', 'k2', 'k3'):
+        helper.save_array_cache(cache_dir, key, big)
+    os.utime(cache_dir+'/k1.npz', (1, 1))
+    os.utime(cache_dir+'/k2.npz', (2, 2))
+    os.utime(cache_dir+'/k3.npz', (3, 3))
+    # use k1 so k2 is the least recently used one
+    assert helper.load_array_cache(cache_dir, 'k1')['a'].shape == (200000,)
+    helper.save_array_cache(cache_dir, 'k4', big, max_size=5)
+    assert sorted(os.listdir(cache_dir)) == ['k1.npz', 'k3.npz', 'k4.npz']
+    assert helper.load_array_cache(cache_dir, 'k2') is None
+    # truncated or foreign files are misses
+    with open(cache_dir+'/k3.npz', 'rb') as f:
+        data = f.read()
+    with open(cache_dir+'/k3.npz', 'wb') as of:
+        of.write(data[:len(data)//2])
+    assert helper.load_array_cache(cache_dir, 'k3') is None
+    with open(cache_dir+'/k5.npz', 'w') as of:
+        of.write('not an npz')
+    assert helper.load_array_cache(cache_dir, 'k5') is None
+
+
+def test_get_bond_components():
+    import numpy as np
+    bonds = np.array([[0, 1], [4, 3], [1, 2], [6, 5], [5, 3]])
+    mol_index = helper.get_bond_components(8, bonds)
+    assert mol_index.tolist() == [0, 0, 0, 1, 1, 1, 1, 2]
+    assert helper.get_bond_components(3, np.zeros((0, 2), dtype=int)).tolist() == [0, 1, 2]
+
+
+def test_bond_graph():
+    import numpy as np
+    # repeated edges are dropped and neighbors keep the given order
+    graph = helper.BondGraph(4, [[0, 2], [0, 1], [1, 0], [0, 2], [2, 0], [3, 2]])
+    assert graph.get_neighbors(0).tolist() == [2, 1]
+    assert graph.get_neighbor_lists() == [[2, 1], [0], [0], [2]]
+    assert graph.get_degree().tolist() == [2, 1, 1, 1]
+    assert graph.get_pairs().tolist() == [[0, 2], [0, 1]]
+    graph = helper.BondGraph.fromBonds(5, np.array([[0, 1], [1, 2], [3, 2]]))
+    assert graph.get_neighbor_lists() == [[1], [0, 2], [1, 3], [2], []]
+    src, dst = graph.get_boundary(np.array([1, 1, 0, 0, 1], dtype=bool))
+    assert list(zip(src.tolist(), dst.tolist())) == [(1, 2)]
+    assert helper.BondGraph.fromBonds(3, []).get_pairs().shape == (0, 2)
+
+
+def test_get_index_ranges():
+    from helper import get_index_ranges
+    assert get_index_ranges([1, 2, 3, 5, 7, 8]) == '1-3,5,7-8'
+    assert get_index_ranges([4]) == '4'
+    assert get_index_ranges([]) == ''
+
+
+def test_iter_in_background():
+    assert list(helper.iter_in_background(iter(range(50)), buffer=3)) == list(range(50))
+    def bad_iter():
+        yield 1
+        raise ValueError('bad item')
+    items = helper.iter_in_background(bad_iter())
+    assert next(items) == 1
+    with pytest.raises(ValueError, match='bad item'):
+        next(items)
+
+
+def test_get_field_strength_values():
+    import numpy as np
+    rng = np.random.default_rng(0)
+    p0 = rng.uniform(-20, 20, (4, 30, 3))
+    c0 = rng.uniform(-1, 1, 30)
+    p1 = rng.uniform(-5, 5, (4, 3))
+    d1 = rng.normal(0, 1, (4, 3))
+    E = helper.get_field_strength_values(p0, c0, p1, d1)
+    assert E.shape == (4, 30)
+    for i in range(4):
+        assert np.allclose(E[i], [helper.get_field_strength_value(p, c, p1[i], d1=list(d1[i])) for p, c in zip(p0[i], c0)])
+    # broadcast over probes
+    assert helper.get_field_strength_values(p0[:, np.newaxis], c0, p1[np.newaxis], d1[np.newaxis]).shape == (4, 4, 30)
+
+
+def test_cell_list_far_point():
+    import numpy as np
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0, 20, (300, 3))
+    # an unplaced atom far away does not grow the index
+    coords[7] = (1e7, -1e7, 1e7)
+    cells = helper.CellList(coords, cell_size=4.0)
+    assert len(cells.cell_start) <= len(coords) + 1
+    i, j, d = cells.query_pairs(3.0)
+    dist = np.linalg.norm(coords[:, None] - coords[None], axis=-1)
+    assert set(zip(i.tolist(), j.tolist())) == set(zip(*[x.tolist() for x in np.nonzero(np.triu(dist <= 3.0, 1))]))
+    q, p, d = cells.query_ball(coords[:5], 4.5)
+    assert set(zip(q.tolist(), p.tolist())) == set(zip(*[x.tolist() for x in np.nonzero(dist[:5] <= 4.5)]))
+    assert cells.query_ball([[1e7, -1e7, 1e7]], 1.0)[1].tolist() == [7]